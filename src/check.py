@@ -0,0 +1,308 @@
+#!/usr/bin/env python
+# Checks the main libmpsse paths against the built in chip simulator, so they can be tested without hardware.
+# Run by 'make check' after building the Python module; exits non-zero if any check fails.
+
+import sys
+import pylibmpsse as _mpsse
+from mpsse import *
+from mpsseflash import SPIFlash
+
+JEDEC_ID = "\xEF\x40\x14"			# JEDEC ID of the simulated SPI flash chip
+EEPROM_WRITE = "\xA0"				# Write address of the simulated I2C EEPROM (slave address 0x50)
+EEPROM_READ = "\xA1"				# Read address of the simulated I2C EEPROM
+ABSENT_WRITE = "\xA4"				# Write address of a slave that isn't on the bus (0x52)
+IDCODES = [0x06413041, 0x4BA00477]		# IDCODEs of the simulated JTAG chain, nearest TDO first
+
+failures = 0
+
+def check(name, ok):
+	global failures
+
+	if ok:
+		print "PASS: %s" % name
+	else:
+		print "FAIL: %s" % name
+		failures += 1
+
+def check_flash():
+	spi = MPSSE()
+	spi.Simulate(SPI0, ONE_MHZ)
+	flash = SPIFlash(spi)
+
+	check("flash JEDEC ID", flash.ChipID() == JEDEC_ID)
+
+	data = "".join([chr(i & 0xFF) for i in range(0, 300)])
+	flash.EraseSector(0x1000)
+	check("flash erase", flash.Read(len(data), 0x1000) == ("\xFF" * len(data)))
+
+	# 300 bytes at an unaligned address crosses two page boundaries
+	flash.Write(data, 0x1010)
+	check("flash program / read", flash.Read(len(data), 0x1010) == data)
+
+	# Same ID read, queued and sent in a single USB write
+	with spi.Batch():
+		spi.Start()
+		spi.Write("\x9F")
+		chipid = spi.Read(3)
+		spi.Stop()
+	check("batch flush", chipid.data == JEDEC_ID)
+
+	# Transfers larger than the transfer size are split into pipelined chunks
+	data = "".join([chr((i * 7) & 0xFF) for i in range(0, 2000)])
+	flash.EraseSector(0x2000)
+	flash.Write(data, 0x2000)
+	spi.Start()
+	rdata = spi.Transfer(SPIFlash.READ + "\x00\x20\x00" + ("\x00" * len(data)))
+	spi.Stop()
+	check("pipelined transfer", rdata[4:] == data)
+
+	spi.Start()
+	spi.Write(SPIFlash.READ + "\x00\x20\x00")
+	rdata = spi.Read(len(data))
+	spi.Stop()
+	check("pipelined read", rdata == data)
+
+	spi.Close()
+
+def check_eeprom():
+	i2c = MPSSE()
+	i2c.Simulate(I2C, FOUR_HUNDRED_KHZ)
+
+	data = "libmpsse"
+
+	i2c.Start()
+	i2c.Write(EEPROM_WRITE + "\x01\x00" + data)
+	i2c.Stop()
+	check("eeprom write ACKed", i2c.GetAcks() == [ACK] * (len(data) + 3))
+
+	i2c.Start()
+	i2c.Write(EEPROM_WRITE + "\x01\x00")
+	i2c.Start()
+	i2c.Write(EEPROM_READ)
+	readback = i2c.Read(len(data))
+	i2c.SendNacks()
+	i2c.Read(1)
+	i2c.Stop()
+	check("eeprom readback", readback == data)
+
+	i2c.Start()
+	i2c.Write(ABSENT_WRITE + "\x00")
+	i2c.Stop()
+	check("absent slave NACKed", i2c.GetAcks()[0] == NACK)
+
+	i2c.Close()
+
+def check_jtag():
+	jtag = MPSSE()
+	jtag.Simulate(JTAG, ONE_MHZ)
+	check("JTAG scan chain", jtag.JTAGScanChain() == IDCODES)
+	jtag.Close()
+
+def check_wait():
+	spi = MPSSE()
+	spi.Simulate(SPI0, ONE_MHZ)
+
+	# GPIOL0 is looped back to GPIOL1 in the simulator, so GPIOL1 never goes high
+	spi.PinLow(GPIOL0)
+	try:
+		spi.WaitRead(HIGH, 3, 50)
+		check("WaitRead timeout", False)
+	except Exception, e:
+		check("WaitRead timeout", "Timed out" in str(e))
+
+	spi.Close()
+
+def check_bitstream():
+	spi = MPSSE()
+	spi.Simulate(SPI0, ONE_MHZ)
+
+	spi.Start()
+	spi.WriteBitstream("\x9F")
+	bits = spi.ReadBitstream(20)
+	spi.Stop()
+	check("read bitstream", bits == "\xEF\x40\x10")
+
+	spi.Start()
+	bits = spi.TransferBitstream("\x9F\x00\x00\x00", 28)
+	spi.Stop()
+	check("transfer bitstream", bits == "\xFF\xEF\x40\x10")
+
+	spi.Close()
+
+def check_clock():
+	spi = MPSSE()
+	spi.Simulate(SPI0, ONE_MHZ)
+
+	plan = spi.PlanClock(7000000)
+	check("clock plan", plan['frequency'] == 6000000 and plan['faster'] == 7500000 and not plan['three_phase'])
+
+	spi.SetClock(7000000)
+	check("set clock rounds down", spi.GetClock() == 6000000)
+
+	spi.Close()
+
+	i2c = MPSSE()
+	i2c.Simulate(I2C, FOUR_HUNDRED_KHZ)
+	check("I2C clock", i2c.GetClock() == FOUR_HUNDRED_KHZ)
+
+	plan = i2c.PlanClock(FOUR_HUNDRED_KHZ)
+	check("I2C clock plan", plan['frequency'] == FOUR_HUNDRED_KHZ and plan['three_phase'])
+
+	# A plan made for I2C (three phase clocking) can't be applied in SPI mode
+	stale = _mpsse.mpsse_clock_plan()
+	_mpsse.PlanClock(i2c.context, FOUR_HUNDRED_KHZ, 0, stale)
+	i2c.SwitchMode(SPI0, ONE_MHZ)
+	check("stale clock plan rejected", _mpsse.SetClockPlan(i2c.context, stale) == MPSSE_FAIL)
+
+	i2c.Close()
+
+def check_stats():
+	spi = MPSSE()
+	spi.Simulate(SPI0, ONE_MHZ)
+
+	trace = []
+	spi.SetTrace(lambda direction, data, timestamp: trace.append((direction, data)))
+	spi.ResetStats()
+
+	spi.Start()
+	spi.Write("\x9F")
+	spi.Read(3)
+	spi.Stop()
+	spi.SetTrace(None)
+
+	stats = spi.GetStats()
+	check("stats", stats['reads'] == 1 and stats['bytes_in'] == len(JEDEC_ID))
+	check("trace", (TRACE_READ, JEDEC_ID) in trace and TRACE_WRITE in [direction for (direction, data) in trace])
+
+	spi.Close()
+
+def check_i2c_registers():
+	i2c = MPSSE()
+	i2c.Simulate(I2C, FOUR_HUNDRED_KHZ)
+
+	check("I2C register write", i2c.I2CWriteReg(0x50, "\x02\x00", "hello") == ACK)
+	check("I2C register read", i2c.I2CReadReg(0x50, "\x02\x00", 5) == ("hello", ACK))
+	check("I2C read many", i2c.I2CReadMany([(0x50, "\x02\x00", 2), (0x50, "\x02\x03", 2)]) == [("he", ACK), ("lo", ACK)])
+	check("I2C absent register read", i2c.I2CReadReg(0x52, "\x00", 2)[1] == NACK)
+	check("I2C absent register write", i2c.I2CWriteReg(0x52, "\x00", "x") == NACK)
+
+	i2c.Close()
+
+def read_id(spi, command):
+	spi.Start()
+	spi.Write(command)
+	data = spi.Read(3)
+	spi.Stop()
+	return data
+
+def check_program():
+	spi = MPSSE()
+	spi.Simulate(SPI0, ONE_MHZ)
+
+	program = spi.Compile(read_id, [1], "read_id")
+	check("program execute", spi.Execute("read_id", "\x9F") == JEDEC_ID)
+
+	# The same program, saved and replayed with a different command byte
+	replay = Program.Loads(program.Dumps())
+	check("program replay", spi.Execute(replay, "\x9F") == JEDEC_ID)
+	check("program parameters", spi.Execute(replay, "\x00") != JEDEC_ID)
+
+	spi.Close()
+
+def check_pool():
+	pool = MPSSEPool(simulate=True)
+
+	spi = pool.Get(mode=SPI0, frequency=ONE_MHZ)
+	check("pool get", read_id(spi, "\x9F") == JEDEC_ID)
+	pool.Put(spi)
+
+	with pool.Connection(mode=SPI0, frequency=ONE_MHZ) as spi:
+		check("pool connection", read_id(spi, "\x9F") == JEDEC_ID)
+
+	pool.Close()
+
+def check_waveform():
+	bb = MPSSE()
+	bb.Simulate(BITBANG, ONE_MHZ)
+
+	# GPIOL0 (0x10) is looped back to GPIOL1 (0x20); the other inputs are pulled high
+	bb.SetDirection(0x10)
+	samples = bb.Waveform("\x10\x00\x10\x10\x00", 100000, True)
+	check("waveform capture", list(samples) == [0xCF, 0xFF, 0xCF, 0xFF, 0xFF])
+
+	try:
+		with bb.Batch():
+			bb.Waveform("\x10\x00")
+		check("waveform refused while batching", False)
+	except Exception, e:
+		check("waveform refused while batching", "batching" in str(e))
+
+	bb.Close()
+
+def check_sample():
+	spi = MPSSE()
+	spi.Simulate(SPI0, ONE_MHZ)
+
+	spi.PinHigh(GPIOL0)
+	(samples, timestamps) = spi.SamplePins(4)
+	check("sample pins", len(samples) == 4 and all([sample & 0x10 for sample in samples]))
+
+	(samples, timestamps) = spi.SamplePins(4, 8)
+	check("sample pins timestamps", len(timestamps) == 4 and timestamps[1] > 0)
+
+	try:
+		with spi.Batch():
+			spi.ReadPins()
+		check("read pins refused while batching", False)
+	except Exception, e:
+		check("read pins refused while batching", "batching" in str(e))
+
+	spi.Close()
+
+	# Sampling clocks TCK, so the TAP state tracker has to follow along
+	jtag = MPSSE()
+	jtag.Simulate(JTAG, ONE_MHZ)
+	jtag.JTAGReset()
+	jtag.JTAGSetState(TAP_DRSELECT)
+	jtag.SamplePins(2, 1)
+	check("sample pins TAP state", jtag.JTAGGetState() == TAP_DRCAPTURE)
+	check("JTAG scan chain after sampling", jtag.JTAGScanChain() == IDCODES)
+	jtag.Close()
+
+def check_errors():
+	spi = MPSSE()
+	spi.Simulate(SPI0, ONE_MHZ)
+
+	# A batch with no reads can only report a failed write from FlushBatch
+	spi.SimulateWriteErrors(1)
+	try:
+		with spi.Batch():
+			spi.Start()
+			spi.Write("\x06")
+			spi.Stop()
+		check("write only batch failure", False)
+	except Exception, e:
+		check("write only batch failure", True)
+
+	spi.SimulateWriteErrors(1)
+	try:
+		spi.SwitchMode(I2C, FOUR_HUNDRED_KHZ)
+		check("failed mode switch", False)
+	except Exception, e:
+		check("failed mode switch", spi.context.mode == SPI0 and read_id(spi, "\x9F") == JEDEC_ID)
+
+	spi.Close()
+
+if __name__ == "__main__":
+	for test in [check_flash, check_eeprom, check_jtag, check_wait, check_bitstream, check_clock, check_stats,
+		     check_i2c_registers, check_program, check_pool, check_waveform, check_sample, check_errors]:
+		try:
+			test()
+		except Exception, e:
+			check("%s: %s" % (test.__name__, e), False)
+
+	if failures:
+		print "%d check(s) failed" % failures
+		sys.exit(1)
+
+	print "All checks passed"
@@ -0,0 +1,301 @@
+#!/usr/bin/env python
+
+from mpsse import *
+from time import time
+
+class Benchmark(object):
+
+	SPI_MODES = [("SPI0", SPI0), ("SPI1", SPI1), ("SPI2", SPI2), ("SPI3", SPI3)]
+	SIZES = [1, 16, 256, 4096, 65536]	# Transfer sizes to time Write/Read/Transfer/FastWrite/FastRead with, in bytes
+	PERCENTILES = [50, 90, 99]		# Latency percentiles to report
+	I2C_ADDRESS = "\xA0"			# Write address of the I2C EEPROM used by the I2C tests (and the simulator)
+	TESTS = ["spi", "fast", "i2c", "gpio", "clock"]
+
+	def __init__(self, iterations=100, frequency=ONE_MHZ, simulate=False, latency=0, flush=False):
+		self.iterations = iterations
+		self.flush = flush
+		self.frequency = frequency
+		self.simulate = simulate
+		self.latency = latency
+		self.results = []
+		self.chip = None
+		self.version = None
+
+	def _open(self, mode):
+		if self.simulate:
+			dev = MPSSE()
+			dev.Simulate(mode, self.frequency, MSB, self.latency)
+		else:
+			dev = MPSSE(mode, self.frequency, MSB)
+
+		dev.FlushAfterRead(int(self.flush))
+
+		if self.chip is None:
+			self.chip = dev.GetDescription()
+			self.version = dev.Version()
+
+		return dev
+
+	def _percentile(self, times, p):
+		return times[int(round((p / 100.0) * (len(times) - 1)))]
+
+	def _measure(self, dev, test, mode, size, func, iterations=None):
+		"""
+		Times iterations calls to func and records the per-call latency, throughput, USB I/O counters and buffer allocations.
+		"""
+		times = []
+
+		if iterations is None:
+			iterations = self.iterations
+
+		# One untimed call so that buffers have grown to their high water mark before measurements start
+		func()
+
+		dev.ResetStats()
+		allocations = dev.GetAllocations()
+
+		for i in range(0, iterations):
+			start = time()
+			func()
+			times.append(time() - start)
+
+		stats = dev.GetStats()
+		allocations = dev.GetAllocations() - allocations
+
+		total = sum(times)
+		times.sort()
+
+		result = {
+			"test"			: test,
+			"mode"			: mode,
+			"size"			: size,
+			"iterations"		: iterations,
+			"mean_us"		: (total / iterations) * 1000000,
+			"max_us"		: times[-1] * 1000000,
+			"bytes_per_sec"		: (size * iterations) / total if total > 0 else 0,
+			"transactions_per_call"	: float(stats["writes"] + stats["reads"]) / iterations,
+			"read_wait_us"		: float(stats["read_usecs"]) / iterations,
+			"short_reads"		: stats["short_reads"],
+			"purges"		: stats["purges"],
+			"allocations"		: allocations,
+		}
+
+		for p in self.PERCENTILES:
+			result["p%d_us" % p] = self._percentile(times, p) * 1000000
+
+		self.results.append(result)
+		return result
+
+	def _iterations(self, size):
+		# Don't spend minutes shifting 64KB blocks through a slow clock
+		return max(1, min(self.iterations, (self.iterations * 256) / size))
+
+	def SPI(self):
+		for (name, mode) in self.SPI_MODES:
+			dev = self._open(mode)
+
+			for size in self.SIZES:
+				data = "\x00" * size
+				n = self._iterations(size)
+
+				def write():
+					dev.Start()
+					dev.Write(data)
+					dev.Stop()
+
+				def read():
+					dev.Start()
+					dev.Read(size)
+					dev.Stop()
+
+				def transfer():
+					dev.Start()
+					dev.Transfer(data)
+					dev.Stop()
+
+				self._measure(dev, "Write", name, size, write, n)
+				self._measure(dev, "Read", name, size, read, n)
+				self._measure(dev, "Transfer", name, size, transfer, n)
+
+			dev.Close()
+
+	def Fast(self):
+		dev = self._open(SPI0)
+		buf = bytearray(max(self.SIZES))
+
+		for size in self.SIZES:
+			data = "\x00" * size
+			n = self._iterations(size)
+
+			def fast_write():
+				dev.Start()
+				dev.FastWrite(data)
+				dev.Stop()
+
+			def fast_read():
+				dev.Start()
+				dev.FastReadInto(buf, 0, size)
+				dev.Stop()
+
+			self._measure(dev, "FastWrite", "SPI0", size, fast_write, n)
+			self._measure(dev, "FastRead", "SPI0", size, fast_read, n)
+
+		dev.Close()
+
+	def I2C(self):
+		dev = self._open(I2C)
+
+		def write_byte():
+			dev.Start()
+			dev.Write(self.I2C_ADDRESS)
+			dev.Stop()
+
+		def read_byte():
+			dev.Start()
+			dev.Write(self.I2C_ADDRESS)
+			dev.Start()
+			dev.Write(chr(ord(self.I2C_ADDRESS) | 1))
+			dev.SendNacks()
+			dev.Read(1)
+			dev.SendAcks()
+			dev.Stop()
+
+		self._measure(dev, "Write", "I2C", 1, write_byte)
+		self._measure(dev, "Read", "I2C", 1, read_byte)
+
+		dev.Close()
+
+	def GPIO(self):
+		dev = self._open(GPIO)
+
+		def toggle():
+			dev.PinHigh(GPIOL0)
+			dev.PinLow(GPIOL0)
+
+		self._measure(dev, "PinToggle", "GPIO", 0, toggle)
+
+		dev.Close()
+
+	def Clock(self):
+		dev = self._open(SPI0)
+		freqs = [ONE_MHZ, TWO_MHZ]
+		state = [0]
+
+		def set_clock():
+			state[0] ^= 1
+			dev.SetClock(freqs[state[0]])
+
+		self._measure(dev, "SetClock", "SPI0", 0, set_clock)
+
+		dev.Close()
+
+	def Run(self, tests=TESTS):
+		for test in tests:
+			{
+				"spi"	: self.SPI,
+				"fast"	: self.Fast,
+				"i2c"	: self.I2C,
+				"gpio"	: self.GPIO,
+				"clock"	: self.Clock,
+			}[test]()
+
+		return self.results
+
+	def Report(self):
+		print "%-10s %-5s %7s %6s %12s %10s %10s %10s %10s %8s %6s" % ("Test", "Mode", "Size", "Calls", "Bytes/s", "Mean(us)", "p50(us)", "p90(us)", "p99(us)", "USB/call", "Mallocs")
+
+		for r in self.results:
+			print "%-10s %-5s %7d %6d %12.0f %10.1f %10.1f %10.1f %10.1f %8.2f %6d" % (r["test"], r["mode"], r["size"], r["iterations"], r["bytes_per_sec"],
+												  r["mean_us"], r["p50_us"], r["p90_us"], r["p99_us"],
+												  r["transactions_per_call"], r["allocations"])
+
+	def JSON(self):
+		import json
+
+		return json.dumps({
+				"version"	: self.version,
+				"chip"		: self.chip,
+				"simulated"	: self.simulate,
+				"latency_us"	: self.latency,
+				"flush"		: self.flush,
+				"frequency"	: self.frequency,
+				"timestamp"	: int(time()),
+				"results"	: self.results,
+		}, indent=4, sort_keys=True)
+
+
+if __name__ == "__main__":
+
+	import sys
+	from getopt import getopt as GetOpt, GetoptError
+
+	def usage():
+		print ""
+		print "Usage: %s [OPTIONS]" % sys.argv[0]
+		print ""
+		print "\t-t, --tests=<list>     Comma separated list of tests to run [%s]" % ",".join(Benchmark.TESTS)
+		print "\t-n, --iterations=<int> Number of timed calls per test [100]"
+		print "\t-f, --frequency=<int>  Set the clock frequency, in hertz [1,000,000]"
+		print "\t-s, --simulate         Benchmark the simulated FTDI chip instead of real hardware"
+		print "\t-l, --latency=<int>    Simulated USB latency, in microseconds [0]"
+		print "\t-r, --flush          Enable FlushAfterRead, to measure what it costs"
+		print "\t-j, --json=<file>      Save the results to file as JSON ('-' for stdout)"
+		print "\t-h, --help             Show help"
+		print ""
+
+		sys.exit(1)
+
+	def main():
+		tests = Benchmark.TESTS
+		iterations = 100
+		freq = ONE_MHZ
+		simulate = False
+		latency = 0
+		flush = False
+		fname = None
+
+		try:
+			opts, args = GetOpt(sys.argv[1:], "t:n:f:l:j:srh", ["tests=", "iterations=", "frequency=", "latency=", "json=", "simulate", "flush", "help"])
+		except GetoptError, e:
+			print e
+			usage()
+
+		for opt, arg in opts:
+			if opt in ('-t', '--tests'):
+				tests = arg.split(',')
+			elif opt in ('-n', '--iterations'):
+				iterations = int(arg)
+			elif opt in ('-f', '--frequency'):
+				freq = int(arg)
+			elif opt in ('-l', '--latency'):
+				latency = int(arg)
+			elif opt in ('-j', '--json'):
+				fname = arg
+			elif opt in ('-s', '--simulate'):
+				simulate = True
+			elif opt in ('-r', '--flush'):
+				flush = True
+			elif opt in ('-h', '--help'):
+				usage()
+
+		for test in tests:
+			if test not in Benchmark.TESTS:
+				print "Unknown test: %s" % test
+				usage()
+
+		bench = Benchmark(iterations, freq, simulate, latency, flush)
+		bench.Run(tests)
+
+		if fname == '-':
+			print bench.JSON()
+		else:
+			print "%s benchmarked at %d hertz" % (bench.chip, freq)
+			print ""
+			bench.Report()
+
+			if fname is not None:
+				open(fname, 'w').write(bench.JSON() + "\n")
+				print ""
+				print "Results saved to %s." % fname
+
+	main()
@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+
+from mpsse import *
+from mpsseflash import SPIFlash, Dump
+from time import time
+
+INTERFACES = {"A" : IFACE_A, "B" : IFACE_B, "C" : IFACE_C, "D" : IFACE_D}
+
+if __name__ == "__main__":
+
+	import sys
+	from getopt import getopt as GetOpt, GetoptError
+
+	def usage():
+		print ""
+		print "Usage: %s [OPTIONS]" % sys.argv[0]
+		print ""
+		print "\t-o, --output=<file>       Dump data from the chip(s) to file"
+		print "\t-s, --size=<int>          Set the number of bytes to dump"
+		print "\t-a, --address=<int>       Set the starting address [0]"
+		print "\t-f, --frequency=<int>     Set the SPI clock frequency, in hertz [30,000,000]"
+		print "\t-w, --window=<int>        Set the number of bytes read between progress updates [262144]"
+		print "\t-i, --interfaces=<list>   Comma separated list of FTDI interfaces to read from in parallel [A]"
+		print "\t-n, --serials=<list>      Comma separated list of FTDI serial numbers to read from in parallel"
+		print "\t-V, --vid=<int>           FTDI USB vendor ID [0x0403]"
+		print "\t-P, --pid=<int>           FTDI USB product ID [0x6010]"
+		print "\t-S, --simulate=<int>      Read from this many simulated chips instead of real hardware"
+		print "\t-h, --help                Show help"
+		print ""
+		print "All chips must contain identical data; the address range is split between them."
+		print ""
+
+		sys.exit(1)
+
+	def progress(done, total):
+		sys.stdout.write("\rDumping...%d%%" % ((done * 100) / total))
+		sys.stdout.flush()
+
+	def main():
+		fname = None
+		size = 0
+		address = 0
+		freq = THIRTY_MHZ
+		window = SPIFlash.WINDOW
+		interfaces = ["A"]
+		serials = [None]
+		vid = 0x0403
+		pid = 0x6010
+		simulate = 0
+		flashes = []
+
+		try:
+			opts, args = GetOpt(sys.argv[1:], "o:s:a:f:w:i:n:V:P:S:h", ["output=", "size=", "address=", "frequency=", "window=", "interfaces=", "serials=", "vid=", "pid=", "simulate=", "help"])
+		except GetoptError, e:
+			print e
+			usage()
+
+		for opt, arg in opts:
+			if opt in ('-o', '--output'):
+				fname = arg
+			elif opt in ('-s', '--size'):
+				size = int(arg, 0)
+			elif opt in ('-a', '--address'):
+				address = int(arg, 0)
+			elif opt in ('-f', '--frequency'):
+				freq = int(arg)
+			elif opt in ('-w', '--window'):
+				window = int(arg, 0)
+			elif opt in ('-i', '--interfaces'):
+				interfaces = arg.upper().split(',')
+			elif opt in ('-n', '--serials'):
+				serials = arg.split(',')
+			elif opt in ('-V', '--vid'):
+				vid = int(arg, 0)
+			elif opt in ('-P', '--pid'):
+				pid = int(arg, 0)
+			elif opt in ('-S', '--simulate'):
+				simulate = int(arg)
+			elif opt in ('-h', '--help'):
+				usage()
+
+		if fname is None or not size:
+			print "Please specify an output file and dump size!"
+			usage()
+
+		if simulate:
+			for i in range(0, simulate):
+				dev = MPSSE()
+				dev.Simulate(SPI0, freq, MSB)
+				flashes.append(SPIFlash(dev))
+		else:
+			for serial in serials:
+				for iface in interfaces:
+					if iface not in INTERFACES:
+						print "Unknown interface: %s" % iface
+						usage()
+
+					dev = MPSSE()
+					dev.Open(vid, pid, SPI0, freq, MSB, INTERFACES[iface], None, serial)
+					flashes.append(SPIFlash(dev))
+
+		print "Reading %d bytes starting at address 0x%X from %d chip(s) at %d hertz" % (size, address, len(flashes), flashes[0].speed)
+
+		start = time()
+		Dump(flashes, fname, size, address, window, progress)
+		elapsed = time() - start
+
+		print "\rDumping...done (%d bytes/s), saved to %s." % (size / elapsed, fname)
+
+		for flash in flashes:
+			flash.Close()
+
+	main()
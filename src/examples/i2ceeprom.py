@@ -3,8 +3,8 @@
 from mpsse import *
 
 SIZE = 0x8000		# Size of EEPROM chip (32 KB)
-WCMD = "\xA0\x00\x00"	# Write start address command
-RCMD = "\xA1"		# Read command
+ADDR = 0x50		# EEPROM slave address
+START = "\x00\x00"	# Start address to read from
 FOUT = "eeprom.bin"	# Output file
 
 try:
@@ -12,24 +12,10 @@ try:
 
 	print "%s initialized at %dHz (I2C)" % (eeprom.GetDescription(), eeprom.GetClock())
 
-	eeprom.Start()
-	eeprom.Write(WCMD)
-
-	if eeprom.GetAck() == ACK:
-
-		eeprom.Start()
-		eeprom.Write(RCMD)
-	
-		if eeprom.GetAck() == ACK:
-			data = eeprom.Read(SIZE)
-			eeprom.SendNacks()
-			eeprom.Read(1)
-		else:
-			raise Exception("Received read command NACK!")
-	else:
-		raise Exception("Received write command NACK!")
-
-	eeprom.Stop()
+	# Write the start address, then read the whole chip back, in one transaction
+	(data, ack) = eeprom.I2CReadReg(ADDR, START, SIZE)
+	if ack != ACK:
+		raise Exception("Received NACK!")
 	
 	open(FOUT, "wb").write(data)	
 	print "Dumped %d bytes to %s" % (len(data), FOUT)
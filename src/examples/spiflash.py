@@ -1,20 +1,10 @@
 #!/usr/bin/env python
 
 from mpsse import *
-from time import sleep
+from mpsseflash import SPIFlash as FlashDriver
+from mmap import mmap, ACCESS_READ
 
-class SPIFlash(object):
-
-	WCMD = "\x02"		# Standard SPI flash write command (0x02)
-	RCMD = "\x03"		# Standard SPI flash read command (0x03)
-	WECMD = "\x06"		# Standard SPI flash write enable command (0x06)
-	CECMD = "\xc7"		# Standard SPI flash chip erase command (0xC7)
-	IDCMD = "\x9f"		# Standard SPI flash chip ID command (0x9F)
-
-	ID_LENGTH = 3		# Normal SPI chip ID length, in bytes
-	ADDRESS_LENGTH = 3	# Normal SPI flash address length (24 bits, aka, 3 bytes)
-	BLOCK_SIZE = 256	# SPI block size, writes must be done in multiples of this size
-	PP_PERIOD = .025	# Page program time, in seconds
+class SPIFlash(FlashDriver):
 
 	def __init__(self, speed=FIFTEEN_MHZ):
 
@@ -22,9 +12,7 @@ class SPIFlash(object):
 		if not speed:
 			speed = FIFTEEN_MHZ
 
-		self.flash = MPSSE(SPI0, speed, MSB)
-		self.chip = self.flash.GetDescription()
-		self.speed = self.flash.GetClock()
+		FlashDriver.__init__(self, MPSSE(SPI0, speed, MSB))
 		self._init_gpio()
 
 	def _init_gpio(self):
@@ -32,60 +20,6 @@ class SPIFlash(object):
 		self.flash.PinHigh(GPIOL0)
 		self.flash.PinHigh(GPIOL1)
 
-	def _addr2str(self, address):
-        	addr_str = ""
-
-        	for i in range(0, self.ADDRESS_LENGTH):
-        	        addr_str += chr((address >> (i*8)) & 0xFF)
-
-        	return addr_str[::-1]
-
-	def Read(self, count, address=0):
-		data = ''
-
-		self.flash.Start()
-		self.flash.Write(self.RCMD + self._addr2str(address))
-		data = self.flash.Read(count)
-		self.flash.Stop()
-
-		return data
-
-	def Write(self, data, address=0):
-		count = 0
-
-		while count < len(data):
-
-			self.flash.Start()
-        		self.flash.Write(self.WECMD)
-        		self.flash.Stop()
-
-			self.flash.Start()
-			self.flash.Write(self.WCMD + self._addr2str(address) + data[address:address+self.BLOCK_SIZE])
-			self.flash.Stop()
-
-			sleep(self.PP_PERIOD)
-			address += self.BLOCK_SIZE
-			count += self.BLOCK_SIZE
-
-	def Erase(self):
-		self.flash.Start()
-		self.flash.Write(self.WECMD)
-		self.flash.Stop()
-
-		self.flash.Start()
-		self.flash.Write(self.CECMD)
-		self.flash.Stop()
-
-	def ChipID(self):
-		self.flash.Start()
-		self.flash.Write(self.IDCMD)
-		chipid = self.flash.Read(self.ID_LENGTH)
-		self.flash.Stop()
-		return chipid
-
-	def Close(self):
-		self.flash.Close()
-
 
 if __name__ == "__main__":
 
@@ -116,6 +50,7 @@ if __name__ == "__main__":
 		print ""
 		print "\t-r, --read=<file>      Read data from the chip to file"
 		print "\t-w, --write=<file>     Write data from file to the chip"
+		print "\t-u, --update=<file>    Write data from file to the chip, only rewriting the sectors that differ"
 		print "\t-s, --size=<int>       Set the size of data to read/write"
 		print "\t-a, --address=<int>    Set the starting address for the read/write operation [0]"
 		print "\t-f, --frequency=<int>  Set the SPI clock frequency, in hertz [15,000,000]"
@@ -138,7 +73,7 @@ if __name__ == "__main__":
 		data = ""
 
 		try:
-			opts, args = GetOpt(sys.argv[1:], "f:s:a:r:w:eipvh", ["frequency=", "size=", "address=", "read=", "write=", "id", "erase", "verify", "pin-mappings", "help"])
+			opts, args = GetOpt(sys.argv[1:], "f:s:a:r:w:u:eipvh", ["frequency=", "size=", "address=", "read=", "write=", "update=", "id", "erase", "verify", "pin-mappings", "help"])
 		except GetoptError, e:
 			print e
 			usage()
@@ -156,6 +91,9 @@ if __name__ == "__main__":
 			elif opt in ('-w', '--write'):
 				action = "write"
 				fname = arg
+			elif opt in ('-u', '--update'):
+				action = "update"
+				fname = arg
 			elif opt in ('-i', '--id'):
 				action = "id"
 			elif opt in ('-e', '--erase'):
@@ -197,7 +135,23 @@ if __name__ == "__main__":
 			sys.stdout.write("Writing %d bytes from %s to the chip starting at address 0x%X..." % (size, fname, address))
 			sys.stdout.flush()
 			spi.Write(data[0:size], address)
-			print "done."
+			print "done (%d bytes/s)." % spi.Throughput()
+
+		elif action == "update":
+			if fname is None:
+				print "Please specify an input file!"
+				usage()
+
+			# Map the image rather than reading it all into memory; only one sector at a time is ever needed
+			fp = open(fname, 'rb')
+			image = mmap(fp.fileno(), 0, access=ACCESS_READ)
+			if size:
+				image = image[0:size]
+
+			sys.stdout.write("Updating %d bytes from %s starting at address 0x%X..." % (len(image), fname, address))
+			sys.stdout.flush()
+			changed = spi.Update(image, address)
+			print "done, rewrote %d of %d sectors (%d bytes/s)." % (len(changed), (len(image) + spi.SECTOR_SIZE - 1) / spi.SECTOR_SIZE, spi.Throughput())
 
 		elif action == "id":
 
@@ -7,12 +7,17 @@
  */
 
 #include <string.h>
+
+#if LIBFTDI1 == 1
+#include <libftdi1/ftdi.h>
+#else
+#include <ftdi.h>
+#endif
+
 #include "mpsse.h"
 #include "support.h"
 
-unsigned char fast_rw_buf[SPI_RW_SIZE + CMD_SIZE];
-
-/* Builds a block buffer for the Fast* functions. For internal use only. */
+/* Builds a block buffer for the Fast* functions in the context's fast_buf. For internal use only. */
 int fast_build_block_buffer(struct mpsse_context *mpsse, uint8_t cmd, unsigned char *data, int size, int *buf_size)
 {
        	int i = 0;
@@ -20,18 +25,24 @@ int fast_build_block_buffer(struct mpsse_context *mpsse, uint8_t cmd, unsigned c
 
 	*buf_size = 0;
 
+	/* The staging buffer is allocated on first use and reused by all subsequent Fast* calls on this context */
+	if(pool_buffer(mpsse, &mpsse->fast_buf, &mpsse->fast_alloc, mpsse->xsize + CMD_SIZE) != MPSSE_OK || (size + CMD_SIZE) > mpsse->fast_alloc)
+	{
+		return MPSSE_FAIL;
+	}
+
 	/* The reported size of this block is block size - 1 */
 	rsize = size - 1;
 
 	/* Copy in the command for this block */
-	fast_rw_buf[i++] = cmd;
-	fast_rw_buf[i++] = (rsize & 0xFF);
-	fast_rw_buf[i++] = ((rsize >> 8) & 0xFF);
+	mpsse->fast_buf[i++] = cmd;
+	mpsse->fast_buf[i++] = (rsize & 0xFF);
+	mpsse->fast_buf[i++] = ((rsize >> 8) & 0xFF);
 
 	/* On a write, copy the data to transmit after the command */
-	if((cmd == mpsse->tx || cmd == mpsse->txrx) && (i + size) <= sizeof(fast_rw_buf))
+	if(cmd == mpsse->tx || cmd == mpsse->txrx)
 	{
-		memcpy(fast_rw_buf+i, data, size);
+		memcpy(mpsse->fast_buf+i, data, size);
 
 		/* i == offset into buf */
 		i += size;
@@ -69,7 +80,7 @@ int FastWrite(struct mpsse_context *mpsse, char *data, int size)
 	
 				if(fast_build_block_buffer(mpsse, mpsse->tx, (unsigned char *) (data + n), txsize, &buf_size) == MPSSE_OK)
 				{	
-					if(raw_write(mpsse, fast_rw_buf, buf_size) == MPSSE_OK)
+					if(raw_write(mpsse, mpsse->fast_buf, buf_size) == MPSSE_OK)
 					{
 						n += txsize;
 					}
@@ -107,7 +118,7 @@ int FastWrite(struct mpsse_context *mpsse, char *data, int size)
  */
 int FastRead(struct mpsse_context *mpsse, char *data, int size)
 {
-	int n = 0, rxsize = 0, data_size = 0;
+	int n = 0, queued = 0, rxsize = 0, data_size = 0;
 
 	if(is_valid_context(mpsse))
 	{
@@ -115,29 +126,39 @@ int FastRead(struct mpsse_context *mpsse, char *data, int size)
 		{
 			while(n < size)
 			{
-				rxsize = size - n;
-				if(rxsize > mpsse->xsize)
+				/* 
+				 * Keep the read commands for the next block(s) queued in the chip while the current block is 
+				 * read back, so that the SPI bus isn't left idle for a USB round trip between blocks.
+				 */
+				while(queued < size && (queued - n) < (FAST_READ_DEPTH * mpsse->xsize))
 				{
-					rxsize = mpsse->xsize;
-				}
-
-				if(fast_build_block_buffer(mpsse, mpsse->rx, NULL, rxsize, &data_size) == MPSSE_OK)
-				{
-					if(raw_write(mpsse, fast_rw_buf, data_size) == MPSSE_OK)
+					rxsize = size - queued;
+					if(rxsize > mpsse->xsize)
 					{
-						n += raw_read(mpsse, (unsigned char *)(data+n), rxsize);
+						rxsize = mpsse->xsize;
 					}
-					else
+
+					if(fast_build_block_buffer(mpsse, mpsse->rx, NULL, rxsize, &data_size) != MPSSE_OK ||
+					   raw_write(mpsse, mpsse->fast_buf, data_size) != MPSSE_OK)
 					{
 						return MPSSE_FAIL;
-						break;
 					}
+
+					queued += rxsize;
 				}
-				else
+
+				rxsize = size - n;
+				if(rxsize > mpsse->xsize)
+				{
+					rxsize = mpsse->xsize;
+				}
+
+				if(raw_read(mpsse, (unsigned char *)(data+n), rxsize) != rxsize)
 				{
-					return MPSSE_FAIL;
 					break;
 				}
+
+				n += rxsize;
 			}
 
 			if(n == size)
@@ -162,38 +183,57 @@ int FastRead(struct mpsse_context *mpsse, char *data, int size)
  */
 int FastTransfer(struct mpsse_context *mpsse, char *wdata, char *rdata, int size)
 {
-	int n = 0, data_size = 0, rxsize = 0;
+	int n = 0, w = 0, data_size = 0, rxsize = 0, txsize = 0, block_size = 0, window = 0;
 
 	if(is_valid_context(mpsse))
 	{
 		if(mpsse->mode >= SPI0 && mpsse->mode <= SPI3)
 		{
+			block_size = transfer_block_size(mpsse);
+			window = fifo_size(mpsse);
+
 			while(n < size)
 			{
-				rxsize = size - n;
-				/* When sending and recieving, FTDI chips don't seem to like large data blocks. Limit the size of each block to SPI_TRANSFER_SIZE */
-				if(rxsize > SPI_TRANSFER_SIZE)
+				/* Keep as many txrx blocks in flight as will fit in the chip's FIFO */
+				while(w < size)
 				{
-					rxsize = SPI_TRANSFER_SIZE;
-				}
+					txsize = size - w;
+					if(txsize > block_size)
+					{
+						txsize = block_size;
+					}
 
-				if(build_block_buffer(mpsse, mpsse->txrx, (unsigned char *) (wdata + n), rxsize, &data_size) == MPSSE_OK)
-				{
-					if(raw_write(mpsse, fast_rw_buf, data_size) == MPSSE_OK)
+					if((w - n + txsize) > window)
 					{
-						n += raw_read(mpsse, (unsigned char *)(rdata + n), rxsize);
+						break;
 					}
-					else
+
+					if(fast_build_block_buffer(mpsse, mpsse->txrx, (unsigned char *) (wdata + w), txsize, &data_size) != MPSSE_OK)
 					{
 						return MPSSE_FAIL;
-						break;
 					}
+
+					if(raw_write(mpsse, mpsse->fast_buf, data_size) != MPSSE_OK)
+					{
+						return MPSSE_FAIL;
+					}
+
+					w += txsize;
 				}
-				else
+
+				/* Read back the oldest block */
+				rxsize = w - n;
+				if(rxsize > block_size)
+				{
+					rxsize = block_size;
+				}
+
+				if(rxsize <= 0 || raw_read(mpsse, (unsigned char *)(rdata + n), rxsize) != rxsize)
 				{
 					return MPSSE_FAIL;
-					break;
 				}
+
+				n += rxsize;
 			}
 
 			if(n == size)
@@ -206,4 +246,227 @@ int FastTransfer(struct mpsse_context *mpsse, char *wdata, char *rdata, int size
 	return MPSSE_FAIL;
 }
 
+/* Queues read commands for up to n more stream chunks. For internal use only. */
+int stream_queue_reads(struct mpsse_context *mpsse, int n)
+{
+	int i = 0, j = 0;
+	uint16_t rsize = mpsse->stream_chunk - 1;
+
+	if(mpsse->stream_count > 0 && n > (mpsse->stream_count - mpsse->stream_queued))
+	{
+		n = mpsse->stream_count - mpsse->stream_queued;
+	}
+
+	if(n <= 0)
+	{
+		return MPSSE_OK;
+	}
+
+	if(pool_buffer(mpsse, &mpsse->stream_cmd, &mpsse->stream_cmd_alloc, n * (CMD_SIZE + 1)) != MPSSE_OK)
+	{
+		return MPSSE_FAIL;
+	}
+
+	/* Each read command is followed by a SEND_IMMEDIATE so that no chunk waits on the latency timer */
+	for(i=0; i<n; i++)
+	{
+		mpsse->stream_cmd[j++] = mpsse->rx;
+		mpsse->stream_cmd[j++] = (rsize & 0xFF);
+		mpsse->stream_cmd[j++] = ((rsize >> 8) & 0xFF);
+		mpsse->stream_cmd[j++] = SEND_IMMEDIATE;
+	}
+
+	if(raw_write(mpsse, mpsse->stream_cmd, j) != MPSSE_OK)
+	{
+		return MPSSE_FAIL;
+	}
+
+	mpsse->stream_queued += n;
+
+	return MPSSE_OK;
+}
+
+/* Starts reading the next stream chunk into the stream buffer. For internal use only. */
+int stream_submit(struct mpsse_context *mpsse)
+{
+#if LIBFTDI1 == 1
+	/* Asynchronous reads are only available when talking to a real chip */
+	if(mpsse->transport == &libftdi_transport)
+	{
+		mpsse->stream_tc = ftdi_read_data_submit(&mpsse->ftdi, mpsse->stream_buf, mpsse->stream_chunk);
+		if(mpsse->stream_tc == NULL)
+		{
+			return MPSSE_FAIL;
+		}
+	}
+#endif
+	return MPSSE_OK;
+}
+
+/* Waits for the current stream chunk to arrive. For internal use only. */
+int stream_wait(struct mpsse_context *mpsse, unsigned char *data)
+{
+	int n = 0;
+
+#if LIBFTDI1 == 1
+	if(mpsse->stream_tc)
+	{
+		uint64_t start = usecs_now();
+
+		n = ftdi_transfer_data_done((struct ftdi_transfer_control *) mpsse->stream_tc);
+		mpsse->stream_tc = NULL;
+		if(data != mpsse->stream_buf)
+		{
+			memcpy(data, mpsse->stream_buf, mpsse->stream_chunk);
+		}
+		record_read(mpsse, data, mpsse->stream_chunk, n, start);
+
+		return n;
+	}
+#endif
+	n = raw_read(mpsse, data, mpsse->stream_chunk);
+
+	return n;
+}
+
+/*
+ * Starts a continuous read for capturing long streams of SPI data.
+ * Up to depth read commands are kept queued in the chip, so it keeps clocking in data while the host
+ * is processing the previous chunk. With libftdi1, the USB read of the next chunk is also submitted
+ * asynchronously before the current chunk is returned by StreamNext(). libftdi reads through a single
+ * buffer per context, so only one USB read is ever in flight; the chip's queued read commands provide
+ * the rest of the overlap.
+ *
+ * @mpsse      - libmpsse context pointer.
+ * @chunk_size - The number of bytes returned by each call to StreamNext(). Must not exceed SPI_RW_SIZE.
+ * @count      - The number of chunks to read, or 0 to read until StreamStop() is called.
+ * @depth      - The number of read commands to keep queued in the chip, or 0 for STREAM_DEPTH.
+ *
+ * Returns MPSSE_OK on success, MPSSE_FAIL on failure.
+ */
+int StreamStart(struct mpsse_context *mpsse, int chunk_size, int count, int depth)
+{
+	if(!is_valid_context(mpsse) || mpsse->stream || mpsse->batch)
+	{
+		return MPSSE_FAIL;
+	}
+
+	if(mpsse->mode < SPI0 || mpsse->mode > SPI3 || chunk_size <= 0 || chunk_size > mpsse->xsize || count < 0 || depth < 0)
+	{
+		return MPSSE_FAIL;
+	}
+
+	/* One chunk buffer for the single in-flight USB read; it is copied out to the caller when it completes */
+	if(pool_buffer(mpsse, &mpsse->stream_buf, &mpsse->stream_alloc, chunk_size) != MPSSE_OK)
+	{
+		return MPSSE_FAIL;
+	}
+
+	mpsse->stream = 1;
+	mpsse->stream_chunk = chunk_size;
+	mpsse->stream_count = count;
+	mpsse->stream_depth = depth ? depth : STREAM_DEPTH;
+	mpsse->stream_queued = 0;
+	mpsse->stream_done = 0;
+	mpsse->stream_tc = NULL;
+
+	if(stream_queue_reads(mpsse, mpsse->stream_depth) != MPSSE_OK || stream_submit(mpsse) != MPSSE_OK)
+	{
+		StreamStop(mpsse);
+		return MPSSE_FAIL;
+	}
+
+	return MPSSE_OK;
+}
+
+/*
+ * Gets the next chunk of a stream started with StreamStart().
+ *
+ * @mpsse - libmpsse context pointer.
+ * @rdata - The destination buffer to read data into.
+ * @rsize - The size of rdata. Must be at least the chunk size passed to StreamStart().
+ *
+ * Returns the number of bytes stored in rdata, or 0 once all chunks have been read.
+ * Returns MPSSE_FAIL on failure.
+ */
+int StreamNext(struct mpsse_context *mpsse, char *rdata, int rsize)
+{
+	if(!is_valid_context(mpsse) || !mpsse->stream || rsize < mpsse->stream_chunk)
+	{
+		return MPSSE_FAIL;
+	}
+
+	if(mpsse->stream_count > 0 && mpsse->stream_done >= mpsse->stream_count)
+	{
+		return 0;
+	}
+
+	if(stream_wait(mpsse, (unsigned char *) rdata) != mpsse->stream_chunk)
+	{
+		return MPSSE_FAIL;
+	}
+
+	mpsse->stream_done++;
+
+	/* Top the chip's command queue back up, then start reading the next chunk before returning this one */
+	if(stream_queue_reads(mpsse, mpsse->stream_depth - (mpsse->stream_queued - mpsse->stream_done)) != MPSSE_OK)
+	{
+		return MPSSE_FAIL;
+	}
+
+	if(mpsse->stream_done < mpsse->stream_queued)
+	{
+		if(stream_submit(mpsse) != MPSSE_OK)
+		{
+			return MPSSE_FAIL;
+		}
+	}
+
+	return mpsse->stream_chunk;
+}
+
+/*
+ * Ends a stream started with StreamStart(), discarding any data still queued in the chip.
+ *
+ * @mpsse - libmpsse context pointer.
+ *
+ * Returns MPSSE_OK on success, MPSSE_FAIL on failure.
+ */
+int StreamStop(struct mpsse_context *mpsse)
+{
+	int retval = MPSSE_OK;
+
+	if(mpsse == NULL || !mpsse->stream)
+	{
+		return MPSSE_OK;
+	}
+
+	/* Drain the chunks that the chip has already been told to read, so that they don't show up in later reads */
+	while(mpsse->stream_done < mpsse->stream_queued)
+	{
+		if(stream_wait(mpsse, mpsse->stream_buf) != mpsse->stream_chunk)
+		{
+			retval = MPSSE_FAIL;
+			break;
+		}
+
+		mpsse->stream_done++;
+
+		if(mpsse->stream_done < mpsse->stream_queued && stream_submit(mpsse) != MPSSE_OK)
+		{
+			retval = MPSSE_FAIL;
+			break;
+		}
+	}
+
+	if(retval != MPSSE_OK)
+	{
+		raw_purge(mpsse);
+	}
+
+	mpsse->stream = 0;
+	mpsse->stream_tc = NULL;
+
+	return retval;
+}
 
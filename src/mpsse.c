@@ -5,6 +5,7 @@
  * 27 December 2011
  */
 
+#include <stdio.h>
 #include <stdlib.h>
 #include <string.h>
 #include <stdint.h>
@@ -22,20 +23,20 @@
 
 /* List of known FT2232-based devices */
 struct vid_pid supported_devices[] = { 
-			{ 0x0403, 0x6010, "FT2232 Future Technology Devices International, Ltd" }, 
-			{ 0x0403, 0x6011, "FT4232 Future Technology Devices International, Ltd" }, 
-			{ 0x0403, 0x6014, "FT232H Future Technology Devices International, Ltd" },
+			{ 0x0403, 0x6010, "FT2232 Future Technology Devices International, Ltd", 2 }, 
+			{ 0x0403, 0x6011, "FT4232 Future Technology Devices International, Ltd", 4 }, 
+			{ 0x0403, 0x6014, "FT232H Future Technology Devices International, Ltd", 1 },
 
 			/* These devices are based on FT2232 chips, but have not been tested. */
-			{ 0x0403, 0x8878, "Bus Blaster v2 (channel A)" },
-			{ 0x0403, 0x8879, "Bus Blaster v2 (channel B)" },
-			{ 0x0403, 0xBDC8, "Turtelizer JTAG/RS232 Adapter A" },
-			{ 0x0403, 0xCFF8, "Amontec JTAGkey" },
-			{ 0x0403, 0x8A98, "TIAO Multi Protocol Adapter"}, 
-			{ 0x15BA, 0x0003, "Olimex Ltd. OpenOCD JTAG" },
-			{ 0x15BA, 0x0004, "Olimex Ltd. OpenOCD JTAG TINY" },
-
-			{ 0, 0, NULL }
+			{ 0x0403, 0x8878, "Bus Blaster v2 (channel A)", 2 },
+			{ 0x0403, 0x8879, "Bus Blaster v2 (channel B)", 2 },
+			{ 0x0403, 0xBDC8, "Turtelizer JTAG/RS232 Adapter A", 2 },
+			{ 0x0403, 0xCFF8, "Amontec JTAGkey", 2 },
+			{ 0x0403, 0x8A98, "TIAO Multi Protocol Adapter", 2 }, 
+			{ 0x15BA, 0x0003, "Olimex Ltd. OpenOCD JTAG", 2 },
+			{ 0x15BA, 0x0004, "Olimex Ltd. OpenOCD JTAG TINY", 2 },
+
+			{ 0, 0, NULL, 0 }
 };
 
 /*
@@ -115,7 +116,6 @@ struct mpsse_context *Open(int vid, int pid, enum modes mode, int freq, int endi
  */
 struct mpsse_context *OpenIndex(int vid, int pid, enum modes mode, int freq, int endianess, int interface, const char *description, const char *serial, int index)
 {
-	int status = 0;
 	struct mpsse_context *mpsse = NULL;
 
 	mpsse = malloc(sizeof(struct mpsse_context));
@@ -129,68 +129,184 @@ struct mpsse_context *OpenIndex(int vid, int pid, enum modes mode, int freq, int
 		/* ftdilib initialization */
 		if(ftdi_init(&mpsse->ftdi) == 0)
 		{
+			mpsse->transport = &libftdi_transport;
+
 			/* Set the FTDI interface  */
 			ftdi_set_interface(&mpsse->ftdi, interface);
 
 			/* Open the specified device */
 			if(ftdi_usb_open_desc_index(&mpsse->ftdi, vid, pid, description, serial, index) == 0)
 			{
-				mpsse->mode = mode;
-				mpsse->vid = vid;
-				mpsse->pid = pid;
-				mpsse->status = STOPPED;
-				mpsse->endianess = endianess;
-
-				/* Set the appropriate transfer size for the requested protocol */
-				if(mpsse->mode == I2C)
+				init_device(mpsse, vid, pid, mode, freq, endianess, 0);
+			}
+		}
+	}
+
+	return mpsse;
+}
+
+/*
+ * Fills in device with the details of the USB device dev, if its VID/PID is in the table of known devices.
+ * The serial number and description are read from the device's string descriptors, which briefly opens it.
+ * For internal use only. Returns 1 if the device is a known device, 0 if not.
+ */
+#if LIBFTDI1 == 1
+static int describe_device(struct ftdi_context *ftdi, struct libusb_device *dev, int vid, int pid, struct mpsse_device *device)
+#else
+static int describe_device(struct ftdi_context *ftdi, struct usb_device *dev, int vid, int pid, struct mpsse_device *device)
+#endif
+{
+	int i = 0;
+
+	for(i=0; supported_devices[i].vid != 0; i++)
+	{
+		if(supported_devices[i].vid == vid && supported_devices[i].pid == pid)
+		{
+			memset(device, 0, sizeof(struct mpsse_device));
+
+			device->vid = vid;
+			device->pid = pid;
+			device->interfaces = supported_devices[i].interfaces;
+
+			ftdi_usb_get_strings(ftdi, dev, NULL, 0, device->description, DESCRIPTION_LEN, device->serial, SERIAL_LEN);
+
+			/* 
+			 * Same format as the "d:<bus>/<device>" string accepted by ftdi_usb_open_string. With libusb-0.1 the bus
+			 * and device names are file names, which can be longer than LOCATION_LEN; such devices can't be reopened
+			 * by location, so they are left out of the list rather than listed with a truncated location.
+			 */
+#if LIBFTDI1 == 1
+			return (snprintf(device->location, LOCATION_LEN, "%03d/%03d", libusb_get_bus_number(dev), libusb_get_device_address(dev)) < LOCATION_LEN);
+#else
+			return (snprintf(device->location, LOCATION_LEN, "%s/%s", dev->bus->dirname, dev->filename) < LOCATION_LEN);
+#endif
+		}
+	}
+
+	return 0;
+}
+
+/*
+ * Lists all attached FTDI devices with a VID/PID from the table of known devices, with a single scan of the USB bus.
+ * The serial number and description of each device are read from its string descriptors, which briefly opens it;
+ * devices are not reset or otherwise disturbed. The bus locations that it returns can be used to quickly reopen
+ * devices with OpenLocation() / OpenDevice().
+ *
+ * @devices - Array to store the device information in.
+ * @max     - Number of entries in the devices array.
+ *
+ * Returns the number of devices found, up to max.
+ */
+int ListDevices(struct mpsse_device *devices, int max)
+{
+	int count = 0;
+	struct ftdi_context ftdi;
+#if LIBFTDI1 == 1
+	int i = 0;
+	libusb_device **list = NULL;
+	struct libusb_device_descriptor desc;
+#else
+	struct usb_bus *bus = NULL;
+	struct usb_device *dev = NULL;
+#endif
+
+	if(ftdi_init(&ftdi) == 0)
+	{
+		/* Enumerate the bus once and match every device against the table, rather than searching for each VID/PID in turn */
+#if LIBFTDI1 == 1
+		if(libusb_get_device_list(ftdi.usb_ctx, &list) >= 0)
+		{
+			for(i=0; list[i] != NULL && count < max; i++)
+			{
+				if(libusb_get_device_descriptor(list[i], &desc) == 0 && describe_device(&ftdi, list[i], desc.idVendor, desc.idProduct, &devices[count]))
 				{
-					mpsse->xsize = I2C_TRANSFER_SIZE;
+					count++;
 				}
-				else
+			}
+
+			libusb_free_device_list(list, 1);
+		}
+#else
+		usb_find_busses();
+		usb_find_devices();
+
+		for(bus = usb_get_busses(); bus != NULL && count < max; bus = bus->next)
+		{
+			for(dev = bus->devices; dev != NULL && count < max; dev = dev->next)
+			{
+				if(describe_device(&ftdi, dev, dev->descriptor.idVendor, dev->descriptor.idProduct, &devices[count]))
 				{
-					mpsse->xsize = SPI_RW_SIZE;
+					count++;
 				}
-	
-				status |= ftdi_usb_reset(&mpsse->ftdi);
-				status |= ftdi_set_latency_timer(&mpsse->ftdi, LATENCY_MS);
-				status |= ftdi_write_data_set_chunksize(&mpsse->ftdi, CHUNK_SIZE);
-				status |= ftdi_read_data_set_chunksize(&mpsse->ftdi, CHUNK_SIZE);
-				status |= ftdi_set_bitmode(&mpsse->ftdi, 0, BITMODE_RESET);
+			}
+		}
+#endif
 
-				if(status == 0)
-				{
-					/* Set the read and write timeout periods */
-					set_timeouts(mpsse, USB_TIMEOUT);
-					
-					if(mpsse->mode != BITBANG)
-					{
-						ftdi_set_bitmode(&mpsse->ftdi, 0, BITMODE_MPSSE);
+		ftdi_deinit(&ftdi);
+	}
 
-						if(SetClock(mpsse, freq) == MPSSE_OK)
-						{
-							if(SetMode(mpsse, endianess) == MPSSE_OK)
-							{
-								mpsse->open = 1;
+	return count;
+}
 
-								/* Give the chip a few mS to initialize */
-								usleep(SETUP_DELAY);
+/*
+ * Checks that the device opened by ftdi has the given VID/PID and, unless serial is NULL or empty, serial number.
+ * For internal use only. Returns 1 if it does, 0 if not.
+ */
+static int is_device(struct ftdi_context *ftdi, int vid, int pid, const char *serial)
+{
+	int retval = 0;
+	char buf[SERIAL_LEN] = { 0 };
+#if LIBFTDI1 == 1
+	struct libusb_device_descriptor desc;
 
-								/* 
-								 * Not all FTDI chips support all the commands that SetMode may have sent.
-								 * This clears out any errors from unsupported commands that might have been sent during set up. 
-								 */
-								ftdi_usb_purge_buffers(&mpsse->ftdi);
-							}
-						}
-					}
-					else
-					{
-						/* Skip the setup functions if we're just operating in BITBANG mode */
-						if(ftdi_set_bitmode(&mpsse->ftdi, 0xFF, BITMODE_BITBANG) == 0)
-						{
-							mpsse->open = 1;
-						}
-					}
+	if(libusb_get_device_descriptor(libusb_get_device(ftdi->usb_dev), &desc) == 0 && desc.idVendor == vid && desc.idProduct == pid)
+	{
+		retval = (serial == NULL || serial[0] == 0 || 
+			  (libusb_get_string_descriptor_ascii(ftdi->usb_dev, desc.iSerialNumber, (unsigned char *) buf, sizeof(buf)) >= 0 && strcmp(buf, serial) == 0));
+	}
+#else
+	struct usb_device *dev = usb_device(ftdi->usb_dev);
+
+	if(dev->descriptor.idVendor == vid && dev->descriptor.idProduct == pid)
+	{
+		retval = (serial == NULL || serial[0] == 0 || 
+			  (usb_get_string_simple(ftdi->usb_dev, dev->descriptor.iSerialNumber, buf, sizeof(buf)) >= 0 && strcmp(buf, serial) == 0));
+	}
+#endif
+
+	return retval;
+}
+
+/* Opens the device at a USB bus location, if it is the expected device. For internal use only. See OpenLocation(). */
+static struct mpsse_context *open_location(int vid, int pid, const char *location, const char *serial, enum modes mode, int freq, int endianess, int interface)
+{
+	char dev[LOCATION_LEN + 2] = { 0 };
+	struct mpsse_context *mpsse = NULL;
+
+	mpsse = malloc(sizeof(struct mpsse_context));
+	if(mpsse)
+	{
+		memset(mpsse, 0, sizeof(struct mpsse_context));
+
+		/* Legacy; flushing is no longer needed, so disable it by default. */
+		FlushAfterRead(mpsse, 0);
+
+		if(ftdi_init(&mpsse->ftdi) == 0)
+		{
+			mpsse->transport = &libftdi_transport;
+
+			ftdi_set_interface(&mpsse->ftdi, interface);
+
+			if(snprintf(dev, sizeof(dev), "d:%s", location) < (int) sizeof(dev) && ftdi_usb_open_string(&mpsse->ftdi, dev) == 0)
+			{
+				/* The location may since have been taken by a different device, which must not be reset or reconfigured */
+				if(is_device(&mpsse->ftdi, vid, pid, serial))
+				{
+					init_device(mpsse, vid, pid, mode, freq, endianess, 1);
+				}
+				else
+				{
+					ftdi_usb_close(&mpsse->ftdi);
 				}
 			}
 		}
@@ -199,6 +315,93 @@ struct mpsse_context *OpenIndex(int vid, int pid, enum modes mode, int freq, int
 	return mpsse;
 }
 
+/* 
+ * Open device by USB bus location. If the device is already in MPSSE mode, for example because it was left
+ * open by a previous program, it is not reset and the setup delay is skipped. The device at the location 
+ * must have the given VID and PID, otherwise it is not opened.
+ *
+ * @vid       - Device vendor ID.
+ * @pid       - Device product ID.
+ * @location  - Bus location of the device, as returned by ListDevices() ("<bus>/<device>").
+ * @mode      - MPSSE mode, one of enum modes.
+ * @freq      - Clock frequency to use for the specified mode.
+ * @endianess - Specifies how data is clocked in/out (MSB, LSB).
+ * @interface - FTDI interface to use (IFACE_A - IFACE_D).
+ *
+ * Returns a pointer to an MPSSE context structure. 
+ * On success, mpsse->open will be set to 1.
+ * On failure, mpsse->open will be set to 0.
+ */
+struct mpsse_context *OpenLocation(int vid, int pid, const char *location, enum modes mode, int freq, int endianess, int interface)
+{
+	return open_location(vid, pid, location, NULL, mode, freq, endianess, interface);
+}
+
+/* 
+ * Opens a device returned by ListDevices(). The device at its bus location must have the same VID, PID and 
+ * serial number, otherwise it is not opened.
+ *
+ * @device    - The device to open.
+ * @mode      - MPSSE mode, one of enum modes.
+ * @freq      - Clock frequency to use for the specified mode.
+ * @endianess - Specifies how data is clocked in/out (MSB, LSB).
+ * @interface - FTDI interface to use (IFACE_A - IFACE_D).
+ *
+ * Returns a pointer to an MPSSE context structure. 
+ * On success, mpsse->open will be set to 1.
+ * On failure, mpsse->open will be set to 0.
+ */
+struct mpsse_context *OpenDevice(struct mpsse_device *device, enum modes mode, int freq, int endianess, int interface)
+{
+	return open_location(device->vid, device->pid, device->location, device->serial, mode, freq, endianess, interface);
+}
+
+/* 
+ * Opens the device with the given serial number, using a device list from ListDevices() to find it without 
+ * scanning the USB bus. If the device is not in the list, or can't be opened at its listed location (e.g., 
+ * because it has been unplugged and plugged back in), the bus is scanned again and the list is updated.
+ *
+ * @devices   - Device list, as filled in by ListDevices().
+ * @count     - Pointer to the number of devices in the list. Updated if the bus is scanned again.
+ * @max       - Number of entries in the devices array.
+ * @serial    - Serial number of the device to open, or NULL for the first device in the list.
+ * @mode      - MPSSE mode, one of enum modes.
+ * @freq      - Clock frequency to use for the specified mode.
+ * @endianess - Specifies how data is clocked in/out (MSB, LSB).
+ * @interface - FTDI interface to use (IFACE_A - IFACE_D).
+ *
+ * Returns a pointer to an MPSSE context structure, or NULL if no device with the serial number is attached.
+ * On success, mpsse->open will be set to 1.
+ * On failure, mpsse->open will be set to 0.
+ */
+struct mpsse_context *OpenSerial(struct mpsse_device *devices, int *count, int max, const char *serial, enum modes mode, int freq, int endianess, int interface)
+{
+	int i = 0, rescan = 0;
+	struct mpsse_context *mpsse = NULL;
+
+	for(rescan=0; rescan<2 && (mpsse == NULL || !mpsse->open); rescan++)
+	{
+		if(rescan)
+		{
+			*count = ListDevices(devices, max);
+		}
+
+		for(i=0; i<*count; i++)
+		{
+			if(serial == NULL || strcmp(devices[i].serial, serial) == 0)
+			{
+				/* Discard the failed attempt to open the device at its old location */
+				Close(mpsse);
+
+				mpsse = OpenDevice(&devices[i], mode, freq, endianess, interface);
+				break;
+			}
+		}
+	}
+
+	return mpsse;
+}
+
 /* 
  * Closes the device, deinitializes libftdi, and frees the MPSSE context pointer.
  *
@@ -212,11 +415,18 @@ void Close(struct mpsse_context *mpsse)
 	{
 		if(mpsse->open)
 		{
-			ftdi_set_bitmode(&mpsse->ftdi, 0, BITMODE_RESET);
-			ftdi_usb_close(&mpsse->ftdi);
-			ftdi_deinit(&mpsse->ftdi);
+			StreamStop(mpsse);
+			mpsse->transport->close(mpsse);
 		}
 
+		free(mpsse->batch_buf);
+		free(mpsse->batch_rbuf);
+		free(mpsse->fast_buf);
+		free(mpsse->cmd_buf);
+		free(mpsse->rx_buf);
+		free(mpsse->stream_buf);
+		free(mpsse->stream_cmd);
+		free(mpsse->acks);
 		free(mpsse);
 		mpsse = NULL;
 	}
@@ -250,6 +460,7 @@ void EnableBitmode(struct mpsse_context *mpsse, int tf)
 
 /*
  * Sets the appropriate transmit and receive commands based on the requested mode and byte order.
+ * Chip settings that are already in effect are not sent again.
  *
  * @mpsse     - MPSSE context pointer.
  * @endianess - MPSSE_MSB or MPSSE_LSB.
@@ -259,8 +470,7 @@ void EnableBitmode(struct mpsse_context *mpsse, int tf)
  */
 int SetMode(struct mpsse_context *mpsse, int endianess)
 {
-	int retval = MPSSE_OK, i = 0, setup_commands_size = 0;
-	unsigned char buf[CMD_SIZE] = { 0 };
+	int retval = MPSSE_OK, setup_commands_size = 0, three_phase = 0;
 	unsigned char setup_commands[CMD_SIZE*MAX_SETUP_COMMANDS] = { 0 };
 
 	/* Do not call is_valid_context() here, as the FTDI chip may not be completely configured when SetMode is called */
@@ -280,14 +490,23 @@ int SetMode(struct mpsse_context *mpsse, int endianess)
 		/* During reads and writes the chip select pin is brought low */
 		mpsse->pstart &= ~CS;
 
-		/* Disable FTDI internal loopback */
-	        SetLoopback(mpsse, 0);
-
 		/* Send ACKs by default */
 		SetAck(mpsse, ACK);
 
+		/* Three phase clocking is only used in I2C mode */
+		three_phase = (mpsse->mode == I2C);
+
+		/* Disable FTDI internal loopback */
+		if(mpsse->settings.loopback != 0)
+		{
+			setup_commands[setup_commands_size++] = LOOPBACK_END;
+		}
+
 		/* Ensure adaptive clock is disabled */
-		setup_commands[setup_commands_size++] = DISABLE_ADAPTIVE_CLOCK;
+		if(mpsse->settings.adaptive != 0)
+		{
+			setup_commands[setup_commands_size++] = DISABLE_ADAPTIVE_CLOCK;
+		}
 
 		switch(mpsse->mode)
 		{
@@ -351,8 +570,21 @@ int SetMode(struct mpsse_context *mpsse, int endianess)
 				mpsse->pstart &= ~DO & ~DI;
 				/* I2C stop bit == data line goes from low to high while clock line is high - set data line low here, so the transition to the idle state triggers the stop condition. */
 				mpsse->pstop &= ~DO & ~DI;
-				/* Enable three phase clock to ensure that I2C data is available on both the rising and falling clock edges */
-				setup_commands[setup_commands_size++] = ENABLE_3_PHASE_CLOCK;
+				break;
+			case JTAG:
+				/* TCK idles low; TMS (CS) is held low so that pin updates never look like a TMS command to the TAP */
+				mpsse->pidle &= ~SK & ~CS;
+				mpsse->pstart &= ~SK & ~CS;
+				mpsse->pstop &= ~SK & ~CS;
+				/* JTAG shifts data LSB first; TDI changes on the falling edge of TCK and TDO is sampled on the rising edge */
+				mpsse->tx |= MPSSE_LSB | MPSSE_WRITE_NEG;
+				mpsse->rx |= MPSSE_LSB;
+				mpsse->rx &= ~MPSSE_READ_NEG;
+				mpsse->txrx |= MPSSE_LSB | MPSSE_WRITE_NEG;
+				mpsse->txrx &= ~MPSSE_READ_NEG;
+				mpsse->endianess = LSB;
+				/* The TAP will be reset before it is first used */
+				mpsse->tap_state = TAP_UNKNOWN;
 				break;
 			case GPIO:
 				break;
@@ -360,26 +592,43 @@ int SetMode(struct mpsse_context *mpsse, int endianess)
 				retval = MPSSE_FAIL;
 		}
 
-		/* Send any setup commands to the chip */
-		if(retval == MPSSE_OK && setup_commands_size > 0)
+		/* 
+		 * Enable three phase clock in I2C mode to ensure that I2C data is available on both the rising and falling clock edges.
+		 * It may have been left enabled if the context was previously switched from I2C mode, so disable it in all other modes.
+		 */
+		if(mpsse->settings.three_phase != three_phase)
 		{
-			retval = raw_write(mpsse, setup_commands, setup_commands_size);
+			setup_commands[setup_commands_size++] = three_phase ? ENABLE_3_PHASE_CLOCK : DISABLE_3_PHASE_CLOCK;
 		}
-	
+
 		if(retval == MPSSE_OK)
 		{
-			/* Set the idle pin states */
-			set_bits_low(mpsse, mpsse->pidle);
-	
 			/* All GPIO pins are outputs, set low */
 			mpsse->trish = 0xFF;
 			mpsse->gpioh = 0x00;
-	
-	                buf[i++] = SET_BITS_HIGH;
-	                buf[i++] = mpsse->gpioh;
-	                buf[i++] = mpsse->trish;
-	
-			retval = raw_write(mpsse, buf, i);
+
+			/* Set the idle pin states; these are always sent, as any other command may have changed the pins */
+			setup_commands[setup_commands_size++] = SET_BITS_LOW;
+			setup_commands[setup_commands_size++] = mpsse->pidle;
+			setup_commands[setup_commands_size++] = mpsse->tris;
+
+			setup_commands[setup_commands_size++] = SET_BITS_HIGH;
+			setup_commands[setup_commands_size++] = mpsse->gpioh;
+			setup_commands[setup_commands_size++] = mpsse->trish;
+
+			/* Send the setup commands and pin states to the chip in a single write */
+			retval = raw_write(mpsse, setup_commands, setup_commands_size);
+		}
+
+		if(retval == MPSSE_OK)
+		{
+			mpsse->settings.loopback = 0;
+			mpsse->settings.adaptive = 0;
+			mpsse->settings.three_phase = three_phase;
+		}
+		else
+		{
+			forget_settings(mpsse);
 		}
 	}
 	else
@@ -392,6 +641,9 @@ int SetMode(struct mpsse_context *mpsse, int endianess)
 
 /* 
  * Sets the appropriate divisor for the desired clock frequency.
+ * The clock is set to the fastest frequency the chip can generate that does not exceed freq, see PlanClock().
+ * In I2C mode, the three phase clocking is allowed for, so that freq is the actual bit rate.
+ * Nothing is sent to the chip if it is already running at the resulting frequency.
  *
  * @mpsse - MPSSE context pointer.
  * @freq  - Desired clock frequency in hertz.
@@ -402,66 +654,295 @@ int SetMode(struct mpsse_context *mpsse, int endianess)
 int SetClock(struct mpsse_context *mpsse, uint32_t freq)
 {
 	int retval = MPSSE_FAIL;
-	uint32_t system_clock = 0;
-	uint16_t divisor = 0;
-	unsigned char buf[CMD_SIZE] = { 0 };
+	struct mpsse_clock_plan plan = { 0 };
 
 	/* Do not call is_valid_context() here, as the FTDI chip may not be completely configured when SetClock is called */
-	if(mpsse)
+	if(PlanClock(mpsse, freq, 0, &plan) == MPSSE_OK)
+	{
+		retval = SetClockPlan(mpsse, &plan);
+	}
+
+	return retval;
+}
+
+/*
+ * Works out the clock configuration to use for a requested frequency, without changing the clock.
+ * Of the frequencies the chip can generate, the fastest one that is no more than tolerance above freq is chosen.
+ * In I2C mode, three phase clocking spends three clock phases on each bit instead of two; this is taken into
+ * account, so that the planned frequency is the actual rate at which bits are clocked.
+ *
+ * @mpsse     - MPSSE context pointer.
+ * @freq      - Desired clock frequency in hertz.
+ * @tolerance - How far above freq the chosen frequency may be, as a fraction of freq (e.g., 0.05 for 5%).
+ * @plan      - Pointer to a struct mpsse_clock_plan, which is filled in with the chosen configuration.
+ *
+ * Returns MPSSE_OK on success.
+ * Returns MPSSE_FAIL on failure.
+ */
+int PlanClock(struct mpsse_context *mpsse, uint32_t freq, double tolerance, struct mpsse_clock_plan *plan)
+{
+	int retval = MPSSE_FAIL, i = 0, phases = CLOCK_PHASES, count = 1, frequency = 0;
+	uint32_t system_clocks[] = { TWELVE_MHZ, SIXTY_MHZ };
+	uint16_t divisor = 0;
+	double limit = 0;
+
+	/* Do not call is_valid_context() here, as PlanClock is called by SetClock while the chip is being configured */
+	if(mpsse && plan && tolerance >= 0)
 	{
-		if(freq > SIX_MHZ)
+		memset(plan, 0, sizeof(struct mpsse_clock_plan));
+
+		if(mpsse->mode == I2C)
 		{
-			buf[0] = TCK_X5;
-			system_clock = SIXTY_MHZ;
+			phases = I2C_CLOCK_PHASES;
+			plan->three_phase = 1;
 		}
-		else
+
+		/* The 60MHz clock is only available on the H series chips */
+		if(has_clock_x5(mpsse))
 		{
-			buf[0] = TCK_D5;
-			system_clock = TWELVE_MHZ;
+			count = 2;
 		}
-		
-		if(raw_write(mpsse, buf, 1) == MPSSE_OK)
+
+		limit = freq * (1 + tolerance);
+
+		for(i=0; i<count; i++)
 		{
-			if(freq <= 0)
-			{
-				divisor = 0xFFFF;
-			}
-			else
+			divisor = freq2div(system_clocks[i], limit, phases);
+			frequency = div2freq(system_clocks[i], divisor, phases);
+
+			/* 
+			 * Choose the fastest frequency within the limit, or the slowest one if even the largest divisor is too fast.
+			 * Prefer the 12MHz clock if both clocks can generate the same frequency.
+			 */
+			if(i == 0 || (frequency <= limit && frequency > plan->frequency) || (plan->frequency > limit && frequency < plan->frequency))
 			{
-				divisor = freq2div(system_clock, freq);
+				plan->frequency = frequency;
+				plan->system_clock = system_clocks[i];
+				plan->divisor = divisor;
 			}
-	
-			buf[0] = TCK_DIVISOR;
-			buf[1] = (divisor & 0xFF);
-			buf[2] = ((divisor >> 8) & 0xFF);
-	
-			if(raw_write(mpsse, buf, 3) == MPSSE_OK)
+		}
+
+		/* The next faster frequency is the smallest one that either clock can generate with one less divisor step */
+		for(i=0; i<count; i++)
+		{
+			divisor = freq2div(system_clocks[i], limit, phases);
+			if(divisor > 0)
 			{
-				mpsse->clock = div2freq(system_clock, divisor);
-				retval = MPSSE_OK;
+				frequency = div2freq(system_clocks[i], divisor - 1, phases);
+				if(frequency > plan->frequency && (plan->faster == 0 || frequency < plan->faster))
+				{
+					plan->faster = frequency;
+				}
 			}
 		}
+
+		plan->requested = freq;
+		if(freq > 0)
+		{
+			plan->error = ((double) plan->frequency - freq) / freq;
+		}
+
+		retval = MPSSE_OK;
 	}
-	
+
 	return retval;
 }
 
-/* 
- * Retrieves the last error string from libftdi.
+/*
+ * Sets the clock to a configuration returned by PlanClock().
+ * Nothing is sent to the chip if it is already running with that configuration.
+ * The plan must have been made for the current mode: the divisor of a plan made with three phase clocking 
+ * (I2C mode) gives a different frequency without it, and vice versa.
  *
  * @mpsse - MPSSE context pointer.
+ * @plan  - Pointer to a struct mpsse_clock_plan, as filled in by PlanClock().
  *
- * Returns a pointer to the last error string.
+ * Returns MPSSE_OK on success.
+ * Returns MPSSE_FAIL on failure, or if the plan was made for a different mode.
  */
-const char *ErrorString(struct mpsse_context *mpsse)
+int SetClockPlan(struct mpsse_context *mpsse, struct mpsse_clock_plan *plan)
 {
-	if(mpsse != NULL)
+	int retval = MPSSE_FAIL, i = 0, clock_base = 0;
+	unsigned char buf[CMD_SIZE+1] = { 0 };
+
+	/* Do not call is_valid_context() here, as the FTDI chip may not be completely configured when SetClock is called */
+	if(mpsse && plan && plan->divisor >= 0 && plan->divisor <= MAX_CLOCK_DIVISOR && plan->three_phase == (mpsse->mode == I2C))
 	{
-        	return ftdi_get_error_string(&mpsse->ftdi);
+		if(plan->system_clock == SIXTY_MHZ && has_clock_x5(mpsse))
+		{
+			clock_base = TCK_X5;
+		}
+		else if(plan->system_clock == TWELVE_MHZ)
+		{
+			clock_base = TCK_D5;
+		}
 	}
 
-	return NULL_CONTEXT_ERROR_MSG;
-}
+	if(clock_base)
+	{
+		/* Only send the parts of the clock configuration that have changed */
+		if(mpsse->settings.clock_base != clock_base)
+		{
+			buf[i++] = clock_base;
+		}
+
+		if(mpsse->settings.divisor != plan->divisor)
+		{
+			buf[i++] = TCK_DIVISOR;
+			buf[i++] = (plan->divisor & 0xFF);
+			buf[i++] = ((plan->divisor >> 8) & 0xFF);
+		}
+	
+		if(i == 0 || raw_write(mpsse, buf, i) == MPSSE_OK)
+		{
+			mpsse->settings.clock_base = clock_base;
+			mpsse->settings.divisor = plan->divisor;
+			mpsse->clock = plan->frequency;
+			retval = MPSSE_OK;
+		}
+		else
+		{
+			forget_settings(mpsse);
+		}
+	}
+	
+	return retval;
+}
+
+/*
+ * Switches an open context to a different mode, clock frequency and byte order without closing and 
+ * reopening the device. Switching to or from BITBANG mode is not supported. Only the chip settings that
+ * differ from the current ones are sent, along with the idle pin states, in a single USB write.
+ *
+ * @mpsse     - MPSSE context pointer.
+ * @mode      - MPSSE mode, one of: SPI0, SPI1, SPI2, SPI3, I2C, GPIO, JTAG.
+ * @freq      - Clock frequency to use for the specified mode.
+ * @endianess - Specifies how data is clocked in/out (MSB, LSB).
+ *
+ * Returns MPSSE_OK on success.
+ * Returns MPSSE_FAIL on failure, in which case the context is left in its previous mode.
+ */
+int SwitchMode(struct mpsse_context *mpsse, enum modes mode, int freq, int endianess)
+{
+	int retval = MPSSE_FAIL, batched = 0;
+	struct mpsse_context saved;
+
+	if(is_valid_context(mpsse) && mpsse->mode != BITBANG && !mpsse->stream && 
+	   ((mode >= SPI0 && mode <= GPIO) || mode == JTAG) && (endianess == MSB || endianess == LSB))
+	{
+		/* Keep a copy of the current mode settings, to put back if the chip can't be switched */
+		memcpy(&saved, mpsse, sizeof(struct mpsse_context));
+
+		mpsse->mode = mode;
+		mpsse->status = STOPPED;
+		mpsse->endianess = endianess;
+
+		if(mpsse->mode == I2C)
+		{
+			mpsse->xsize = I2C_TRANSFER_SIZE;
+		}
+		else
+		{
+			mpsse->xsize = SPI_RW_SIZE;
+		}
+
+		/* Queue the clock and mode commands so that they are sent to the chip together, unless the caller is already batching */
+		batched = (BeginBatch(mpsse) == MPSSE_OK);
+
+		if(SetClock(mpsse, freq) == MPSSE_OK && SetMode(mpsse, endianess) == MPSSE_OK)
+		{
+			retval = MPSSE_OK;
+		}
+
+		if(batched)
+		{
+			if(retval == MPSSE_OK && batch_sync(mpsse) != MPSSE_OK)
+			{
+				retval = MPSSE_FAIL;
+			}
+
+			mpsse->batch = 0;
+		}
+		else if(retval != MPSSE_OK)
+		{
+			/* Drop anything that was queued in the caller's batch */
+			mpsse->batch_size = saved.batch_size;
+			mpsse->coalesce_end = saved.coalesce_end;
+		}
+
+		if(retval != MPSSE_OK)
+		{
+			mpsse->mode = saved.mode;
+			mpsse->status = saved.status;
+			mpsse->endianess = saved.endianess;
+			mpsse->xsize = saved.xsize;
+			mpsse->clock = saved.clock;
+			mpsse->tx = saved.tx;
+			mpsse->rx = saved.rx;
+			mpsse->txrx = saved.txrx;
+			mpsse->tack = saved.tack;
+			mpsse->tris = saved.tris;
+			mpsse->pidle = saved.pidle;
+			mpsse->pstart = saved.pstart;
+			mpsse->pstop = saved.pstop;
+			mpsse->trish = saved.trish;
+			mpsse->gpioh = saved.gpioh;
+			mpsse->tap_state = saved.tap_state;
+
+			/* Some of the new settings may have reached the chip */
+			forget_settings(mpsse);
+		}
+	}
+
+	return retval;
+}
+
+/*
+ * Checks that the chip is still connected and responding, by sending it an invalid command and 
+ * checking for the bad command response. Any unread data in the chip's buffers is discarded.
+ * Always fails in BITBANG mode, or while a batch or stream is in progress.
+ *
+ * @mpsse - MPSSE context pointer.
+ *
+ * Returns MPSSE_OK if the chip responded.
+ * Returns MPSSE_FAIL otherwise.
+ */
+int Ping(struct mpsse_context *mpsse)
+{
+	int retval = MPSSE_FAIL;
+
+	if(is_valid_context(mpsse) && mpsse->mode != BITBANG && !mpsse->batch && !mpsse->stream)
+	{
+		if(mpsse_active(mpsse))
+		{
+			retval = MPSSE_OK;
+		}
+	}
+
+	return retval;
+}
+
+/* 
+ * Retrieves the last error string from libftdi.
+ *
+ * @mpsse - MPSSE context pointer.
+ *
+ * Returns a pointer to the last error string.
+ */
+const char *ErrorString(struct mpsse_context *mpsse)
+{
+	if(mpsse != NULL)
+	{
+		if(mpsse->transport)
+		{
+			return mpsse->transport->error_string(mpsse);
+		}
+
+        	return ftdi_get_error_string(&mpsse->ftdi);
+	}
+
+	return NULL_CONTEXT_ERROR_MSG;
+}
 
 /* 
  * Gets the currently configured clock rate.
@@ -565,6 +1046,7 @@ int SetLoopback(struct mpsse_context *mpsse, int enable)
 		}
 
 		retval = raw_write(mpsse, buf, 1);
+		mpsse->settings.loopback = (retval == MPSSE_OK) ? (enable != 0) : -1;
 	}
 
 	return retval;
@@ -684,35 +1166,25 @@ int Start(struct mpsse_context *mpsse)
  */
 int WriteBits(struct mpsse_context *mpsse, char bits, int size)
 {
-	char data[8] = { 0 };
-	int i = 0, retval = MPSSE_OK;
+	unsigned char data = 0;
+	int retval = MPSSE_FAIL;
 
-	if(size > sizeof(data))
+	if(is_valid_context(mpsse))
 	{
-		size = sizeof(data);
-	}
+		if(size > 8)
+		{
+			size = 8;
+		}
 
-	/* Convert each bit in bits to an array of bytes */
-	for(i=0; i<size; i++)
-	{
-		if(bits & (1 << i))
+		/* The bits to write are the least significant size bits of bits; WriteBitstream expects MSB first bits at the top of the byte */
+		data = (unsigned char) bits;
+		if(mpsse->endianess == MSB)
 		{
-			/* Be sure to honor endianess */
-			if(mpsse->endianess == LSB)
-			{
-				data[i] = '\xFF';
-			}
-			else
-			{
-				data[size-i-1] = '\xFF';
-			}
+			data <<= (8 - size);
 		}
-	}
 
-	/* Enable bit mode before writing, then disable it afterwards. */
-	EnableBitmode(mpsse, 1);
-	retval = Write(mpsse, data, size);
-	EnableBitmode(mpsse, 0);
+		retval = WriteBitstream(mpsse, (char *) &data, 1, size);
+	}
 
 	return retval;
 }
@@ -730,12 +1202,22 @@ int WriteBits(struct mpsse_context *mpsse, char bits, int size)
 int Write(struct mpsse_context *mpsse, char *data, int size)
 {
 	unsigned char *buf = NULL;
-	int retval = MPSSE_FAIL, buf_size = 0, txsize = 0, n = 0;
+	int retval = MPSSE_FAIL, buf_size = 0, txsize = 0, n = 0, i = 0;
 
 	if(is_valid_context(mpsse))
 	{
 		if(mpsse->mode)
 		{
+			/* In I2C mode, one ACK bit is read back for each byte written */
+			if(mpsse->mode == I2C)
+			{
+				mpsse->ack_count = 0;
+				if(pool_buffer(mpsse, &mpsse->acks, &mpsse->acks_alloc, size) != MPSSE_OK)
+				{
+					return MPSSE_FAIL;
+				}
+			}
+
 			while(n < size)
 			{
 				txsize = size - n;
@@ -744,38 +1226,45 @@ int Write(struct mpsse_context *mpsse, char *data, int size)
 					txsize = mpsse->xsize;
 				}
 	
-				/* 
-				 * For I2C we need to send each byte individually so that we can 
-				 * read back each individual ACK bit, so set the transmit size to 1.
-				 */
-				if(mpsse->mode == I2C)
-				{
-					txsize = 1;
-				}
-	
 				buf = build_block_buffer(mpsse, mpsse->tx, (unsigned char *) (data + n), txsize, &buf_size);
 				if(buf)
 				{	
 					retval = raw_write(mpsse, buf, buf_size);
-					n += txsize;
-					free(buf);
 	
 					if(retval == MPSSE_FAIL)
 					{
 						break;
 					}
 				
-					/* Read in the ACK bit and store it in mpsse->rack */
+					/* Read in the ACK bits for every byte in this block in one go */
 					if(mpsse->mode == I2C)
 					{
-						raw_read(mpsse, (unsigned char *) &mpsse->rack, 1);
+						if(raw_read(mpsse, mpsse->acks + n, txsize) != txsize)
+						{
+							retval = MPSSE_FAIL;
+							break;
+						}
 					}
+
+					n += txsize;
 				}
 				else
 				{
 					break;
 				}
 			}
+
+			/* The ACK data isn't available until the batch is flushed */
+			if(mpsse->mode == I2C && n > 0 && !mpsse->batch)
+			{
+				for(i=0; i<n; i++)
+				{
+					mpsse->acks[i] &= 0x01;
+				}
+
+				mpsse->ack_count = n;
+				mpsse->rack = mpsse->acks[n-1];
+			}
 		}
 	
 		if(retval == MPSSE_OK && n == size)
@@ -787,55 +1276,50 @@ int Write(struct mpsse_context *mpsse, char *data, int size)
 	return retval;
 }
 
-/* Performs a read. For internal use only; see Read() and ReadBits(). */
-char *InternalRead(struct mpsse_context *mpsse, int size)
+/* 
+ * Performs a read into buf. For internal use only; see Read() and ReadBits().
+ * Returns the number of bytes read.
+ */
+int InternalRead(struct mpsse_context *mpsse, unsigned char *buf, int size)
 {
-	unsigned char *data = NULL, *buf = NULL;
-	unsigned char sbuf[SPI_RW_SIZE] = { 0 };
+	unsigned char *data = NULL;
 	int n = 0, rxsize = 0, data_size = 0, retval = 0;
 
 	if(is_valid_context(mpsse))
 	{
 		if(mpsse->mode)
 		{
-			buf = malloc(size);
-			if(buf)
+			while(n < size)
 			{
-				memset(buf, 0, size);
-	
-				while(n < size)
+				rxsize = size - n;
+				if(rxsize > mpsse->xsize)
 				{
-					rxsize = size - n;
-					if(rxsize > mpsse->xsize)
-					{
-						rxsize = mpsse->xsize;
-					}
-	
-					data = build_block_buffer(mpsse, mpsse->rx, sbuf, rxsize, &data_size);
-					if(data)
+					rxsize = mpsse->xsize;
+				}
+
+				data = build_block_buffer(mpsse, mpsse->rx, NULL, rxsize, &data_size);
+				if(data)
+				{
+					retval = raw_write(mpsse, data, data_size);
+					
+					if(retval == MPSSE_OK)
 					{
-						retval = raw_write(mpsse, data, data_size);
-						free(data);
-						
-						if(retval == MPSSE_OK)
-						{
-							n += raw_read(mpsse, buf+n, rxsize);
-						}
-						else
-						{
-							break;
-						}
+						n += raw_read(mpsse, buf+n, rxsize);
 					}
 					else
 					{
 						break;
 					}
 				}
+				else
+				{
+					break;
+				}
 			}
 		}
 	}
 
-	return (char *) buf;
+	return n;
 }
 
 /*
@@ -853,16 +1337,37 @@ swig_string_data Read(struct mpsse_context *mpsse, int size)
 char *Read(struct mpsse_context *mpsse, int size)
 #endif
 {
-	char *buf = NULL;
-
-	buf = InternalRead(mpsse, size);
-
 #ifdef SWIGPYTHON
+	int n = 0;
 	swig_string_data sdata = { 0 };
-	sdata.size = size;
-	sdata.data = buf;
+
+	/* The Python wrapper copies the data out immediately, so the context's reusable read buffer can be returned */
+	if(is_valid_context(mpsse) && pool_buffer(mpsse, &mpsse->rx_buf, &mpsse->rx_alloc, size) == MPSSE_OK)
+	{
+		n = InternalRead(mpsse, mpsse->rx_buf, size);
+		if(n < size)
+		{
+			memset(mpsse->rx_buf + n, 0, size - n);
+		}
+
+		sdata.size = size;
+		sdata.data = (char *) mpsse->rx_buf;
+	}
+
 	return sdata;
 #else
+	char *buf = NULL;
+
+	if(is_valid_context(mpsse))
+	{
+		buf = malloc(size);
+		if(buf)
+		{
+			memset(buf, 0, size);
+			InternalRead(mpsse, (unsigned char *) buf, size);
+		}
+	}
+
 	return buf;
 #endif
 }
@@ -878,381 +1383,1607 @@ char *Read(struct mpsse_context *mpsse, int size)
 char ReadBits(struct mpsse_context *mpsse, int size)
 {
 	char bits = 0;
-	char *rdata = NULL;
 
 	if(size > 8)
 	{
 		size = 8;
 	}
 
-	EnableBitmode(mpsse, 1);
-	rdata = InternalRead(mpsse, size);
-	EnableBitmode(mpsse, 0);
-
-	if(rdata)
+	/* 
+	 * In MSB mode, the read bits are returned in the most significant bits of the byte;
+	 * in LSB mode, they are returned in the least significant bits.
+	 */
+	if(ReadBitstream(mpsse, &bits, 1, size) != MPSSE_OK)
 	{
-		/* The last byte in rdata will have all the read bits set or unset as needed. */
-		bits = rdata[size-1];
-
-		if(mpsse->endianess == MSB)
-		{
-			/*
-			 * In MSB mode, bits are sifted in from the left. If less than 8 bits were
-			 * read, we need to shift them left accordingly.
-			 */
-			bits = bits << (8-size);
-		}
-		else if(mpsse->endianess == LSB)
-		{
-			/* 
-			 * In LSB mode, bits are shifted in from the right. If less than 8 bits were
-			 * read, we need to shift them right accordingly.
-			 */
-			bits = bits >> (8-size);
-		}
-		
-		free(rdata);
+		bits = 0;
 	}
 
 	return bits;
 }
 
-/*
- * Reads and writes data over the selected serial protocol (SPI only).
- * 
- * @mpsse - MPSSE context pointer.
- * @data  - Buffer containing bytes to write.
- * @size  - Number of bytes to transfer.
- *
- * Returns a pointer to the read data on success.
- * Returns NULL on failure.
+/* 
+ * Clocks nbits bits out of data and / or into rdata using the cmd data transfer command, see WriteBitstream().
+ * For internal use only. Returns MPSSE_OK on success, MPSSE_FAIL on failure.
  */
-#ifdef SWIGPYTHON
-swig_string_data Transfer(struct mpsse_context *mpsse, char *data, int size)
-#else
-char *Transfer(struct mpsse_context *mpsse, char *data, int size)
-#endif
+int InternalBitstream(struct mpsse_context *mpsse, uint8_t cmd, unsigned char *data, unsigned char *rdata, int nbits)
 {
-	unsigned char *txdata = NULL, *buf = NULL;
-	int n = 0, data_size = 0, rxsize = 0, retval = 0;
+	unsigned char *buf = NULL;
+	int retval = MPSSE_FAIL, buf_size = 0, n = 0, chunk = 0, bytes = 0, bits = 0;
 
-	if(is_valid_context(mpsse))
+	if(is_valid_context(mpsse) && mpsse->mode != I2C && mpsse->mode != BITBANG && nbits > 0)
 	{
-		/* Make sure we're configured for one of the SPI modes */
-		if(mpsse->mode >= SPI0 && mpsse->mode <= SPI3)
+		retval = MPSSE_OK;
+
+		/* Each chunk of up to xsize bytes is sent as a single USB write, with any remaining bits added to the last chunk */
+		while(retval == MPSSE_OK && n < nbits)
 		{
-			buf = malloc(size);
-			if(buf)
+			chunk = nbits - n;
+			if(chunk > (mpsse->xsize * 8))
 			{
-				memset(buf, 0, size);
+				chunk = mpsse->xsize * 8;
+			}
 
-				while(n < size)
-				{
-					/* When sending and recieving, FTDI chips don't seem to like large data blocks. Limit the size of each block to SPI_TRANSFER_SIZE */
-					rxsize = size - n;
-					if(rxsize > SPI_TRANSFER_SIZE)
-					{
-						rxsize = SPI_TRANSFER_SIZE;
-					}
+			bytes = (chunk + 7) / 8;
+			bits = chunk % 8;
 
-					txdata = build_block_buffer(mpsse, mpsse->txrx, (unsigned char *) (data + n), rxsize, &data_size);
-					if(txdata)
+			buf = build_bitstream_buffer(mpsse, cmd, data ? data + (n / 8) : NULL, chunk, &buf_size);
+			if(buf == NULL || raw_write(mpsse, buf, buf_size) != MPSSE_OK)
+			{
+				retval = MPSSE_FAIL;
+			}
+			else if(rdata)
+			{
+				if(raw_read(mpsse, rdata + (n / 8), bytes) != bytes)
+				{
+					retval = MPSSE_FAIL;
+				}
+				/* The read data isn't available until the batch is flushed */
+				else if(bits && !mpsse->batch)
+				{
+					/* 
+					 * Bits are shifted in at the bottom of the byte in MSB mode, and at the top in LSB mode.
+					 * Move them to where they would be had a whole byte been read.
+					 */
+					if(mpsse->endianess == MSB)
 					{
-						retval = raw_write(mpsse, txdata, data_size);
-						free(txdata);
-
-						if(retval == MPSSE_OK)
-						{
-							n += raw_read(mpsse, (buf + n), rxsize);
-						}
-						else
-						{
-							break;
-						}
+						rdata[(n / 8) + bytes - 1] <<= (8 - bits);
 					}
 					else
 					{
-						break;
+						rdata[(n / 8) + bytes - 1] >>= (8 - bits);
 					}
 				}
 			}
+
+			n += chunk;
 		}
 	}
 
-#ifdef SWIGPYTHON
-	swig_string_data sdata = { 0 };
-	sdata.size = n;
-	sdata.data = (char *) buf;
-	return sdata;
-#else
-	return (char *) buf;
-#endif
+	return retval;
 }
 
 /*
- * Returns the last received ACK bit.
+ * Writes an arbitrary number of bits out via the selected serial protocol. For use in SPI modes only.
+ * Bits are taken from data in the order that they are sent: in MSB mode the first bit is the most significant 
+ * bit of the first byte, in LSB mode it is the least significant bit. The whole bytes are clocked with one 
+ * byte-clock command and any remaining bits with one bit-clock command, in a single USB write.
  *
  * @mpsse - MPSSE context pointer.
+ * @data  - Buffer containing the bits to write.
+ * @size  - Size of data, in bytes. Must be at least (nbits + 7) / 8.
+ * @nbits - Number of bits to write.
  *
- * Returns either an ACK (0) or a NACK (1).
+ * Returns MPSSE_OK on success.
+ * Returns MPSSE_FAIL on failure.
  */
-int GetAck(struct mpsse_context *mpsse)
-{	
-	int ack = 0;
+int WriteBitstream(struct mpsse_context *mpsse, char *data, int size, int nbits)
+{
+	int retval = MPSSE_FAIL;
 
-	if(is_valid_context(mpsse))
+	if(is_valid_context(mpsse) && nbits <= (size * 8))
 	{
-		ack = (mpsse->rack & 0x01);
+		retval = InternalBitstream(mpsse, mpsse->tx, (unsigned char *) data, NULL, nbits);
 	}
 
-	return ack;
+	return retval;
 }
 
 /*
- * Sets the transmitted ACK bit.
+ * Reads an arbitrary number of bits over the selected serial protocol. For use in SPI modes only.
+ * Bits are stored in rdata in the order they were received, packed as for WriteBitstream(); any unused bits in
+ * the last byte are set to zero. 
  *
  * @mpsse - MPSSE context pointer.
- * @ack   - 0 to send ACKs, 1 to send NACKs.
+ * @rdata - Buffer to store the read bits in.
+ * @rsize - Size of rdata, in bytes. Must be at least (nbits + 7) / 8.
+ * @nbits - Number of bits to read.
  *
- * Returns void.
+ * Returns MPSSE_OK on success.
+ * Returns MPSSE_FAIL on failure.
  */
-void SetAck(struct mpsse_context *mpsse, int ack)
+int ReadBitstream(struct mpsse_context *mpsse, char *rdata, int rsize, int nbits)
 {
-	if(is_valid_context(mpsse))
+	int retval = MPSSE_FAIL;
+
+	if(is_valid_context(mpsse) && nbits <= (rsize * 8))
 	{
-		if(ack == NACK)
-		{
-			mpsse->tack = 0xFF;
-		}
-		else
-		{
-			mpsse->tack = 0x00;
-		}
+		retval = InternalBitstream(mpsse, mpsse->rx, NULL, (unsigned char *) rdata, nbits);
 	}
 
-	return;
+	return retval;
 }
 
 /*
- * Causes libmpsse to send ACKs after each read byte in I2C mode.
+ * Writes and reads an arbitrary number of bits over the selected serial protocol. For use in SPI modes only.
+ * The bits are packed as for WriteBitstream().
  *
  * @mpsse - MPSSE context pointer.
+ * @data  - Buffer containing the bits to write.
+ * @size  - Size of data, in bytes. Must be at least (nbits + 7) / 8.
+ * @rdata - Buffer to store the read bits in.
+ * @rsize - Size of rdata, in bytes. Must be at least (nbits + 7) / 8.
+ * @nbits - Number of bits to transfer.
  *
- * Returns void.
+ * Returns MPSSE_OK on success.
+ * Returns MPSSE_FAIL on failure.
  */
-void SendAcks(struct mpsse_context *mpsse)
+int TransferBitstream(struct mpsse_context *mpsse, char *data, int size, char *rdata, int rsize, int nbits)
 {
-	return SetAck(mpsse, ACK);
+	int retval = MPSSE_FAIL;
+
+	if(is_valid_context(mpsse) && nbits <= (size * 8) && nbits <= (rsize * 8))
+	{
+		retval = InternalBitstream(mpsse, mpsse->txrx, (unsigned char *) data, (unsigned char *) rdata, nbits);
+	}
+
+	return retval;
 }
 
-/*
- * Causes libmpsse to send NACKs after each read byte in I2C mode.
+/* 
+ * Shifts nbits bits of data through the IR or DR and stores the bits shifted out in rdata (if rdata is not NULL), 
+ * finishing in state end. For internal use only; see JTAGShiftIR() and JTAGShiftDR().
+ * Returns MPSSE_OK on success, MPSSE_FAIL on failure.
+ */
+int InternalJTAGShift(struct mpsse_context *mpsse, int shift_state, unsigned char *data, unsigned char *rdata, int nbits, int end)
+{
+	unsigned char *buf = NULL;
+	int retval = MPSSE_FAIL, i = 0, n = 0, bits = 0, rbytes = 0, last = 0;
+	uint8_t cmd = 0;
+
+	if(is_valid_context(mpsse) && mpsse->mode == JTAG && data && nbits > 0 && nbits <= (mpsse->xsize * 8) && end >= 0 && end < NUM_TAP_STATES)
+	{
+		/* All but the last bit are shifted with data commands; the last one is shifted as TMS goes high to leave the shift state */
+		n = nbits - 1;
+		bits = n % 8;
+		rbytes = ((n + 7) / 8) + 1;
+		cmd = rdata ? mpsse->txrx : mpsse->tx;
+
+		if(pool_buffer(mpsse, &mpsse->cmd_buf, &mpsse->cmd_alloc, (TMS_MOVE_SIZE * 2) + (CMD_SIZE * 3) + (n / 8) + 1) == MPSSE_OK &&
+		   (rdata == NULL || pool_buffer(mpsse, &mpsse->rx_buf, &mpsse->rx_alloc, rbytes) == MPSSE_OK))
+		{
+			/* The whole scan, from the current state to the end state, is sent to the chip in a single write */
+			buf = mpsse->cmd_buf;
+			i += tap_move(mpsse, buf + i, shift_state);
+			i += bitstream_commands(buf + i, cmd, data, n);
+
+			last = (data[n / 8] >> bits) & 1;
+			buf[i++] = TMS_WRITE | (rdata ? MPSSE_DO_READ : 0);
+			buf[i++] = 0;
+			buf[i++] = (last << 7) | 1;
+			mpsse->tap_state = tap_transitions[shift_state][1];
+
+			i += tap_move(mpsse, buf + i, end);
+
+			retval = raw_write(mpsse, buf, i);
+			if(retval == MPSSE_OK && rdata)
+			{
+				if(raw_read(mpsse, mpsse->rx_buf, rbytes) != rbytes)
+				{
+					retval = MPSSE_FAIL;
+				}
+				/* The read data isn't available until the batch is flushed */
+				else if(!mpsse->batch)
+				{
+					/* The bits of a partial byte are shifted in at the top, and the last bit is at the top of the TMS command's byte */
+					memcpy(rdata, mpsse->rx_buf, n / 8);
+					rdata[n / 8] = bits ? (mpsse->rx_buf[n / 8] >> (8 - bits)) : 0;
+					rdata[n / 8] |= ((mpsse->rx_buf[rbytes - 1] >> 7) & 1) << bits;
+				}
+			}
+		}
+
+		if(retval != MPSSE_OK)
+		{
+			mpsse->tap_state = TAP_UNKNOWN;
+		}
+	}
+
+	return retval;
+}
+
+/* 
+ * Resets the JTAG TAP by clocking TMS high TAP_RESET_CLOCKS times, leaving it in the TAP_RESET state. For use in JTAG mode only.
  *
  * @mpsse - MPSSE context pointer.
  *
- * Returns void.
+ * Returns MPSSE_OK on success.
+ * Returns MPSSE_FAIL on failure.
  */
-void SendNacks(struct mpsse_context *mpsse)
+int JTAGReset(struct mpsse_context *mpsse)
 {
-	return SetAck(mpsse, NACK);
+	int retval = MPSSE_FAIL;
+
+	if(is_valid_context(mpsse) && mpsse->mode == JTAG)
+	{
+		mpsse->tap_state = TAP_UNKNOWN;
+		retval = JTAGSetState(mpsse, TAP_RESET);
+	}
+
+	return retval;
 }
 
-/*
- * Send data stop condition.
+/* 
+ * Moves the JTAG TAP to the requested state, along the shortest path from its current state. For use in JTAG mode only.
+ * If the current state is not known, the TAP is reset first.
  *
  * @mpsse - MPSSE context pointer.
+ * @state - One of enum tap_states, except TAP_UNKNOWN.
  *
  * Returns MPSSE_OK on success.
  * Returns MPSSE_FAIL on failure.
  */
-int Stop(struct mpsse_context *mpsse)
+int JTAGSetState(struct mpsse_context *mpsse, int state)
 {
-	int retval = MPSSE_OK;
+	int retval = MPSSE_FAIL, i = 0;
+	unsigned char buf[TMS_MOVE_SIZE] = { 0 };
 
-	if(is_valid_context(mpsse))
+	if(is_valid_context(mpsse) && mpsse->mode == JTAG && state >= 0 && state < NUM_TAP_STATES)
 	{
-		/* In I2C mode, we need to ensure that the data line goes low while the clock line is low to avoid sending an inadvertent start condition */
-		if(mpsse->mode == I2C)
+		i = tap_move(mpsse, buf, state);
+		if(i == 0 || raw_write(mpsse, buf, i) == MPSSE_OK)
 		{
-			retval |= set_bits_low(mpsse, (mpsse->pidle & ~DO & ~SK));
+			retval = MPSSE_OK;
 		}
-
-		/* Send the stop condition */
-		retval |= set_bits_low(mpsse, mpsse->pstop);
-
-		if(retval == MPSSE_OK)
+		else
 		{
-			/* Restore the pins to their idle states */
-			retval |= set_bits_low(mpsse, mpsse->pidle);
+			mpsse->tap_state = TAP_UNKNOWN;
 		}
-		
-		mpsse->status = STOPPED;
 	}
-	else
+
+	return retval;
+}
+
+/* 
+ * Gets the current state of the JTAG TAP.
+ *
+ * @mpsse - MPSSE context pointer.
+ *
+ * Returns one of enum tap_states. TAP_UNKNOWN is returned if the TAP has not been reset since JTAG mode was entered.
+ */
+int JTAGGetState(struct mpsse_context *mpsse)
+{
+	int state = TAP_UNKNOWN;
+
+	if(is_valid_context(mpsse) && mpsse->mode == JTAG)
 	{
-		retval = MPSSE_FAIL;
-		mpsse->status = STOPPED;
+		state = mpsse->tap_state;
 	}
 
-	return retval;
+	return state;
 }
 
 /* 
- * Sets the specified pin high. 
+ * Shifts bits through the instruction register: moves the TAP to TAP_IRSHIFT, shifts nbits bits in from data and out
+ * to rdata, and moves the TAP on to the end state, all in a single USB write. For use in JTAG mode only.
+ * Bits are shifted LSB first: the first bit is the least significant bit of the first byte of data.
+ * When batching, several scans can be queued and sent together.
  *
  * @mpsse - MPSSE context pointer.
- * @pin   - Pin number to set high.
- * 
+ * @data  - Buffer containing the bits to shift in.
+ * @size  - Size of data, in bytes. Must be at least (nbits + 7) / 8.
+ * @rdata - Buffer to store the bits shifted out in, or NULL if they are not needed.
+ * @rsize - Size of rdata, in bytes. Must be at least (nbits + 7) / 8.
+ * @nbits - Number of bits to shift.
+ * @end   - State to leave the TAP in, usually TAP_IDLE.
+ *
  * Returns MPSSE_OK on success.
  * Returns MPSSE_FAIL on failure.
  */
-int PinHigh(struct mpsse_context *mpsse, int pin)
+int JTAGShiftIR(struct mpsse_context *mpsse, char *data, int size, char *rdata, int rsize, int nbits, int end)
 {
 	int retval = MPSSE_FAIL;
 
-	if(is_valid_context(mpsse))
+	if(nbits <= (size * 8) && (rdata == NULL || nbits <= (rsize * 8)))
 	{
-		retval = gpio_write(mpsse, pin, HIGH);
+		retval = InternalJTAGShift(mpsse, TAP_IRSHIFT, (unsigned char *) data, (unsigned char *) rdata, nbits, end);
 	}
 
 	return retval;
 }
 
-/*
- * Sets the specified pin low.
+/* 
+ * Shifts bits through the data register selected by the current instruction. See JTAGShiftIR().
  *
  * @mpsse - MPSSE context pointer.
- * @pin   - Pin number to set low.
+ * @data  - Buffer containing the bits to shift in.
+ * @size  - Size of data, in bytes. Must be at least (nbits + 7) / 8.
+ * @rdata - Buffer to store the bits shifted out in, or NULL if they are not needed.
+ * @rsize - Size of rdata, in bytes. Must be at least (nbits + 7) / 8.
+ * @nbits - Number of bits to shift.
+ * @end   - State to leave the TAP in, usually TAP_IDLE.
  *
  * Returns MPSSE_OK on success.
  * Returns MPSSE_FAIL on failure.
  */
-int PinLow(struct mpsse_context *mpsse, int pin)
+int JTAGShiftDR(struct mpsse_context *mpsse, char *data, int size, char *rdata, int rsize, int nbits, int end)
 {
 	int retval = MPSSE_FAIL;
-	
-	if(is_valid_context(mpsse))
+
+	if(nbits <= (size * 8) && (rdata == NULL || nbits <= (rsize * 8)))
 	{
-		retval = gpio_write(mpsse, pin, LOW);
+		retval = InternalJTAGShift(mpsse, TAP_DRSHIFT, (unsigned char *) data, (unsigned char *) rdata, nbits, end);
 	}
 
 	return retval;
 }
 
 /*
- * Sets the input/output direction of all pins. For use in BITBANG mode only.
- *
- * @mpsse     - MPSSE context pointer.
- * @direction - Byte indicating input/output direction of each bit.  1 is out.
+ * Reads and writes data over the selected serial protocol (SPI only).
+ * 
+ * @mpsse - MPSSE context pointer.
+ * @data  - Buffer containing bytes to write.
+ * @size  - Number of bytes to transfer.
  *
- * Returns MPSSE_OK if direction could be set, MPSSE_FAIL otherwise.
+ * Returns a pointer to the read data on success.
+ * Returns NULL on failure.
  */
-int SetDirection(struct mpsse_context *mpsse, uint8_t direction)
+#ifdef SWIGPYTHON
+swig_string_data Transfer(struct mpsse_context *mpsse, char *data, int size)
+#else
+char *Transfer(struct mpsse_context *mpsse, char *data, int size)
+#endif
 {
-	int retval = MPSSE_FAIL;
+	unsigned char *txdata = NULL, *buf = NULL;
+	int n = 0, w = 0, data_size = 0, rxsize = 0, txsize = 0, block_size = 0, window = 0, retval = MPSSE_OK;
 
 	if(is_valid_context(mpsse))
 	{
-		if(mpsse->mode == BITBANG)
+		/* Make sure we're configured for one of the SPI modes */
+		if(mpsse->mode >= SPI0 && mpsse->mode <= SPI3)
 		{
-			if(ftdi_set_bitmode(&mpsse->ftdi, direction, BITMODE_BITBANG) == 0)
-                	{
-				retval = MPSSE_OK;
+#ifdef SWIGPYTHON
+			if(pool_buffer(mpsse, &mpsse->rx_buf, &mpsse->rx_alloc, size) == MPSSE_OK)
+			{
+				buf = mpsse->rx_buf;
+			}
+#else
+			buf = malloc(size);
+			if(buf)
+			{
+				memset(buf, 0, size);
+			}
+#endif
+			if(buf)
+			{
+				block_size = transfer_block_size(mpsse);
+				window = fifo_size(mpsse);
+
+				/* 
+				 * w is the number of bytes written, n is the number of bytes read back. Keep writing txrx blocks 
+				 * as long as the unread data fits in the chip's FIFO, then read back the oldest block.
+				 */
+				while(n < size && retval == MPSSE_OK)
+				{
+					while(w < size)
+					{
+						txsize = size - w;
+						if(txsize > block_size)
+						{
+							txsize = block_size;
+						}
+
+						if((w - n + txsize) > window)
+						{
+							break;
+						}
+
+						txdata = build_block_buffer(mpsse, mpsse->txrx, (unsigned char *) (data + w), txsize, &data_size);
+						if(txdata == NULL || raw_write(mpsse, txdata, data_size) != MPSSE_OK)
+						{
+							retval = MPSSE_FAIL;
+							break;
+						}
+
+						w += txsize;
+					}
+
+					rxsize = w - n;
+					if(rxsize > block_size)
+					{
+						rxsize = block_size;
+					}
+
+					if(rxsize <= 0 || raw_read(mpsse, (buf + n), rxsize) != rxsize)
+					{
+						retval = MPSSE_FAIL;
+						break;
+					}
+
+					n += rxsize;
+				}
 			}
 		}
 	}
 
-	return retval;
+#ifdef SWIGPYTHON
+	swig_string_data sdata = { 0 };
+	sdata.size = n;
+	sdata.data = (char *) buf;
+	return sdata;
+#else
+	return (char *) buf;
+#endif
 }
 
 /*
- * Sets the input/output value of all pins. For use in BITBANG mode only.
+ * Returns the last received ACK bit.
  *
  * @mpsse - MPSSE context pointer.
- * @data  - Byte indicating bit hi/low value of each bit.
  *
- * Returns MPSSE_OK if direction could be set, MPSSE_FAIL otherwise.
+ * Returns either an ACK (0) or a NACK (1).
  */
-int WritePins(struct mpsse_context *mpsse, uint8_t data)
-{
-	int retval = MPSSE_FAIL;
+int GetAck(struct mpsse_context *mpsse)
+{	
+	int ack = 0;
 
 	if(is_valid_context(mpsse))
 	{
-		if(mpsse->mode == BITBANG)
-		{
-			if(ftdi_write_data(&mpsse->ftdi, &data, 1) == 0)
-			{
-				retval = MPSSE_OK;
-			}
-		}
+		ack = (mpsse->rack & 0x01);
 	}
-    
-	return retval;
+
+	return ack;
 }
 
 /*
- * Reads the state of the chip's pins. For use in BITBANG mode only.
+ * Returns the ACK bits received for each byte sent by the last Write() in I2C mode.
  *
  * @mpsse - MPSSE context pointer.
+ * @rdata - Buffer to store the ACK bits in, one byte per byte written; each is either an ACK (0) or a NACK (1).
+ * @rsize - Size of rdata. May be 0 to just get the number of ACK bits available.
  *
- * Returns a byte with the corresponding pin's bits set to 1 or 0.
+ * Returns the number of ACK bits available, which may be larger than rsize.
  */
-int ReadPins(struct mpsse_context *mpsse)
+int GetAcks(struct mpsse_context *mpsse, char *rdata, int rsize)
 {
-	uint8_t val = 0;
+	int count = 0;
 
 	if(is_valid_context(mpsse))
 	{
-		ftdi_read_pins((struct ftdi_context *) &mpsse->ftdi, (unsigned char *) &val);
+		count = mpsse->ack_count;
+
+		if(rdata && rsize > 0)
+		{
+			memcpy(rdata, mpsse->acks, (rsize < count) ? rsize : count);
+		}
 	}
 
-	return (int) val;
+	return count;
 }
 
 /*
- * Checks if a specific pin is high or low. For use in BITBANG mode only.
+ * Sets the transmitted ACK bit.
  *
  * @mpsse - MPSSE context pointer.
- * @pin   - The pin number.
- * @state - The state of the pins, as returned by ReadPins.
- *          If set to -1, ReadPins will automatically be called.
+ * @ack   - 0 to send ACKs, 1 to send NACKs.
  *
- * Returns a 1 if the pin is high, 0 if the pin is low.
+ * Returns void.
  */
-int PinState(struct mpsse_context *mpsse, int pin, int state)
+void SetAck(struct mpsse_context *mpsse, int ack)
 {
-	if(state == -1)
-	{
-		state = ReadPins(mpsse);
-	}
-
-	/* If not in bitbang mode, the specified pin should be one of GPIOLx. Convert these defines into an absolute pin number. */
-	if(mpsse->mode != BITBANG)
+	if(is_valid_context(mpsse))
 	{
-		pin += NUM_GPIOL_PINS;
+		if(ack == NACK)
+		{
+			mpsse->tack = 0xFF;
+		}
+		else
+		{
+			mpsse->tack = 0x00;
+		}
 	}
 
-	return ((state & (1 << pin)) >> pin);
+	return;
 }
 
 /*
- * Places all I/O pins into a tristate mode.
+ * Causes libmpsse to send ACKs after each read byte in I2C mode.
  *
  * @mpsse - MPSSE context pointer.
  *
- * Returns MPSSE_OK on success, MPSSE_FAIL on failure.
+ * Returns void.
  */
-int Tristate(struct mpsse_context *mpsse)
+void SendAcks(struct mpsse_context *mpsse)
 {
-	unsigned char cmd[CMD_SIZE] = { 0 };
+	return SetAck(mpsse, ACK);
+}
+
+/*
+ * Causes libmpsse to send NACKs after each read byte in I2C mode.
+ *
+ * @mpsse - MPSSE context pointer.
+ *
+ * Returns void.
+ */
+void SendNacks(struct mpsse_context *mpsse)
+{
+	return SetAck(mpsse, NACK);
+}
+
+/*
+ * Send data stop condition.
+ *
+ * @mpsse - MPSSE context pointer.
+ *
+ * Returns MPSSE_OK on success.
+ * Returns MPSSE_FAIL on failure.
+ */
+int Stop(struct mpsse_context *mpsse)
+{
+	int retval = MPSSE_OK;
+
+	if(is_valid_context(mpsse))
+	{
+		/* In I2C mode, we need to ensure that the data line goes low while the clock line is low to avoid sending an inadvertent start condition */
+		if(mpsse->mode == I2C)
+		{
+			retval |= set_bits_low(mpsse, (mpsse->pidle & ~DO & ~SK));
+		}
+
+		/* Send the stop condition */
+		retval |= set_bits_low(mpsse, mpsse->pstop);
+
+		if(retval == MPSSE_OK)
+		{
+			/* Restore the pins to their idle states */
+			retval |= set_bits_low(mpsse, mpsse->pidle);
+		}
+		
+		mpsse->status = STOPPED;
+	}
+	else
+	{
+		retval = MPSSE_FAIL;
+		mpsse->status = STOPPED;
+	}
+
+	return retval;
+}
+
+/* 
+ * Sets the specified pin high. 
+ *
+ * @mpsse - MPSSE context pointer.
+ * @pin   - Pin number to set high.
+ * 
+ * Returns MPSSE_OK on success.
+ * Returns MPSSE_FAIL on failure.
+ */
+int PinHigh(struct mpsse_context *mpsse, int pin)
+{
+	int retval = MPSSE_FAIL;
+
+	if(is_valid_context(mpsse))
+	{
+		retval = gpio_write(mpsse, pin, HIGH);
+	}
+
+	return retval;
+}
+
+/*
+ * Sets the specified pin low.
+ *
+ * @mpsse - MPSSE context pointer.
+ * @pin   - Pin number to set low.
+ *
+ * Returns MPSSE_OK on success.
+ * Returns MPSSE_FAIL on failure.
+ */
+int PinLow(struct mpsse_context *mpsse, int pin)
+{
+	int retval = MPSSE_FAIL;
+	
+	if(is_valid_context(mpsse))
+	{
+		retval = gpio_write(mpsse, pin, LOW);
+	}
+
+	return retval;
+}
+
+/*
+ * Sets multiple pins high or low at once.
+ * All of the pins are updated with one SET_BITS_LOW and / or one SET_BITS_HIGH command (one byte in BITBANG mode).
+ *
+ * @mpsse  - MPSSE context pointer.
+ * @mask   - Bit mask of the pins to change; bit 0 is pin 0, etc.
+ * @values - The new pin values; bits not set in mask are ignored.
+ *
+ * Returns MPSSE_OK on success.
+ * Returns MPSSE_FAIL on failure.
+ */
+int SetPins(struct mpsse_context *mpsse, int mask, int values)
+{
+	int retval = MPSSE_FAIL;
+
+	if(is_valid_context(mpsse))
+	{
+		retval = gpio_set(mpsse, mask, values);
+	}
+
+	return retval;
+}
+
+/*
+ * Gets the last values written to the pins by PinHigh, PinLow, SetPins or WritePins.
+ * Unlike ReadPins, this does not read the pins from the chip.
+ *
+ * @mpsse - MPSSE context pointer.
+ *
+ * Returns the pin values, with bit 0 being pin 0, etc.
+ */
+int GetPins(struct mpsse_context *mpsse)
+{
+	int pins = 0;
+
+	if(is_valid_context(mpsse))
+	{
+		if(mpsse->mode == BITBANG)
+		{
+			pins = mpsse->bitbang;
+		}
+		else
+		{
+			pins = ((mpsse->pidle / GPIO0) & 0x0F) | (mpsse->gpioh << NUM_GPIOL_PINS);
+		}
+	}
+
+	return pins;
+}
+
+/*
+ * Enables / disables the merging of consecutive GPIO writes while batching.
+ * When enabled, a pin write that immediately follows other pin writes in a batch updates the queued
+ * command instead of queuing a new one, so only the final state of a run of pin changes is sent.
+ * Do not enable this if intermediate pin states matter (e.g., when generating pulses).
+ *
+ * @mpsse - MPSSE context pointer.
+ * @tf    - Set to 1 to enable, 0 to disable (default).
+ *
+ * Returns void.
+ */
+void CoalescePinWrites(struct mpsse_context *mpsse, int tf)
+{
+	if(is_valid_context(mpsse))
+	{
+		mpsse->coalesce = tf;
+		mpsse->coalesce_end = -1;
+	}
+}
+
+/*
+ * Sets the input/output direction of all pins. For use in BITBANG mode only.
+ *
+ * @mpsse     - MPSSE context pointer.
+ * @direction - Byte indicating input/output direction of each bit.  1 is out.
+ *
+ * Returns MPSSE_OK if direction could be set, MPSSE_FAIL otherwise.
+ */
+int SetDirection(struct mpsse_context *mpsse, uint8_t direction)
+{
+	int retval = MPSSE_FAIL;
+
+	if(is_valid_context(mpsse))
+	{
+		if(mpsse->mode == BITBANG)
+		{
+			if(mpsse->transport->set_bitmode(mpsse, direction, BITMODE_BITBANG) == 0)
+                	{
+				mpsse->bitbang_dir = direction;
+				retval = MPSSE_OK;
+			}
+		}
+	}
+
+	return retval;
+}
+
+/*
+ * Sets the input/output value of all pins. For use in BITBANG mode only.
+ *
+ * @mpsse - MPSSE context pointer.
+ * @data  - Byte indicating bit hi/low value of each bit.
+ *
+ * Returns MPSSE_OK if direction could be set, MPSSE_FAIL otherwise.
+ */
+int WritePins(struct mpsse_context *mpsse, uint8_t data)
+{
+	int retval = MPSSE_FAIL;
+
+	if(is_valid_context(mpsse))
+	{
+		if(mpsse->mode == BITBANG)
+		{
+			retval = raw_write(mpsse, &data, 1);
+			if(retval == MPSSE_OK)
+			{
+				mpsse->bitbang = data;
+			}
+		}
+	}
+    
+	return retval;
+}
+
+/*
+ * Clocks a waveform out on the pins. For use in BITBANG mode only.
+ * Each byte of data is one sample of all eight pins, which the chip clocks out of its FIFO at the specified rate.
+ *
+ * @mpsse - MPSSE context pointer.
+ * @data  - Pin values for each sample.
+ * @size  - Number of samples.
+ * @rate  - Sample rate, in samples per second. If 0, the previously used rate is kept.
+ *
+ * Not supported while batching: the rate is set with a USB control transfer, which can't be queued, and 
+ * would take effect before the queued commands are sent.
+ *
+ * Returns MPSSE_OK on success, MPSSE_FAIL on failure.
+ */
+int WriteWaveform(struct mpsse_context *mpsse, char *data, int size, int rate)
+{
+	int retval = MPSSE_FAIL;
+
+	if(is_valid_context(mpsse))
+	{
+		if(mpsse->mode == BITBANG && !mpsse->batch && size > 0)
+		{
+			if(set_bitbang_rate(mpsse, rate) == MPSSE_OK)
+			{
+				retval = raw_write(mpsse, (unsigned char *) data, size);
+
+				if(retval == MPSSE_OK)
+				{
+					mpsse->bitbang = (uint8_t) data[size-1];
+				}
+			}
+		}
+	}
+
+	return retval;
+}
+
+/*
+ * Clocks a waveform out on the pins and captures the state of the pins for every sample. For use in BITBANG mode only.
+ * The chip is placed in synchronous bitbang mode for the duration of the transfer, in which the pins are sampled
+ * immediately before each new sample is clocked out.
+ *
+ * @mpsse - MPSSE context pointer.
+ * @data  - Pin values for each sample.
+ * @size  - Number of samples.
+ * @rdata - Buffer to store the captured pin states in.
+ * @rsize - Size of rdata. Must be at least size bytes.
+ * @rate  - Sample rate, in samples per second. If 0, the previously used rate is kept.
+ *
+ * Not supported while batching.
+ *
+ * Returns MPSSE_OK on success, MPSSE_FAIL on failure.
+ */
+int TransferWaveform(struct mpsse_context *mpsse, char *data, int size, char *rdata, int rsize, int rate)
+{
+	int retval = MPSSE_FAIL, n = 0, w = 0, txsize = 0, rxsize = 0, window = 0;
+
+	if(is_valid_context(mpsse))
+	{
+		if(mpsse->mode == BITBANG && !mpsse->batch && size > 0 && rsize >= size)
+		{
+			if(mpsse->transport->set_bitmode(mpsse, mpsse->bitbang_dir, BITMODE_SYNCBB) == 0)
+			{
+				if(set_bitbang_rate(mpsse, rate) == MPSSE_OK)
+				{
+					/* 
+					 * Every sample written produces one byte of read data; keep writing ahead
+					 * of the reads, but never by more than the chip's FIFO can hold.
+					 */
+					window = fifo_size(mpsse);
+					retval = MPSSE_OK;
+
+					while(n < size)
+					{
+						txsize = size - w;
+						if(txsize > (window - (w - n)))
+						{
+							txsize = window - (w - n);
+						}
+
+						if(txsize > 0)
+						{
+							if(raw_write(mpsse, (unsigned char *) (data + w), txsize) != MPSSE_OK)
+							{
+								retval = MPSSE_FAIL;
+								break;
+							}
+
+							w += txsize;
+						}
+
+						rxsize = w - n;
+						if(rxsize > (window / 2) && w < size)
+						{
+							rxsize = window / 2;
+						}
+
+						if(raw_read(mpsse, (unsigned char *) (rdata + n), rxsize) != rxsize)
+						{
+							retval = MPSSE_FAIL;
+							break;
+						}
+
+						n += rxsize;
+					}
+
+					if(retval == MPSSE_OK)
+					{
+						mpsse->bitbang = (uint8_t) data[size-1];
+					}
+				}
+
+				/* Go back to asynchronous bitbang mode */
+				if(mpsse->transport->set_bitmode(mpsse, mpsse->bitbang_dir, BITMODE_BITBANG) != 0)
+				{
+					retval = MPSSE_FAIL;
+				}
+			}
+		}
+	}
+
+	return retval;
+}
+
+/*
+ * Reads the state of the chip's pins. For use in BITBANG mode only.
+ *
+ * @mpsse - MPSSE context pointer.
+ *
+ * Returns a byte with the corresponding pin's bits set to 1 or 0.
+ * Returns MPSSE_FAIL while batching, since the pins would be read before the queued commands are sent.
+ */
+int ReadPins(struct mpsse_context *mpsse)
+{
+	uint8_t val = 0;
+
+	if(is_valid_context(mpsse))
+	{
+		if(mpsse->batch)
+		{
+			return MPSSE_FAIL;
+		}
+
+		mpsse->transport->read_pins(mpsse, (unsigned char *) &val);
+	}
+
+	return (int) val;
+}
+
+/*
+ * Checks if a specific pin is high or low. For use in BITBANG mode only.
+ *
+ * @mpsse - MPSSE context pointer.
+ * @pin   - The pin number.
+ * @state - The state of the pins, as returned by ReadPins.
+ *          If set to -1, ReadPins will automatically be called.
+ *
+ * Returns a 1 if the pin is high, 0 if the pin is low.
+ * Returns MPSSE_FAIL if state is -1 and the pins can't be read (e.g., while batching).
+ */
+int PinState(struct mpsse_context *mpsse, int pin, int state)
+{
+	if(state == -1)
+	{
+		state = ReadPins(mpsse);
+		if(state == MPSSE_FAIL)
+		{
+			return MPSSE_FAIL;
+		}
+	}
+
+	/* If not in bitbang mode, the specified pin should be one of GPIOLx. Convert these defines into an absolute pin number. */
+	if(mpsse->mode != BITBANG)
+	{
+		pin += NUM_GPIOL_PINS;
+	}
+
+	return ((state & (1 << pin)) >> pin);
+}
+
+/*
+ * Tells the chip to wait until GPIOL1 is at the given level before it executes any of the commands that
+ * follow, so that a read that depends on a data ready or busy line is started by the chip itself, without
+ * polling the pin from the host. GPIOL1 is made an input, until the next SetMode().
+ *
+ * The chip can't be told to give up waiting; if the next read doesn't complete within timeout milliseconds,
+ * the MPSSE engine is reset, the context's clock, mode and GPIO pin states are restored, any commands 
+ * queued behind the wait are discarded and mpsse->wait_expired is set.
+ *
+ * @mpsse   - MPSSE context pointer.
+ * @level   - The level to wait for, one of: HIGH, LOW.
+ * @timeout - Maximum time to wait for the next read to complete, in milliseconds.
+ *
+ * Returns MPSSE_OK on success.
+ * Returns MPSSE_FAIL on failure.
+ */
+int WaitForPin(struct mpsse_context *mpsse, int level, int timeout)
+{
+	int retval = MPSSE_FAIL, i = 0;
+	unsigned char buf[CMD_SIZE+1] = { 0 };
+
+	if(is_valid_context(mpsse) && mpsse->mode != BITBANG && !mpsse->stream && timeout > 0)
+	{
+		/* GPIOL1 is otherwise driven by the chip, in which case the wait would just see its own output */
+		if(mpsse->tris & GPIO1)
+		{
+			mpsse->tris &= ~GPIO1;
+
+			buf[i++] = SET_BITS_LOW;
+			buf[i++] = (mpsse->status == STARTED) ? mpsse->pstart : mpsse->pidle;
+			buf[i++] = mpsse->tris;
+		}
+
+		buf[i++] = (level == HIGH) ? WAIT_ON_HIGH : WAIT_ON_LOW;
+
+		retval = raw_write(mpsse, buf, i);
+		if(retval == MPSSE_OK)
+		{
+			mpsse->wait_timeout = timeout;
+			mpsse->wait_expired = 0;
+		}
+	}
+
+	return retval;
+}
+
+/*
+ * Waits for GPIOL1 to reach the given level and then reads data over the selected serial protocol, see WaitForPin().
+ * The wait and the read are sent to the chip in a single USB write. While batching, the wait and the read are 
+ * queued, and rdata is not written to; the data is returned by FlushBatch() instead.
+ *
+ * @mpsse   - MPSSE context pointer.
+ * @level   - The level to wait for, one of: HIGH, LOW.
+ * @rdata   - Buffer to store the read data in.
+ * @rsize   - Number of bytes to read.
+ * @timeout - Maximum time to wait, in milliseconds.
+ *
+ * Returns MPSSE_OK on success.
+ * Returns MPSSE_FAIL on failure, or if GPIOL1 didn't reach the level in time.
+ */
+int WaitRead(struct mpsse_context *mpsse, int level, char *rdata, int rsize, int timeout)
+{
+	int retval = MPSSE_FAIL, batched = 0;
+
+	if(is_valid_context(mpsse) && rsize > 0)
+	{
+		/* Queue the wait and the read so that they are sent to the chip together, unless the caller is already batching */
+		batched = (BeginBatch(mpsse) == MPSSE_OK);
+
+		if(WaitForPin(mpsse, level, timeout) == MPSSE_OK && InternalRead(mpsse, (unsigned char *) rdata, rsize) == rsize)
+		{
+			retval = MPSSE_OK;
+		}
+
+		if(batched)
+		{
+			if(retval == MPSSE_OK && batch_sync(mpsse) == MPSSE_OK && mpsse->batch_status == MPSSE_OK && mpsse->batch_rsize == rsize)
+			{
+				memcpy(rdata, mpsse->batch_rbuf, rsize);
+			}
+			else
+			{
+				retval = MPSSE_FAIL;
+			}
+
+			mpsse->batch = 0;
+		}
+	}
+
+	return retval;
+}
+
+/*
+ * Captures the state of the pins count times, optionally clocking interval clock cycles between samples, so that
+ * the samples are taken at a known rate: sample i is taken i * interval / GetClock() seconds after the first. The
+ * GET_BITS commands for all of the samples are streamed to the chip in blocks, as for Transfer(), so the timing
+ * only slips if the host falls so far behind in reading the samples that the chip's FIFO fills up.
+ * Note that the clock cycles toggle SK. In JTAG mode, the TAP controllers see them as clocks with TMS low.
+ * While batching, the samples are returned by FlushBatch() instead.
+ *
+ * @mpsse    - MPSSE context pointer.
+ * @rdata    - Buffer to store the samples in.
+ * @rsize    - Size of rdata, in bytes. Must be at least count bytes, or count * 2 bytes if high is set.
+ * @count    - Number of samples to take.
+ * @interval - Number of clock cycles between samples, up to MAX_SAMPLE_INTERVAL. If 0, the samples are taken 
+ *             as fast as the chip can execute the GET_BITS commands, at an unspecified rate.
+ * @high     - If set, each sample is two bytes: the low pins (as returned by ReadPins()) followed by the high pins.
+ *             Otherwise, each sample is one byte with the state of the low pins.
+ *
+ * Returns MPSSE_OK on success.
+ * Returns MPSSE_FAIL on failure.
+ */
+int SamplePins(struct mpsse_context *mpsse, char *rdata, int rsize, int count, int interval, int high)
+{
+	unsigned char gap[CLOCK_CYCLES_SIZE] = { 0 };
+	int retval = MPSSE_FAIL, width = 0, gap_size = 0, block = 0, window = 0, samples = 0, w = 0, n = 0, i = 0, j = 0;
+
+	width = high ? 2 : 1;
+
+	if(is_valid_context(mpsse) && mpsse->mode != BITBANG && !mpsse->stream && count > 0 && rsize >= (count * width) &&
+	   interval >= 0 && interval <= MAX_SAMPLE_INTERVAL)
+	{
+		gap_size = clock_commands(gap, interval);
+
+		/* Block and FIFO sizes in samples, rather than bytes */
+		block = transfer_block_size(mpsse) / width;
+		window = fifo_size(mpsse) / width;
+
+		if(pool_buffer(mpsse, &mpsse->cmd_buf, &mpsse->cmd_alloc, (block * (width + gap_size)) + 1) == MPSSE_OK)
+		{
+			retval = MPSSE_OK;
+
+			/* 
+			 * w is the number of samples requested, n is the number of samples read back. Keep writing blocks of
+			 * sample commands as long as the unread samples fit in the chip's FIFO, then read back the oldest block.
+			 */
+			while(n < count && retval == MPSSE_OK)
+			{
+				while(w < count)
+				{
+					samples = count - w;
+					if(samples > block)
+					{
+						samples = block;
+					}
+
+					if((w - n + samples) > window)
+					{
+						break;
+					}
+
+					for(i=0, j=0; i<samples; i++)
+					{
+						mpsse->cmd_buf[j++] = GET_BITS_LOW;
+						if(high)
+						{
+							mpsse->cmd_buf[j++] = GET_BITS_HIGH;
+						}
+
+						/* No need to clock anything after the last sample */
+						if((w + i) < (count - 1))
+						{
+							memcpy(mpsse->cmd_buf + j, gap, gap_size);
+							j += gap_size;
+						}
+					}
+					mpsse->cmd_buf[j++] = SEND_IMMEDIATE;
+
+					if(raw_write(mpsse, mpsse->cmd_buf, j) != MPSSE_OK)
+					{
+						retval = MPSSE_FAIL;
+						break;
+					}
+
+					w += samples;
+				}
+
+				samples = w - n;
+				if(samples > block)
+				{
+					samples = block;
+				}
+
+				if(retval != MPSSE_OK || samples <= 0 || raw_read(mpsse, (unsigned char *) (rdata + (n * width)), samples * width) != (samples * width))
+				{
+					retval = MPSSE_FAIL;
+					break;
+				}
+
+				n += samples;
+			}
+		}
+
+		/* 
+		 * The gaps between samples clocked the TAP controllers interval * (count - 1) times with TMS held low.
+		 * Follow them until they reach a stable state; if it isn't known how many clocks went out, neither is the state.
+		 */
+		if(mpsse->mode == JTAG && mpsse->tap_state != TAP_UNKNOWN && interval > 0)
+		{
+			if(retval != MPSSE_OK)
+			{
+				mpsse->tap_state = TAP_UNKNOWN;
+			}
+			else
+			{
+				for(i=0; i<(count - 1) && tap_transitions[mpsse->tap_state][0] != mpsse->tap_state; i++)
+				{
+					for(j=0; j<interval && tap_transitions[mpsse->tap_state][0] != mpsse->tap_state; j++)
+					{
+						mpsse->tap_state = tap_transitions[mpsse->tap_state][0];
+					}
+				}
+			}
+		}
+	}
+
+	return retval;
+}
+
+/*
+ * Places all I/O pins into a tristate mode.
+ *
+ * @mpsse - MPSSE context pointer.
+ *
+ * Returns MPSSE_OK on success, MPSSE_FAIL on failure.
+ */
+int Tristate(struct mpsse_context *mpsse)
+{
+	unsigned char cmd[CMD_SIZE] = { 0 };
 
 	/* Tristate the all I/O pins (FT232H only) */
 	cmd[0] = TRISTATE_IO;
 	cmd[1] = 0xFF;
 	cmd[2] = 0xFF;
 
-	return raw_write(mpsse, cmd, sizeof(cmd));
+	return raw_write(mpsse, cmd, sizeof(cmd));
+}
+
+/*
+ * Sets the size of the blocks that Transfer() and FastTransfer() split data into.
+ * Several blocks are kept in flight at once, up to the size of the chip's FIFO.
+ *
+ * @mpsse - MPSSE context pointer.
+ * @size  - Block size in bytes, or 0 to use the default (SPI_TRANSFER_SIZE).
+ *          Sizes larger than the chip's FIFO are limited to the FIFO size.
+ *
+ * Returns MPSSE_OK on success.
+ * Returns MPSSE_FAIL on failure.
+ */
+int SetTransferSize(struct mpsse_context *mpsse, int size)
+{
+	int retval = MPSSE_FAIL;
+
+	if(is_valid_context(mpsse) && size >= 0)
+	{
+		mpsse->transfer_size = size;
+		retval = MPSSE_OK;
+	}
+
+	return retval;
+}
+
+/*
+ * Gets the block size that Transfer() and FastTransfer() will actually use.
+ *
+ * @mpsse - MPSSE context pointer.
+ *
+ * Returns the block size in bytes.
+ */
+int GetTransferSize(struct mpsse_context *mpsse)
+{
+	int size = 0;
+
+	if(is_valid_context(mpsse))
+	{
+		size = transfer_block_size(mpsse);
+	}
+
+	return size;
+}
+
+/*
+ * Returns the number of times one of the context's reusable buffers had to be allocated or grown.
+ *
+ * @mpsse - MPSSE context pointer.
+ *
+ * Returns the number of buffer allocations.
+ */
+unsigned long GetAllocations(struct mpsse_context *mpsse)
+{
+	unsigned long allocations = 0;
+
+	if(is_valid_context(mpsse))
+	{
+		allocations = mpsse->allocations;
+	}
+
+	return allocations;
+}
+
+/*
+ * Returns the number of times an existing reusable buffer was used instead of allocating a new one.
+ *
+ * @mpsse - MPSSE context pointer.
+ *
+ * Returns the number of buffer allocations avoided.
+ */
+unsigned long GetAllocationsAvoided(struct mpsse_context *mpsse)
+{
+	unsigned long avoided = 0;
+
+	if(is_valid_context(mpsse))
+	{
+		avoided = mpsse->allocations_avoided;
+	}
+
+	return avoided;
+}
+
+/*
+ * Returns the number of USB reads and writes made to the chip.
+ * Commands queued by a batch count once, when the batch is sent.
+ *
+ * @mpsse - MPSSE context pointer.
+ *
+ * Returns the number of USB transactions.
+ */
+unsigned long GetTransactions(struct mpsse_context *mpsse)
+{
+	unsigned long transactions = 0;
+
+	if(is_valid_context(mpsse))
+	{
+		transactions = mpsse->stats.writes + mpsse->stats.reads;
+	}
+
+	return transactions;
+}
+
+/*
+ * Returns the context's I/O counters: the number of USB writes and reads, the bytes sent and received,
+ * the time spent waiting in USB reads (in microseconds), the number of reads that returned less data
+ * than was asked for and the number of buffer purges. Use ResetStats() to clear them.
+ *
+ * @mpsse - MPSSE context pointer.
+ *
+ * Returns a copy of the context's counters.
+ */
+struct mpsse_stats GetStats(struct mpsse_context *mpsse)
+{
+	struct mpsse_stats stats = { 0 };
+
+	if(is_valid_context(mpsse))
+	{
+		stats = mpsse->stats;
+	}
+
+	return stats;
+}
+
+/*
+ * Clears the context's I/O counters.
+ *
+ * @mpsse - MPSSE context pointer.
+ *
+ * Returns void.
+ */
+void ResetStats(struct mpsse_context *mpsse)
+{
+	if(is_valid_context(mpsse))
+	{
+		memset(&mpsse->stats, 0, sizeof(mpsse->stats));
+	}
+}
+
+/*
+ * Sets a callback function that is called with every buffer written to or read from the chip.
+ * Writes are traced before they are sent, reads once the data has been received. Batched commands
+ * are traced when the batch is sent.
+ *
+ * @mpsse    - MPSSE context pointer.
+ * @callback - The function to call, or NULL to disable tracing.
+ * @userdata - Passed to the callback function.
+ *
+ * Returns void.
+ */
+void SetTrace(struct mpsse_context *mpsse, mpsse_trace_callback callback, void *userdata)
+{
+	if(is_valid_context(mpsse))
+	{
+		mpsse->trace = callback;
+		mpsse->trace_data = userdata;
+	}
+}
+
+/*
+ * Starts queuing commands instead of sending them to the chip.
+ * Subsequent calls to Start, Write, Read, Stop, PinHigh, etc are collected into a single
+ * command buffer which is sent to the chip, along with one SEND_IMMEDIATE, by FlushBatch().
+ * Functions that read data (Read, Transfer, I2C Write ACKs) return placeholder data while
+ * batching; the real data is returned by FlushBatch() in the order it was requested.
+ *
+ * @mpsse - MPSSE context pointer.
+ *
+ * Returns MPSSE_OK on success.
+ * Returns MPSSE_FAIL on failure, or if a batch is already in progress.
+ */
+int BeginBatch(struct mpsse_context *mpsse)
+{
+	int retval = MPSSE_FAIL;
+
+	if(is_valid_context(mpsse) && !mpsse->batch)
+	{
+		mpsse->batch = 1;
+		mpsse->batch_status = MPSSE_OK;
+		mpsse->batch_size = 0;
+		mpsse->coalesce_end = -1;
+		mpsse->batch_rsize = 0;
+		mpsse->batch_pending = 0;
+		retval = MPSSE_OK;
+	}
+
+	return retval;
+}
+
+/*
+ * Returns the number of bytes of read data that the current batch will return.
+ *
+ * @mpsse - MPSSE context pointer.
+ *
+ * Returns the number of bytes that FlushBatch() will return.
+ */
+int BatchPending(struct mpsse_context *mpsse)
+{
+	int pending = 0;
+
+	if(is_valid_context(mpsse) && mpsse->batch)
+	{
+		pending = mpsse->batch_rsize + mpsse->batch_pending;
+	}
+
+	return pending;
+}
+
+/*
+ * Sends all queued commands to the chip and ends the batch.
+ *
+ * @mpsse - MPSSE context pointer.
+ *
+ * Returns a pointer to BatchPending() bytes of read data on success.
+ * Returns NULL on failure, while recording, or if none of the queued commands read any data; use BatchStatus()
+ * to tell a failure apart from a batch that read no data.
+ */
+#ifdef SWIGPYTHON
+swig_string_data FlushBatch(struct mpsse_context *mpsse)
+#else
+char *FlushBatch(struct mpsse_context *mpsse)
+#endif
+{
+	char *buf = NULL;
+
+	if(is_valid_context(mpsse) && mpsse->batch && !mpsse->batch_recording)
+	{
+		if(batch_sync(mpsse) == MPSSE_OK && mpsse->batch_status == MPSSE_OK && mpsse->batch_rsize > 0)
+		{
+			buf = (char *) mpsse->batch_rbuf;
+#ifndef SWIGPYTHON
+			/* Hand the read buffer over to the caller */
+			mpsse->batch_rbuf = NULL;
+			mpsse->batch_ralloc = 0;
+#endif
+		}
+
+		mpsse->batch = 0;
+	}
+	else if(is_valid_context(mpsse) && !mpsse->batch)
+	{
+		/* There was no batch to flush */
+		mpsse->batch_status = MPSSE_FAIL;
+	}
+
+#ifdef SWIGPYTHON
+	swig_string_data sdata = { 0 };
+	sdata.size = buf ? mpsse->batch_rsize : 0;
+	sdata.data = buf;
+	return sdata;
+#else
+	return buf;
+#endif
+}
+
+/*
+ * Gets the status of the current batch, or of the last batch flushed with FlushBatch(). Every queued command
+ * that failed, and any USB write or read error while flushing, is reflected here, whether or not the batch
+ * read any data.
+ *
+ * @mpsse - MPSSE context pointer.
+ *
+ * Returns MPSSE_OK if all of the batch's commands were queued and sent successfully.
+ * Returns MPSSE_FAIL otherwise.
+ */
+int BatchStatus(struct mpsse_context *mpsse)
+{
+	int retval = MPSSE_FAIL;
+
+	if(is_valid_context(mpsse))
+	{
+		retval = mpsse->batch_status;
+	}
+
+	return retval;
+}
+
+/*
+ * Discards any commands that have not yet been sent to the chip and ends the batch, or recording.
+ *
+ * @mpsse - MPSSE context pointer.
+ *
+ * Returns void.
+ */
+void CancelBatch(struct mpsse_context *mpsse)
+{
+	if(is_valid_context(mpsse))
+	{
+		mpsse->batch = 0;
+		mpsse->batch_recording = 0;
+		mpsse->batch_size = 0;
+		mpsse->coalesce_end = -1;
+		mpsse->batch_rsize = 0;
+		mpsse->batch_pending = 0;
+
+		/* The discarded commands may have included settings that were recorded as applied */
+		forget_settings(mpsse);
+	}
+
+	return;
+}
+
+/*
+ * Starts recording commands into a program that can be replayed any number of times with Execute(). Recording
+ * works like batching (see BeginBatch()), except that nothing is sent to the chip until the program is executed,
+ * however much data the recorded commands read. The recorded commands should leave the context as they found it
+ * (e.g., Start() ... Stop()); mode and clock changes and waits on GPIOL1 can't be recorded.
+ *
+ * @mpsse - MPSSE context pointer.
+ *
+ * Returns MPSSE_OK on success.
+ * Returns MPSSE_FAIL on failure, or if a batch or recording is already in progress.
+ */
+int BeginRecording(struct mpsse_context *mpsse)
+{
+	int retval = MPSSE_FAIL;
+
+	if(is_valid_context(mpsse) && mpsse->mode != BITBANG && !mpsse->stream && BeginBatch(mpsse) == MPSSE_OK)
+	{
+		mpsse->batch_recording = 1;
+		retval = MPSSE_OK;
+	}
+
+	return retval;
+}
+
+/*
+ * Returns the size of the program that EndRecording() will return.
+ * The number of bytes of data that the program reads is returned by BatchPending().
+ *
+ * @mpsse - MPSSE context pointer.
+ *
+ * Returns the size of the recorded program, in bytes.
+ */
+int RecordingSize(struct mpsse_context *mpsse)
+{
+	int size = 0;
+
+	if(is_valid_context(mpsse) && mpsse->batch_recording)
+	{
+		size = mpsse->batch_size;
+
+		/* EndRecording() adds a SEND_IMMEDIATE to programs that read data */
+		if(mpsse->batch_pending > 0)
+		{
+			size++;
+		}
+	}
+
+	return size;
+}
+
+/*
+ * Ends a recording started with BeginRecording().
+ *
+ * @mpsse - MPSSE context pointer.
+ *
+ * Returns a pointer to the RecordingSize() bytes of the recorded program on success.
+ * Returns NULL on failure, or if nothing was recorded.
+ */
+#ifdef SWIGPYTHON
+swig_string_data EndRecording(struct mpsse_context *mpsse)
+#else
+char *EndRecording(struct mpsse_context *mpsse)
+#endif
+{
+	char *buf = NULL;
+	unsigned char cmd = SEND_IMMEDIATE;
+#ifdef SWIGPYTHON
+	int size = 0;
+#endif
+
+	if(is_valid_context(mpsse) && mpsse->batch_recording)
+	{
+		/* Make sure the chip doesn't sit on the read data until the latency timer expires when the program is executed */
+		if(mpsse->batch_pending > 0)
+		{
+			batch_append(mpsse, &cmd, sizeof(cmd));
+		}
+
+		if(mpsse->batch_status == MPSSE_OK && mpsse->batch_size > 0)
+		{
+			buf = (char *) mpsse->batch_buf;
+#ifdef SWIGPYTHON
+			size = mpsse->batch_size;
+#else
+			/* Hand the command buffer over to the caller */
+			mpsse->batch_buf = NULL;
+			mpsse->batch_alloc = 0;
+#endif
+		}
+
+		/* None of the recorded commands, including any settings they recorded as applied, have reached the chip */
+		CancelBatch(mpsse);
+
+		/* A wait can't be timed when it is part of a program */
+		mpsse->wait_timeout = 0;
+	}
+
+#ifdef SWIGPYTHON
+	swig_string_data sdata = { 0 };
+	sdata.size = size;
+	sdata.data = buf;
+	return sdata;
+#else
+	return buf;
+#endif
+}
+
+/*
+ * Executes a program recorded with BeginRecording() and EndRecording(), with a single USB write and a single read.
+ * The program may be copied and have parameters patched into it first; libmpsse does not look inside it.
+ * While batching, the program is queued and the data it reads is returned by FlushBatch() instead.
+ *
+ * @mpsse - MPSSE context pointer.
+ * @data  - The program.
+ * @size  - Size of the program, in bytes.
+ * @rdata - Buffer to store the read data in.
+ * @rsize - Number of bytes of data the program reads, as returned by BatchPending() at the end of the 
+ *          recording. Must not exceed the size of the chip's FIFO (4KB for the FT2232H/FT4232H, 1KB for the FT232H).
+ *
+ * Returns MPSSE_OK on success.
+ * Returns MPSSE_FAIL on failure.
+ */
+int Execute(struct mpsse_context *mpsse, char *data, int size, char *rdata, int rsize)
+{
+	int retval = MPSSE_FAIL;
+
+	/* The whole program is written before any data is read back, so the data must fit in the chip's FIFO */
+	if(is_valid_context(mpsse) && mpsse->mode != BITBANG && !mpsse->stream && size > 0 && rsize >= 0 && rsize <= fifo_size(mpsse))
+	{
+		retval = raw_write(mpsse, (unsigned char *) data, size);
+
+		if(retval == MPSSE_OK && rsize > 0)
+		{
+			if(raw_read(mpsse, (unsigned char *) rdata, rsize) != rsize)
+			{
+				retval = MPSSE_FAIL;
+			}
+		}
+	}
+
+	return retval;
 }
 
 /* 
@@ -19,6 +19,8 @@
 #define SPI_RW_SIZE		(63 * 1024) 
 #define SPI_TRANSFER_SIZE	512
 #define I2C_TRANSFER_SIZE	64
+#define STREAM_DEPTH		8
+#define FAST_READ_DEPTH		2
 
 #define LATENCY_MS		2
 #define TIMEOUT_DIVISOR		1000000
@@ -39,6 +41,26 @@
 
 #define NULL_CONTEXT_ERROR_MSG	"NULL MPSSE context pointer!"
 
+#define MAX_DEVICES		64
+#define SERIAL_LEN		64
+#define DESCRIPTION_LEN		128
+#define LOCATION_LEN		32
+#define PROBE_TRIES		4
+#define BAD_COMMAND_RESPONSE	0xFA
+
+#define MAX_CLOCK_DIVISOR	0xFFFF
+
+#define NUM_TAP_STATES		16
+#define TAP_RESET_CLOCKS	5							/* Clocks with TMS high that reset the TAP from any state */
+#define TMS_MAX_BITS		7							/* Maximum number of TMS bits clocked by one TMS command */
+#define TMS_MOVE_SIZE		(CMD_SIZE * 3)						/* Maximum size of the TMS commands for one TAP state change */
+#define TMS_WRITE		(MPSSE_WRITE_TMS | MPSSE_BITMODE | MPSSE_LSB | MPSSE_WRITE_NEG)	/* 0x4B, clock out TMS bits with TDI held */
+#define CLOCK_PHASES		2
+#define I2C_CLOCK_PHASES	3
+#define MAX_CLOCK_N8		65536							/* Maximum number of 8 clock groups clocked by one CLOCK_N8_CYCLES command */
+#define MAX_SAMPLE_INTERVAL	((MAX_CLOCK_N8 * 8) + 7)				/* Maximum number of clocks between SamplePins() samples */
+#define CLOCK_CYCLES_SIZE	(CMD_SIZE + 2)						/* Maximum size of the commands for up to MAX_SAMPLE_INTERVAL clocks */
+
 /* FTDI interfaces */
 enum interface
 {
@@ -75,6 +97,29 @@ enum modes
 	I2C     = 5,
 	GPIO    = 6,
 	BITBANG = 7,
+	JTAG    = 8,
+};
+
+/* JTAG TAP controller states. TCK is SK, TDI is DO, TDO is DI and TMS is CS. */
+enum tap_states
+{
+	TAP_UNKNOWN    = -1,
+	TAP_RESET      = 0,
+	TAP_IDLE       = 1,
+	TAP_DRSELECT   = 2,
+	TAP_DRCAPTURE  = 3,
+	TAP_DRSHIFT    = 4,
+	TAP_DREXIT1    = 5,
+	TAP_DRPAUSE    = 6,
+	TAP_DREXIT2    = 7,
+	TAP_DRUPDATE   = 8,
+	TAP_IRSELECT   = 9,
+	TAP_IRCAPTURE  = 10,
+	TAP_IRSHIFT    = 11,
+	TAP_IREXIT1    = 12,
+	TAP_IRPAUSE    = 13,
+	TAP_IREXIT2    = 14,
+	TAP_IRUPDATE   = 15
 };
 
 enum pins
@@ -138,17 +183,96 @@ enum low_bits_status
 	STOPPED
 };
 
+enum trace_direction
+{
+	TRACE_WRITE = 0,
+	TRACE_READ  = 1
+};
+
 struct vid_pid
 {
 	int vid;
 	int pid;
 	char *description;
+	int interfaces;
+};
+
+/* An attached FTDI device, as returned by ListDevices() */
+struct mpsse_device
+{
+	int vid;
+	int pid;
+	int interfaces;
+	char serial[SERIAL_LEN];
+	char description[DESCRIPTION_LEN];
+	char location[LOCATION_LEN];
+};
+
+struct mpsse_context;
+
+/* 
+ * Low level I/O functions used to talk to the chip. Data and return values follow the equivalent libftdi functions. 
+ * The libftdi implementation is in support.c; the simulated chip used by OpenSimulator() is in sim.c.
+ */
+struct mpsse_transport
+{
+	int (*write)(struct mpsse_context *mpsse, unsigned char *buf, int size);
+	int (*read)(struct mpsse_context *mpsse, unsigned char *buf, int size);
+	int (*purge)(struct mpsse_context *mpsse);
+	int (*purge_rx)(struct mpsse_context *mpsse);
+	int (*read_pins)(struct mpsse_context *mpsse, unsigned char *pins);
+	int (*set_bitmode)(struct mpsse_context *mpsse, unsigned char mask, unsigned char mode);
+	int (*set_baudrate)(struct mpsse_context *mpsse, int rate);
+	const char *(*error_string)(struct mpsse_context *mpsse);
+	void (*close)(struct mpsse_context *mpsse);
+};
+
+/* Per-context I/O counters, see GetStats() */
+struct mpsse_stats
+{
+	unsigned long writes;
+	unsigned long reads;
+	unsigned long bytes_out;
+	unsigned long bytes_in;
+	unsigned long read_usecs;
+	unsigned long short_reads;
+	unsigned long purges;
 };
 
+/* Clock configuration chosen by PlanClock() for a requested frequency */
+struct mpsse_clock_plan
+{
+	int requested;		/* The requested frequency, in hertz */
+	int frequency;		/* The fastest achievable frequency within tolerance of the requested frequency */
+	int faster;		/* The next achievable frequency above frequency, or 0 if there is none */
+	int system_clock;	/* The chip clock the divisor applies to, SIXTY_MHZ or TWELVE_MHZ (divide by 5 enabled) */
+	int divisor;		/* The TCK_DIVISOR value */
+	int three_phase;	/* Set if the plan allows for three phase clocking (I2C mode); SetClockPlan() only accepts a plan made for the current mode */
+	double error;		/* Relative error of frequency, (frequency - requested) / requested */
+};
+
+/* 
+ * Chip settings last applied by SetMode(), SetClock() and SetLoopback(), so that unchanged settings are not sent again.
+ * A value of -1 means that the chip's setting is not known, see forget_settings().
+ */
+struct mpsse_settings
+{
+	int loopback;
+	int adaptive;
+	int three_phase;
+	int clock_base;
+	int divisor;
+};
+
+/* Trace callback, called with every buffer written to or read from the chip. The timestamp is in seconds since the epoch. */
+typedef void (*mpsse_trace_callback)(struct mpsse_context *mpsse, int direction, unsigned char *buf, int size, double timestamp, void *userdata);
+
 struct mpsse_context
 {
 	char *description;
 	struct ftdi_context ftdi;
+	const struct mpsse_transport *transport;
+	void *transport_data;
 	enum modes mode;
 	enum low_bits_status status;
 	int flush_after_read;
@@ -156,6 +280,7 @@ struct mpsse_context
 	int pid;
 	int clock;
 	int xsize;
+	int transfer_size;
 	int open;
 	int endianess;
 	uint8_t tris;
@@ -165,21 +290,76 @@ struct mpsse_context
 	uint8_t gpioh;
 	uint8_t trish;
 	uint8_t bitbang;
+	uint8_t bitbang_dir;
+	int coalesce;
+	int coalesce_low;
+	int coalesce_high;
+	int coalesce_end;
+	int bitbang_rate;
 	uint8_t tx;
 	uint8_t rx;
 	uint8_t txrx;
 	uint8_t tack;
 	uint8_t rack;
+	int batch;
+	int batch_status;
+	unsigned char *batch_buf;
+	int batch_size;
+	int batch_alloc;
+	unsigned char *batch_rbuf;
+	int batch_rsize;
+	int batch_ralloc;
+	int batch_pending;
+	int batch_recording;
+	unsigned char *fast_buf;
+	int fast_alloc;
+	unsigned char *cmd_buf;
+	int cmd_alloc;
+	unsigned char *rx_buf;
+	int rx_alloc;
+	unsigned long allocations;
+	unsigned long allocations_avoided;
+	struct mpsse_stats stats;
+	struct mpsse_settings settings;
+	int tap_state;
+	int wait_timeout;
+	int wait_expired;
+	mpsse_trace_callback trace;
+	void *trace_data;
+	int stream;
+	int stream_chunk;
+	int stream_count;
+	int stream_depth;
+	int stream_queued;
+	int stream_done;
+	void *stream_tc;
+	unsigned char *stream_buf;
+	int stream_alloc;
+	unsigned char *stream_cmd;
+	int stream_cmd_alloc;
+	unsigned char *acks;
+	int acks_alloc;
+	int ack_count;
 };
 
 struct mpsse_context *MPSSE(enum modes mode, int freq, int endianess);
 struct mpsse_context *Open(int vid, int pid, enum modes mode, int freq, int endianess, int interface, const char *description, const char *serial);
 struct mpsse_context *OpenIndex(int vid, int pid, enum modes mode, int freq, int endianess, int interface, const char *description, const char *serial, int index);
+struct mpsse_context *OpenLocation(int vid, int pid, const char *location, enum modes mode, int freq, int endianess, int interface);
+struct mpsse_context *OpenDevice(struct mpsse_device *device, enum modes mode, int freq, int endianess, int interface);
+struct mpsse_context *OpenSerial(struct mpsse_device *devices, int *count, int max, const char *serial, enum modes mode, int freq, int endianess, int interface);
+int ListDevices(struct mpsse_device *devices, int max);
+struct mpsse_context *OpenSimulator(enum modes mode, int freq, int endianess, int latency);
+int SimulateWriteErrors(struct mpsse_context *mpsse, int count);
 void Close(struct mpsse_context *mpsse);
 const char *ErrorString(struct mpsse_context *mpsse);
 int SetMode(struct mpsse_context *mpsse, int endianess);
 void EnableBitmode(struct mpsse_context *mpsse, int tf);
 int SetClock(struct mpsse_context *mpsse, uint32_t freq);
+int PlanClock(struct mpsse_context *mpsse, uint32_t freq, double tolerance, struct mpsse_clock_plan *plan);
+int SetClockPlan(struct mpsse_context *mpsse, struct mpsse_clock_plan *plan);
+int SwitchMode(struct mpsse_context *mpsse, enum modes mode, int freq, int endianess);
+int Ping(struct mpsse_context *mpsse);
 int GetClock(struct mpsse_context *mpsse);
 int GetVid(struct mpsse_context *mpsse);
 int GetPid(struct mpsse_context *mpsse);
@@ -190,19 +370,51 @@ int Start(struct mpsse_context *mpsse);
 int Write(struct mpsse_context *mpsse, char *data, int size);
 int Stop(struct mpsse_context *mpsse);
 int GetAck(struct mpsse_context *mpsse);
+int GetAcks(struct mpsse_context *mpsse, char *rdata, int rsize);
 void SetAck(struct mpsse_context *mpsse, int ack);
 void SendAcks(struct mpsse_context *mpsse);
 void SendNacks(struct mpsse_context *mpsse);
 void FlushAfterRead(struct mpsse_context *mpsse, int tf);
 int PinHigh(struct mpsse_context *mpsse, int pin);
 int PinLow(struct mpsse_context *mpsse, int pin);
+int SetPins(struct mpsse_context *mpsse, int mask, int values);
+int GetPins(struct mpsse_context *mpsse);
+void CoalescePinWrites(struct mpsse_context *mpsse, int tf);
 int SetDirection(struct mpsse_context *mpsse, uint8_t direction);
 int WriteBits(struct mpsse_context *mpsse, char bits, int size);
 char ReadBits(struct mpsse_context *mpsse, int size);
+int WriteBitstream(struct mpsse_context *mpsse, char *data, int size, int nbits);
+int ReadBitstream(struct mpsse_context *mpsse, char *rdata, int rsize, int nbits);
+int TransferBitstream(struct mpsse_context *mpsse, char *data, int size, char *rdata, int rsize, int nbits);
+int JTAGReset(struct mpsse_context *mpsse);
+int JTAGSetState(struct mpsse_context *mpsse, int state);
+int JTAGGetState(struct mpsse_context *mpsse);
+int JTAGShiftIR(struct mpsse_context *mpsse, char *data, int size, char *rdata, int rsize, int nbits, int end);
+int JTAGShiftDR(struct mpsse_context *mpsse, char *data, int size, char *rdata, int rsize, int nbits, int end);
 int WritePins(struct mpsse_context *mpsse, uint8_t data);
 int ReadPins(struct mpsse_context *mpsse);
 int PinState(struct mpsse_context *mpsse, int pin, int state);
+int WaitForPin(struct mpsse_context *mpsse, int level, int timeout);
+int WaitRead(struct mpsse_context *mpsse, int level, char *rdata, int rsize, int timeout);
+int SamplePins(struct mpsse_context *mpsse, char *rdata, int rsize, int count, int interval, int high);
 int Tristate(struct mpsse_context *mpsse);
+int WriteWaveform(struct mpsse_context *mpsse, char *data, int size, int rate);
+int TransferWaveform(struct mpsse_context *mpsse, char *data, int size, char *rdata, int rsize, int rate);
+int SetTransferSize(struct mpsse_context *mpsse, int size);
+int GetTransferSize(struct mpsse_context *mpsse);
+unsigned long GetAllocations(struct mpsse_context *mpsse);
+unsigned long GetAllocationsAvoided(struct mpsse_context *mpsse);
+unsigned long GetTransactions(struct mpsse_context *mpsse);
+struct mpsse_stats GetStats(struct mpsse_context *mpsse);
+void ResetStats(struct mpsse_context *mpsse);
+void SetTrace(struct mpsse_context *mpsse, mpsse_trace_callback callback, void *userdata);
+int BeginBatch(struct mpsse_context *mpsse);
+int BatchPending(struct mpsse_context *mpsse);
+int BatchStatus(struct mpsse_context *mpsse);
+void CancelBatch(struct mpsse_context *mpsse);
+int BeginRecording(struct mpsse_context *mpsse);
+int RecordingSize(struct mpsse_context *mpsse);
+int Execute(struct mpsse_context *mpsse, char *data, int size, char *rdata, int rsize);
 char Version(void);
 
 #ifdef SWIGPYTHON
@@ -214,15 +426,21 @@ typedef struct swig_string_data
 
 swig_string_data Read(struct mpsse_context *mpsse, int size);
 swig_string_data Transfer(struct mpsse_context *mpsse, char *data, int size);
+swig_string_data FlushBatch(struct mpsse_context *mpsse);
+swig_string_data EndRecording(struct mpsse_context *mpsse);
 #else
 char *Read(struct mpsse_context *mpsse, int size);
 char *Transfer(struct mpsse_context *mpsse, char *data, int size);
+char *FlushBatch(struct mpsse_context *mpsse);
+char *EndRecording(struct mpsse_context *mpsse);
+#endif
 
-extern unsigned char fast_rw_buf[SPI_RW_SIZE + CMD_SIZE];
 int FastWrite(struct mpsse_context *mpsse, char *data, int size);
 int FastRead(struct mpsse_context *mpsse, char *data, int size);
 int FastTransfer(struct mpsse_context *mpsse, char *wdata, char *rdata, int size);
-#endif
+int StreamStart(struct mpsse_context *mpsse, int chunk_size, int count, int depth);
+int StreamNext(struct mpsse_context *mpsse, char *rdata, int rsize);
+int StreamStop(struct mpsse_context *mpsse);
 
 
 #endif
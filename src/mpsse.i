@@ -1,24 +1,194 @@
 %module pylibmpsse
 %{
 #include "mpsse.h"
+
+/* Gets a pointer to the contents of any object that supports either the new or old style buffer protocol */
+static int get_buffer(PyObject *obj, Py_buffer *view, int writable)
+{
+	int retval = -1;
+	void *buf = NULL;
+	Py_ssize_t size = 0;
+
+	if(PyObject_CheckBuffer(obj))
+	{
+		retval = PyObject_GetBuffer(obj, view, writable ? PyBUF_WRITABLE : PyBUF_SIMPLE);
+	}
+	else
+	{
+		if(writable)
+		{
+			retval = PyObject_AsWriteBuffer(obj, &buf, &size);
+		}
+		else
+		{
+			retval = PyObject_AsReadBuffer(obj, (const void **) &buf, &size);
+		}
+
+		if(retval == 0)
+		{
+			retval = PyBuffer_FillInfo(view, NULL, buf, size, !writable, PyBUF_SIMPLE);
+		}
+	}
+
+	return retval;
+}
+
+/* Trace callback that passes each buffer on to the Python callable stored in userdata as (direction, data, timestamp) */
+static void python_trace(struct mpsse_context *mpsse, int direction, unsigned char *buf, int size, double timestamp, void *userdata)
+{
+	PyObject *result = NULL;
+	PyGILState_STATE gstate = PyGILState_Ensure();
+
+	result = PyObject_CallFunction((PyObject *) userdata, "is#d", direction, (char *) buf, size, timestamp);
+	if(result == NULL)
+	{
+		/* There is no way to hand the exception back to the caller of the libmpsse function, so report and drop it */
+		PyErr_Print();
+	}
+	Py_XDECREF(result);
+
+	PyGILState_Release(gstate);
+}
 %}
 
-%typemap(in) (char *data, int size)
+%typemap(arginit) (char *data, int size)
+{
+	memset(&view$argnum, 0, sizeof(Py_buffer));
+}
+
+%typemap(in) (char *data, int size) (Py_buffer view)
 {
-        if(!PyString_Check($input))
-        {
-                PyErr_SetString(PyExc_ValueError, "String value required");
-                return NULL;
-        }
+	if(get_buffer($input, &view, 0) != 0)
+	{
+		PyErr_SetString(PyExc_ValueError, "String or buffer value required");
+		SWIG_fail;
+	}
+
+	$1 = (char *) view.buf;
+	$2 = (int) view.len;
+}
 
-        $1 = PyString_AsString($input);
-        $2 = PyString_Size($input);
+%typemap(freearg) (char *data, int size)
+{
+	PyBuffer_Release(&view$argnum);
+}
+
+%typemap(arginit) (char *rdata, int rsize)
+{
+	memset(&view$argnum, 0, sizeof(Py_buffer));
 }
 
+%typemap(in) (char *rdata, int rsize) (Py_buffer view)
+{
+	if(get_buffer($input, &view, 1) != 0)
+	{
+		PyErr_SetString(PyExc_ValueError, "Writable buffer value required");
+		SWIG_fail;
+	}
+
+	$1 = (char *) view.buf;
+	$2 = (int) view.len;
+}
+
+%typemap(freearg) (char *rdata, int rsize)
+{
+	PyBuffer_Release(&view$argnum);
+}
+
+/* swig_string_data always points to one of the context's reusable buffers, so it is copied but not freed */
 %typemap(out) swig_string_data
 {
         $result = PyString_FromStringAndSize($1.data, $1.size);
-        free($1.data);
 }
 
+/* FastRead and FastTransfer write to caller-owned buffers; Python uses the bounds checked *Into functions below */
+%ignore FastRead;
+%ignore FastTransfer;
+
+/* Python code sets a Python callable as the trace function with SetPythonTrace instead */
+%ignore SetTrace;
+%nothread SetPythonTrace;
+
+/* Python code gets the device list as Python objects from ListPythonDevices instead */
+%ignore ListDevices;
+%ignore OpenSerial;
+%nothread ListPythonDevices;
+
+%include "stdint.i"
 %include "mpsse.h"
+
+%inline %{
+/* Reads size bytes into rdata, starting at offset. */
+int FastReadInto(struct mpsse_context *mpsse, char *rdata, int rsize, int offset, int size)
+{
+	int retval = MPSSE_FAIL;
+
+	if(offset >= 0 && size >= 0 && offset <= rsize && size <= (rsize - offset))
+	{
+		retval = FastRead(mpsse, rdata + offset, size);
+	}
+
+	return retval;
+}
+
+/* Transfers size bytes from data, storing the received bytes in rdata. */
+int FastTransferInto(struct mpsse_context *mpsse, char *data, int size, char *rdata, int rsize)
+{
+	int retval = MPSSE_FAIL;
+
+	if(size <= rsize)
+	{
+		retval = FastTransfer(mpsse, data, rdata, size);
+	}
+
+	return retval;
+}
+
+/* Sets callback as the trace function, or disables tracing if callback is None. */
+void SetPythonTrace(struct mpsse_context *mpsse, PyObject *callback)
+{
+	if(mpsse && mpsse->open)
+	{
+		if(mpsse->trace == python_trace)
+		{
+			Py_XDECREF((PyObject *) mpsse->trace_data);
+		}
+
+		if(callback == Py_None)
+		{
+			SetTrace(mpsse, NULL, NULL);
+		}
+		else
+		{
+			Py_INCREF(callback);
+			SetTrace(mpsse, python_trace, callback);
+		}
+	}
+}
+
+/* Returns a list of dictionaries describing the attached devices, see ListDevices. */
+PyObject *ListPythonDevices(void)
+{
+	int i = 0, count = 0;
+	PyObject *device = NULL, *list = NULL;
+	struct mpsse_device devices[MAX_DEVICES];
+
+	count = ListDevices(devices, MAX_DEVICES);
+
+	list = PyList_New(0);
+	for(i=0; list != NULL && i<count; i++)
+	{
+		device = Py_BuildValue("{s:i,s:i,s:i,s:s,s:s,s:s}", "vid", devices[i].vid, "pid", devices[i].pid, "interfaces", devices[i].interfaces,
+				       "serial", devices[i].serial, "description", devices[i].description, "location", devices[i].location);
+		if(device == NULL || PyList_Append(list, device) != 0)
+		{
+			Py_XDECREF(device);
+			Py_DECREF(list);
+			return NULL;
+		}
+		Py_DECREF(device);
+	}
+
+	return list;
+}
+%}
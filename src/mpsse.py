@@ -1,4 +1,7 @@
 import pylibmpsse as _mpsse
+from threading import Condition
+from array import array
+import sys
 
 MPSSE_OK = _mpsse.MPSSE_OK
 MPSSE_FAIL = _mpsse.MPSSE_FAIL
@@ -9,6 +12,12 @@ LSB = _mpsse.LSB
 ACK = _mpsse.ACK
 NACK = _mpsse.NACK
 
+HIGH = _mpsse.HIGH
+LOW = _mpsse.LOW
+
+TRACE_WRITE = _mpsse.TRACE_WRITE
+TRACE_READ = _mpsse.TRACE_READ
+
 SPI0 = _mpsse.SPI0
 SPI1 = _mpsse.SPI1
 SPI2 = _mpsse.SPI2
@@ -16,6 +25,25 @@ SPI3 = _mpsse.SPI3
 I2C = _mpsse.I2C
 GPIO = _mpsse.GPIO
 BITBANG = _mpsse.BITBANG
+JTAG = _mpsse.JTAG
+
+TAP_UNKNOWN = _mpsse.TAP_UNKNOWN
+TAP_RESET = _mpsse.TAP_RESET
+TAP_IDLE = _mpsse.TAP_IDLE
+TAP_DRSELECT = _mpsse.TAP_DRSELECT
+TAP_DRCAPTURE = _mpsse.TAP_DRCAPTURE
+TAP_DRSHIFT = _mpsse.TAP_DRSHIFT
+TAP_DREXIT1 = _mpsse.TAP_DREXIT1
+TAP_DRPAUSE = _mpsse.TAP_DRPAUSE
+TAP_DREXIT2 = _mpsse.TAP_DREXIT2
+TAP_DRUPDATE = _mpsse.TAP_DRUPDATE
+TAP_IRSELECT = _mpsse.TAP_IRSELECT
+TAP_IRCAPTURE = _mpsse.TAP_IRCAPTURE
+TAP_IRSHIFT = _mpsse.TAP_IRSHIFT
+TAP_IREXIT1 = _mpsse.TAP_IREXIT1
+TAP_IRPAUSE = _mpsse.TAP_IRPAUSE
+TAP_IREXIT2 = _mpsse.TAP_IREXIT2
+TAP_IRUPDATE = _mpsse.TAP_IRUPDATE
 
 GPIOL0 = _mpsse.GPIOL0
 GPIOL1 = _mpsse.GPIOL1
@@ -47,6 +75,223 @@ TWELVE_MHZ = _mpsse.TWELVE_MHZ
 FIFTEEN_MHZ = _mpsse.FIFTEEN_MHZ
 THIRTY_MHZ = _mpsse.THIRTY_MHZ
 
+MAX_SAMPLE_INTERVAL = _mpsse.MAX_SAMPLE_INTERVAL
+
+def ListDevices():
+	"""
+	Lists the attached FTDI devices in a single USB scan. The serial and description are read by briefly
+	opening each device; devices are not reset or reconfigured.
+
+	Returns a list of dictionaries with the keys vid, pid, interfaces, serial, description and location.
+	Pass one of them to MPSSE.OpenDevice to open that device.
+	"""
+	return _mpsse.ListPythonDevices()
+
+class BatchRead(object):
+	"""
+	Placeholder for data requested while commands are being queued with MPSSE.BeginBatch / MPSSE.Batch.
+	The data attribute is None until the batch has been flushed.
+	"""
+
+	def __init__(self, offset, size):
+		"""
+		Class constructor.
+
+		@offset - Offset of this read's data in the batch read data.
+		@size   - Number of bytes this read will return.
+
+		Returns None.
+		"""
+		self.offset = offset
+		self.size = size
+		self.data = None
+
+	def _resolve(self, data):
+		self.data = data[self.offset:self.offset+self.size]
+
+class BitstreamRead(BatchRead):
+	"""
+	BatchRead for the data requested by MPSSE.ReadBitstream / MPSSE.TransferBitstream while batching.
+	"""
+
+	def __init__(self, offset, size, nbits, endianess):
+		BatchRead.__init__(self, offset, size)
+		self.nbits = nbits
+		self.endianess = endianess
+
+	def _resolve(self, data):
+		BatchRead._resolve(self, data)
+
+		# Move the bits of a partial last byte to where they would be had a whole byte been read, as ReadBitstream does
+		bits = self.nbits % 8
+		if bits and self.data:
+			last = ord(self.data[-1])
+			if self.endianess == MSB:
+				last = (last << (8 - bits)) & 0xFF
+			else:
+				last = last >> (8 - bits)
+			self.data = self.data[:-1] + chr(last)
+
+class JTAGRead(BatchRead):
+	"""
+	BatchRead for the bits shifted out by MPSSE.JTAGShiftIR / MPSSE.JTAGShiftDR while batching.
+	"""
+
+	def __init__(self, offset, size, nbits):
+		BatchRead.__init__(self, offset, size)
+		self.nbits = nbits
+
+	def _resolve(self, data):
+		BatchRead._resolve(self, data)
+
+		# All but the last bit are read with data commands, LSB first, so a partial byte has its bits at the top.
+		# The last bit is read by the TMS command that leaves the shift state, and is at the top of its own byte.
+		n = self.nbits - 1
+		bits = n % 8
+		last = (ord(self.data[-1]) >> 7) & 1
+		rdata = self.data[:n / 8]
+
+		if bits:
+			rdata += chr((ord(self.data[n / 8]) >> (8 - bits)) | (last << bits))
+		else:
+			rdata += chr(last)
+
+		self.data = rdata
+
+class Batch(object):
+	"""
+	Context manager returned by MPSSE.Batch.
+	Commands issued inside the with block are sent to the chip as a single USB write when the block exits.
+	"""
+
+	def __init__(self, mpsse):
+		self.mpsse = mpsse
+		self.reads = []
+
+	def __enter__(self):
+		self.mpsse.BeginBatch()
+		return self
+
+	def __exit__(self, t, v, traceback):
+		if t is None:
+			self.reads = self.mpsse.FlushBatch()
+		else:
+			self.mpsse.CancelBatch()
+
+class Program(object):
+	"""
+	A sequence of commands recorded by MPSSE.Compile, which MPSSE.Execute replays with new parameters in a
+	single USB write and read. Programs can be saved with Dumps and loaded on another machine with Program.Loads.
+	"""
+
+	FORMAT = 1
+	READS = {"BatchRead" : BatchRead, "BitstreamRead" : BitstreamRead, "JTAGRead" : JTAGRead}
+
+	def __init__(self, commands, rsize, sizes, slots, reads, result):
+		"""
+		Class constructor. Programs are created by MPSSE.Compile and Program.Loads.
+
+		@commands - The recorded commands.
+		@rsize    - Number of bytes of data the commands read.
+		@sizes    - Size of each parameter, in bytes.
+		@slots    - List of (parameter, parameter offset, command offset) tuples, one for each parameter byte sent.
+		@reads    - The BatchRead objects returned while recording.
+		@result   - Index of the read to return, a list of indices, or None to return all reads.
+
+		Returns None.
+		"""
+		self.commands = commands
+		self.rsize = rsize
+		self.sizes = sizes
+		self.slots = slots
+		self.reads = reads
+		self.result = result
+
+	def Build(self, params):
+		"""
+		Patches parameters into a copy of the recorded commands.
+
+		@params - List of parameter strings, one for each parameter size.
+
+		Returns a bytearray of commands.
+		"""
+		if len(params) != len(self.sizes):
+			raise Exception, "Program takes %d parameters, %d given" % (len(self.sizes), len(params))
+
+		for (param, size) in zip(params, self.sizes):
+			if len(param) != size:
+				raise Exception, "Program parameter should be %d bytes, not %d" % (size, len(param))
+
+		commands = bytearray(self.commands)
+		for (i, j, k) in self.slots:
+			commands[k] = params[i][j]
+		return commands
+
+	def Results(self, data):
+		"""
+		Splits up the data read by the program.
+
+		@data - The data read by the program.
+
+		Returns the data of the read (or list of reads) selected when the program was compiled.
+		"""
+		for read in self.reads:
+			read._resolve(data)
+
+		if self.result is None:
+			return [read.data for read in self.reads]
+		elif isinstance(self.result, list):
+			return [self.reads[i].data for i in self.result]
+		return self.reads[self.result].data
+
+	def Dumps(self):
+		"""
+		Serializes the program, for loading with Program.Loads.
+
+		Returns a JSON string.
+		"""
+		import json
+
+		reads = []
+		for read in self.reads:
+			attrs = dict(read.__dict__)
+			del attrs["data"]
+			reads.append([type(read).__name__, attrs])
+
+		return json.dumps({
+				"format"	: self.FORMAT,
+				"commands"	: self.commands.encode("hex"),
+				"rsize"		: self.rsize,
+				"sizes"		: self.sizes,
+				"slots"		: self.slots,
+				"reads"		: reads,
+				"result"	: self.result,
+		}, sort_keys=True)
+
+	@staticmethod
+	def Loads(s):
+		"""
+		Loads a program serialized with Dumps.
+
+		@s - The JSON string returned by Dumps.
+
+		Returns a Program.
+		"""
+		import json
+
+		p = json.loads(s)
+		if p["format"] != Program.FORMAT:
+			raise Exception, "Unsupported program format: %s" % p["format"]
+
+		reads = []
+		for (name, attrs) in p["reads"]:
+			read = object.__new__(Program.READS[name])
+			read.__dict__.update(attrs)
+			read.data = None
+			reads.append(read)
+
+		return Program(p["commands"].decode("hex"), p["rsize"], p["sizes"], [tuple(slot) for slot in p["slots"]], reads, p["result"])
+
 class MPSSE(object):
 	"""
 	Python class wrapper for libmpsse.
@@ -64,6 +309,9 @@ class MPSSE(object):
 		Returns None.
 		"""
 		self.context = None
+		self._batch = None
+		self.profiles = {}
+		self.programs = {}
 		if mode is not None:
 			self.context = _mpsse.MPSSE(mode, frequency, endianess)
 			if self.context.open == 0:
@@ -103,14 +351,76 @@ class MPSSE(object):
 			raise Exception, self.ErrorString()
 		return MPSSE_OK
 
+	def OpenDevice(self, device, mode, frequency=ONE_HUNDRED_KHZ, endianess=MSB, interface=IFACE_A):
+		"""
+		Opens a device returned by ListDevices, by its USB bus location.
+		If the device is already in MPSSE mode it is not reset, which makes reopening a device much faster.
+		The device at the location must have the same VID, PID and serial number, otherwise it is not opened.
+
+		@device    - One of the dictionaries returned by ListDevices.
+		@mode      - The MPSSE mode to use, one of: SPI0, SPI1, SPI2, SPI3, I2C, GPIO, BITBANG.
+		@frequency - The frequency to use for the specified serial protocol, in hertz (default: 100KHz).
+		@endianess - The endianess of data transfers, one of: MSB, LSB (default: MSB).
+		@interface - The interface to use on the FTDI chip, one of: IFACE_A, IFACE_B, IFACE_C, IFACE_D (default: IFACE_A).
+
+		Returns MPSSE_OK on success.
+		Raises an exception on failure.
+		"""
+		dev = _mpsse.mpsse_device()
+		dev.vid = device['vid']
+		dev.pid = device['pid']
+		dev.serial = device['serial']
+		dev.location = device['location']
+
+		self.context = _mpsse.OpenDevice(dev, mode, frequency, endianess, interface)
+		if self.context.open == 0:
+			raise Exception, self.ErrorString()
+		return MPSSE_OK
+
+	def Simulate(self, mode, frequency=ONE_HUNDRED_KHZ, endianess=MSB, latency=0):
+		"""
+		Opens a simulated FTDI chip instead of a real device, for testing and benchmarking without hardware.
+		The simulator emulates an SPI flash chip (all modes except I2C and JTAG), an I2C EEPROM at address 0x50 (I2C mode),
+		a chain of two JTAG TAPs (JTAG mode) and loopback connections between pairs of GPIO pins (GPIOL0 <-> GPIOL1, 
+		GPIOH0 <-> GPIOH1, etc).
+
+		@mode      - The MPSSE mode to use, one of: SPI0, SPI1, SPI2, SPI3, I2C, GPIO, BITBANG, JTAG.
+		@frequency - The frequency to use for the specified serial protocol, in hertz (default: 100KHz).
+		@endianess - The endianess of data transfers, one of: MSB, LSB (default: MSB).
+		@latency   - Simulated USB latency of each read and write, in microseconds (default: 0).
+
+		Returns MPSSE_OK on success.
+		Raises an exception on failure.
+		"""
+		self.context = _mpsse.OpenSimulator(mode, frequency, endianess, latency)
+		if self.context.open == 0:
+			raise Exception, self.ErrorString()
+		return MPSSE_OK
+
+	def SimulateWriteErrors(self, count=1):
+		"""
+		Makes the next USB writes to a simulated chip fail, for testing error handling.
+		For use only with a chip opened by Simulate.
+
+		@count - Number of writes that should fail (default: 1).
+
+		Returns MPSSE_OK on success.
+		Raises an exception on failure.
+		"""
+		if _mpsse.SimulateWriteErrors(self.context, count) == MPSSE_FAIL:
+			raise Exception, "Not a simulated chip"
+		return MPSSE_OK
+
 	def Close(self):
 		"""
 		Closes the FTDI device connection, deinitializes libftdi, and frees the libmpsse context.
 
 		Returns None.
 		"""
+		_mpsse.SetPythonTrace(self.context, None)
 		retval = _mpsse.Close(self.context)
 		self.context = None
+		self._batch = None
 	
 	def ErrorString(self):
 		"""
@@ -129,10 +439,67 @@ class MPSSE(object):
 		Returns MPSSE_OK on success.
 		Raises an exception on failure.
 		"""
-		if _mpsse.SetMode(self.context, mode, endianess) == MPSSE_FAIL:
+		if mode == self.context.mode:
+			retval = _mpsse.SetMode(self.context, endianess)
+		else:
+			retval = _mpsse.SwitchMode(self.context, mode, self.GetClock(), endianess)
+
+		if retval == MPSSE_FAIL:
+			raise Exception, self.ErrorString()
+		return MPSSE_OK
+
+	def SwitchMode(self, mode, frequency, endianess=MSB):
+		"""
+		Switches to a different mode, clock frequency and byte order without closing and reopening the device.
+		Switching to or from BITBANG mode is not supported.
+
+		@mode      - The MPSSE mode to use, one of: SPI0, SPI1, SPI2, SPI3, I2C, GPIO, JTAG.
+		@frequency - The frequency to use for the specified serial protocol, in hertz.
+		@endianess - The endianess of data transfers, one of: MSB, LSB (default: MSB).
+
+		Returns MPSSE_OK on success.
+		Raises an exception on failure, in which case the previous mode is kept.
+		"""
+		if _mpsse.SwitchMode(self.context, mode, frequency, endianess) == MPSSE_FAIL:
 			raise Exception, self.ErrorString()
 		return MPSSE_OK
 
+	def AddProfile(self, name, mode, frequency, endianess=MSB):
+		"""
+		Saves a mode, clock frequency and byte order under a name, for switching to with UseProfile.
+		Useful when a single interface talks to devices using different protocols, such as an SPI flash and an I2C PMIC.
+
+		@name      - Name of the profile.
+		@mode      - The MPSSE mode to use, one of: SPI0, SPI1, SPI2, SPI3, I2C, GPIO.
+		@frequency - The frequency to use for the specified serial protocol, in hertz.
+		@endianess - The endianess of data transfers, one of: MSB, LSB (default: MSB).
+
+		Returns None.
+		"""
+		self.profiles[name] = (mode, frequency, endianess)
+
+	def UseProfile(self, name):
+		"""
+		Switches to a profile saved with AddProfile. Only the chip settings that differ from the current ones are
+		sent to the chip, so alternating between profiles is cheap.
+
+		@name - Name of the profile.
+
+		Returns MPSSE_OK on success.
+		Raises an exception on failure.
+		"""
+		(mode, frequency, endianess) = self.profiles[name]
+		return self.SwitchMode(mode, frequency, endianess)
+
+	def Ping(self):
+		"""
+		Checks that the FTDI chip is still connected and responding.
+		Any unread data in the chip's buffers is discarded.
+
+		Returns True if the chip responded, False if not.
+		"""
+		return self.context is not None and _mpsse.Ping(self.context) == MPSSE_OK
+
 	def EnableBitmode(self, tf):
 		"""
 		Enables/disables bitwise data transfers.
@@ -154,20 +521,61 @@ class MPSSE(object):
 		"""
 		return _mpsse.FlushAfterRead(self.context, tf)
 
-	def SetClock(self, frequency):
+	def SetClock(self, frequency, tolerance=0):
 		"""
 		Sets the appropriate divisor for the desired clock frequency.
-		Called internally by __init__ and Open.
+		The clock is set to the fastest frequency the chip can generate that is no more than tolerance above the 
+		requested frequency; use PlanClock to find out what that frequency will be. Called internally by __init__ and Open.
+		In I2C mode, three phase clocking is allowed for, so that the frequency is the actual bit rate. Earlier versions
+		could round the clock above the requested frequency, and ran I2C at two thirds of it.
 
 		@frequency - The desired clock frequency, in hertz.
+		@tolerance - How far above frequency the clock may be set, as a fraction of frequency (default: 0).
 
 		Returns MPSSE_OK on success.
 		Raises an exception on failure.
 		"""
-		if _mpsse.SetClock(self.context, frequency) == MPSSE_FAIL:
+		plan = _mpsse.mpsse_clock_plan()
+
+		if _mpsse.PlanClock(self.context, frequency, tolerance, plan) == MPSSE_FAIL or _mpsse.SetClockPlan(self.context, plan) == MPSSE_FAIL:
 			raise Exception, self.ErrorString()
 		return MPSSE_OK
 
+	def PlanClock(self, frequency, tolerance=0):
+		"""
+		Works out the clock configuration that SetClock would use for a requested frequency, without changing the clock.
+		In I2C mode, the extra clock phase used by three phase clocking is taken into account.
+
+		@frequency - The desired clock frequency, in hertz.
+		@tolerance - How far above frequency the clock may be set, as a fraction of frequency (default: 0).
+
+		Returns a dictionary with the following keys:
+
+			requested    - The requested frequency, in hertz.
+			frequency    - The fastest achievable frequency within tolerance, in hertz.
+			faster       - The next achievable frequency above frequency, in hertz, or 0 if there is none.
+			system_clock - The chip clock the divisor applies to (SIXTY_MHZ, or TWELVE_MHZ with divide by 5 enabled).
+			divisor      - The clock divisor.
+			three_phase  - True if three phase clocking was allowed for (I2C mode); the plan only applies in such a mode.
+			error        - Relative error of frequency, (frequency - requested) / requested.
+
+		Raises an exception on failure.
+		"""
+		plan = _mpsse.mpsse_clock_plan()
+
+		if _mpsse.PlanClock(self.context, frequency, tolerance, plan) == MPSSE_FAIL:
+			raise Exception, "Invalid clock frequency or tolerance"
+
+		return {
+			"requested"	: plan.requested,
+			"frequency"	: plan.frequency,
+			"faster"	: plan.faster,
+			"system_clock"	: plan.system_clock,
+			"divisor"	: plan.divisor,
+			"three_phase"	: bool(plan.three_phase),
+			"error"		: plan.error,
+		}
+
 	def GetClock(self):
 		"""
 		Returns the currently configured clock rate, in hertz.
@@ -245,8 +653,15 @@ class MPSSE(object):
 		@data - A string of bytes to be written.
 
 		Returns MPSSE_OK on success.
+		While batching in I2C mode, returns a BatchRead for the received ACK bytes instead.
 		Raises an exception on failure.
 		"""
+		if self._batch is not None:
+			before = _mpsse.BatchPending(self.context)
+			if _mpsse.Write(self.context, data) == MPSSE_FAIL:
+				raise Exception, self.ErrorString()
+			return self._queue_read(before) or MPSSE_OK
+
 		if _mpsse.Write(self.context, data) == MPSSE_FAIL:
 			raise Exception, self.ErrorString()
 		return MPSSE_OK
@@ -258,7 +673,13 @@ class MPSSE(object):
 		@size - Number of bytes to read.
 
 		Returns a string of size bytes.
+		While batching, returns a BatchRead instead.
 		"""
+		if self._batch is not None:
+			before = _mpsse.BatchPending(self.context)
+			_mpsse.Read(self.context, size)
+			return self._queue_read(before)
+
 		return _mpsse.Read(self.context, size)
 
 	def Transfer(self, data):
@@ -269,154 +690,1135 @@ class MPSSE(object):
 		@data - A string of bytes to be written.
 
 		Returns a string of len(data) bytes.
+		While batching, returns a BatchRead instead.
 		"""
-		return _mpsse.Transfer(self.context, data)
-
-	def SetAck(self, ack):
-		"""
-		Sets the transmitted ACK bit.
-		For use only in I2C mode.
+		if self._batch is not None:
+			before = _mpsse.BatchPending(self.context)
+			_mpsse.Transfer(self.context, data)
+			return self._queue_read(before)
 
-		@ack - One of: ACK, NACK.
+		return _mpsse.Transfer(self.context, data)
 
-		Returns None.
+	def StreamRead(self, chunk_size, count=0, depth=0):
 		"""
-		_mpsse.SetAck(self.context, ack)
+		Generator for capturing long, continuous streams of data, for example:
 
-	def SendAcks(self):
-		"""
-		Causes all subsequent I2C read operations to respond with an acknowledgement.
+			for chunk in spi.StreamRead(4096, 1000):
+				process(chunk)
 
-		Returns None.
-		"""
-		_mpsse.SendAcks(self.context)
+		Several read commands are kept queued in the chip, and the USB read of the next chunk is started 
+		before the current chunk is yielded, so the bus is not left idle while the chunk is processed.
+		For use only in SPI0, SPI1, SPI2, SPI3 modes.
 
-	def SendNacks(self):
-		"""
-		Causes all subsequent I2C read operations to respond with a no-acknowledgement.
+		@chunk_size - The size of each chunk, in bytes.
+		@count      - The number of chunks to read, or 0 to read until the generator is closed (default: 0).
+		@depth      - The number of read commands to keep queued in the chip, or 0 for the default (default: 0).
 
-		Returns None.
+		Yields a bytearray of chunk_size bytes for each chunk.
+		Raises an exception on failure.
 		"""
-		return _mpsse.SendNacks(self.context)
+		if _mpsse.StreamStart(self.context, chunk_size, count, depth) == MPSSE_FAIL:
+			raise Exception, self.ErrorString()
 
-	def GetAck(self):
-		"""
-		Returns the last received ACK bit.
+		try:
+			while True:
+				chunk = bytearray(chunk_size)
+				n = _mpsse.StreamNext(self.context, chunk)
+				if n == MPSSE_FAIL:
+					raise Exception, self.ErrorString()
+				elif n == 0:
+					break
+				yield chunk
+		finally:
+			_mpsse.StreamStop(self.context)
 
-		Returns one of: ACK, NACK.
+	def SetTransferSize(self, size):
 		"""
-		return _mpsse.GetAck(self.context)
+		Sets the size of the blocks that Transfer and FastTransfer split data into.
+		Several blocks are kept in flight at once, up to the size of the chip's FIFO.
 
-	def PinHigh(self, pin):
-		"""
-		Sets the specified GPIO pin high.
-		
-		@pin - Pin number 0 - 11 in GPIO mode.
-		       In all other modes, one of: GPIOL0, GPIOL1, GPIOL2, GPIOL3, GPIOH0, GPIOH1, GPIOH2, GPIOH3, GPIOH4, GPIOH5, GPIOH6, GPIOH7.
+		@size - Block size in bytes, or 0 to use the default. Sizes larger than the chip's FIFO are limited to the FIFO size.
 
 		Returns MPSSE_OK on success.
 		Raises an exception on failure.
 		"""
-		if _mpsse.PinHigh(self.context, pin) == MPSSE_FAIL:
-			raise Exception, self.ErrorString()
+		if _mpsse.SetTransferSize(self.context, size) == MPSSE_FAIL:
+			raise Exception, "Invalid transfer size"
 		return MPSSE_OK
 
-	def PinLow(self, pin):
+	def GetTransferSize(self):
 		"""
-		Sets the specified GPIO pin low.
-		
-		@pin - Pin number 0 - 11 in GPIO mode.
-		       In all other modes, one of: GPIOL0, GPIOL1, GPIOL2, GPIOL3, GPIOH0, GPIOH1, GPIOH2, GPIOH3, GPIOH4, GPIOH5, GPIOH6, GPIOH7.
-		
-		Returns MPSSE_OK on success.
-		Raises an exception on failure.
+		Returns the block size, in bytes, that Transfer and FastTransfer will use.
 		"""
-		if _mpsse.PinLow(self.context, pin) == MPSSE_FAIL:
-			raise Exception, self.ErrorString()
-		return MPSSE_OK
+		return _mpsse.GetTransferSize(self.context)
 
-	def SetDirection(self, direction):
+	def FastWrite(self, data):
 		"""
-		Sets the input/output direction of pins as determined by direction (1 = Output, 0 = Input). 
-		For use in BITBANG mode only.
+		Writes bytes out via the selected serial protocol, without the per-call buffer allocations of Write.
+		For use only in SPI0, SPI1, SPI2, SPI3 modes.
 
-		@direction -  Byte indicating input/output direction of each bit (1 is output, 0 is input). 
+		@data - A string, or any object supporting the buffer protocol (bytearray, memoryview, mmap, array), of bytes to be written.
 
 		Returns MPSSE_OK on success.
 		Raises an exception on failure.
 		"""
-		if _mpsse.SetDirection(self.context, direction) == MPSSE_FAIL:
+		if _mpsse.FastWrite(self.context, data) == MPSSE_FAIL:
 			raise Exception, self.ErrorString()
 		return MPSSE_OK
 
-	def WriteBits(self, bits, n):
+	def FastRead(self, size):
 		"""
-		Performs a bitwise write of up to 8 bits at a time.
-		
-		@bits - An integer of bits to be written.
-		@n    - Transmit n number of least-significant bits.
+		Reads bytes over the selected serial protocol, without the per-call buffer allocations of Read.
+		For use only in SPI0, SPI1, SPI2, SPI3 modes.
 
-		Returns MPSSE_OK on success.
+		@size - Number of bytes to read.
+
+		Returns a bytearray of size bytes.
 		Raises an exception on failure.
 		"""
-		if _mpsse.WriteBits(self.context, bits, n) == MPSSE_FAIL:
-			raise Exception, self.ErrorString()
-		return MPSSE_OK
+		data = bytearray(size)
+		self.FastReadInto(data)
+		return data
 
-	def ReadBits(self, n):
+	def FastReadInto(self, buf, offset=0, size=None):
 		"""
-		Performs a bitwise read of up to 8 bits at a time.
+		Reads bytes over the selected serial protocol directly into a caller supplied buffer.
+		For use only in SPI0, SPI1, SPI2, SPI3 modes.
 
-		@n - Number of bits to read.
+		@buf    - Any writable object supporting the buffer protocol (bytearray, memoryview, mmap, array).
+		@offset - Offset into buf at which to store the read data (default: 0).
+		@size   - Number of bytes to read (default: the rest of buf).
 
-		Returns an integer value with the read bits set.
+		Returns the number of bytes read.
+		Raises an exception on failure.
 		"""
-		return ord(_mpsse.ReadBits(self.context, n))
+		if size is None:
+			size = len(buf) - offset
 
-	def WritePins(self, data):
+		if _mpsse.FastReadInto(self.context, buf, offset, size) == MPSSE_FAIL:
+			raise Exception, self.ErrorString()
+		return size
+
+	def FastTransfer(self, data, buf=None):
 		"""
-		Writes a new state to the chip's pins.
-		For use in BITBANG mode only.
+		Transfers data over the selected serial protocol, without the per-call buffer allocations of Transfer.
+		For use only in SPI0, SPI1, SPI2, SPI3 modes.
 
-		@data - An integer with the bits set to the desired pin states (1 = output, 0 = input).
+		@data - A string, or any object supporting the buffer protocol, of bytes to be written.
+		@buf  - Writable buffer to store the received bytes in (default: a new bytearray).
 
-		Returns MPSSE_OK on success.
+		Returns buf, with the first len(data) bytes set to the received data.
 		Raises an exception on failure.
 		"""
-		if _mpsse.WritePins(self.context, data) == MPSSE_FAIL:
+		if buf is None:
+			buf = bytearray(len(data))
+
+		if _mpsse.FastTransferInto(self.context, data, buf) == MPSSE_FAIL:
 			raise Exception, self.ErrorString()
-		return MPSSE_OK
+		return buf
 
-	def ReadPins(self):
+	def GetAllocations(self):
 		"""
-		Reads the current state of the chip's pins.
-		For use in BITBANG mode only.
-
-		Returns an integer with the corresponding pin's bits set.
+		Returns the number of times libmpsse had to allocate or grow one of its reusable buffers.
 		"""
-		return _mpsse.ReadPins(self.context)
+		return _mpsse.GetAllocations(self.context)
 
-	def PinState(self, pin, state=-1):
+	def GetAllocationsAvoided(self):
 		"""
-		Checks the current state of the pins.
-		For use in BITBANG mode only.
-
-		@pin   - The pin number whose state you want to check. 
-		@state - The value returned by ReadPins. If not specified, ReadPins will be called automatically.
-
-		Returns a 1 if the pin is high, 0 if the pin is low.
+		Returns the number of times libmpsse reused an existing buffer instead of allocating a new one.
+		Once all buffers have grown to their high water mark, only this counter should increase.
 		"""
-		return _mpsse.PinState(self.context, pin, state)
+		return _mpsse.GetAllocationsAvoided(self.context)
 
-	def Tristate(self):
+	def GetTransactions(self):
 		"""
-		Puts all I/O pins into a tristate mode (FT232H only).
+		Returns the number of USB reads and writes libmpsse has made to the chip.
+		Commands queued in a batch are counted once, when the batch is sent.
 		"""
-		return _mpsse.Tristate(self.context)
+		return _mpsse.GetTransactions(self.context)
 
-	def Version(self):
+	def GetStats(self):
+		"""
+		Returns a dictionary of the I/O counters that libmpsse keeps for this connection:
+
+			writes      - Number of USB writes.
+			reads       - Number of USB reads.
+			bytes_out   - Number of bytes written to the chip.
+			bytes_in    - Number of bytes read from the chip.
+			read_usecs  - Time spent waiting for USB reads to complete, in microseconds.
+			short_reads - Number of USB reads that returned less data than was asked for.
+			purges      - Number of times the chip's buffers were purged.
+		"""
+		stats = _mpsse.GetStats(self.context)
+		return dict((name, getattr(stats, name)) for name in ['writes', 'reads', 'bytes_out', 'bytes_in', 'read_usecs', 'short_reads', 'purges'])
+
+	def ResetStats(self):
+		"""
+		Clears the I/O counters returned by GetStats.
+
+		Returns None.
+		"""
+		_mpsse.ResetStats(self.context)
+
+	def SetTrace(self, callback):
+		"""
+		Sets a function to be called with every buffer written to or read from the chip.
+
+		@callback - Called as callback(direction, data, timestamp), where direction is one of TRACE_WRITE, TRACE_READ
+		            and timestamp is the time in seconds since the epoch. Pass None to disable tracing.
+
+		Returns None.
+		"""
+		_mpsse.SetPythonTrace(self.context, callback)
+
+	def BeginBatch(self):
+		"""
+		Starts queuing commands instead of sending them to the chip.
+		All subsequent commands are sent to the chip in a single USB write by FlushBatch.
+		While batching, Read and Transfer return BatchRead objects whose data is filled in by FlushBatch.
+
+		Returns MPSSE_OK on success.
+		Raises an exception on failure.
+		"""
+		if _mpsse.BeginBatch(self.context) == MPSSE_FAIL:
+			raise Exception, "Failed to start batch"
+		self._batch = []
+		return MPSSE_OK
+
+	def FlushBatch(self):
+		"""
+		Sends all queued commands to the chip and ends the batch.
+
+		Returns a list of the BatchRead objects returned while batching, with their data filled in.
+		Raises an exception on failure.
+		"""
+		reads = self._batch
+		expected = _mpsse.BatchPending(self.context)
+		self._batch = None
+
+		# A batch that reads no data returns an empty string whether or not it was sent, so check its status too
+		data = _mpsse.FlushBatch(self.context)
+		if _mpsse.BatchStatus(self.context) != MPSSE_OK or len(data) != expected:
+			self._check_wait()
+			raise Exception, self.ErrorString()
+
+		for read in reads:
+			read._resolve(data)
+		return reads
+
+	def CancelBatch(self):
+		"""
+		Discards any queued commands and ends the batch.
+
+		Returns None.
+		"""
+		self._batch = None
+		_mpsse.CancelBatch(self.context)
+
+	def Batch(self):
+		"""
+		Returns a context manager that queues all commands issued inside a with block and
+		sends them to the chip in a single USB write when the block exits:
+
+			with flash.Batch():
+				flash.Start()
+				flash.Write("\x9F")
+				chipid = flash.Read(3)
+				flash.Stop()
+			print chipid.data
+
+		If an exception is raised inside the with block, the queued commands are discarded.
+		"""
+		return Batch(self)
+
+	def _queue_read(self, before):
+		size = _mpsse.BatchPending(self.context) - before
+		if size > 0:
+			read = BatchRead(before, size)
+			self._batch.append(read)
+			return read
+		return None
+
+	def Compile(self, func, sizes=(), key=None):
+		"""
+		Records the commands issued by func into a Program that Execute can replay with new parameters, in a
+		single USB write and read, without going through the Python wrapper call by call:
+
+			def read_page(spi, address):
+				spi.Start()
+				spi.Write("\\x03" + address)
+				data = spi.Read(256)
+				spi.Stop()
+				return data
+
+			program = spi.Compile(read_page, [3], "read_page")
+			data = spi.Execute("read_page", "\\x00\\x01\\x00")
+
+		func is called several times, with each parameter set to a string of sizes[i] bytes. The bytes of the
+		parameters that are sent to the chip are located by changing them one at a time, so the commands func
+		issues must not depend on the parameter values. func should leave the context as it found it, and
+		must not change the mode or clock, or wait on GPIOL1. The data it reads must fit in the chip's FIFO
+		(4KB for the FT2232H/FT4232H, 1KB for the FT232H). Nothing is sent to the chip while compiling.
+
+		@func  - Function to record, called as func(mpsse, *params). It may return the BatchRead (or a list of
+		         the BatchReads) whose data Execute should return; if it returns None, Execute returns a list
+		         of the data of all of the reads.
+		@sizes - Size of each parameter, in bytes.
+		@key   - If set, the program is saved in self.programs under key, and a program already compiled under
+		         key is returned without recording func again.
+
+		Returns a Program.
+		Raises an exception on failure.
+		"""
+		if key is not None and key in self.programs:
+			return self.programs[key]
+
+		params = [bytearray(size) for size in sizes]
+		(commands, rsize, reads, result) = self._record(func, params)
+		slots = []
+
+		for (i, param) in enumerate(params):
+			for j in range(0, len(param)):
+				param[j] = 0xFF
+				(variant, vsize, vreads, vresult) = self._record(func, params)
+				param[j] = 0x00
+
+				if len(variant) != len(commands) or vsize != rsize:
+					raise Exception, "The commands recorded depend on the value of parameter %d" % i
+
+				for k in range(0, len(commands)):
+					if commands[k] != variant[k]:
+						if commands[k] != "\x00" or variant[k] != "\xFF":
+							raise Exception, "Parameter %d is not sent to the chip as is" % i
+						slots.append((i, j, k))
+
+		program = Program(commands, rsize, list(sizes), slots, reads, result)
+		if key is not None:
+			self.programs[key] = program
+		return program
+
+	def Execute(self, program, *params):
+		"""
+		Runs a program compiled by Compile (or loaded with Program.Loads) with a single USB write and read.
+		Not supported while batching.
+
+		@program - The Program, or the key it was compiled under.
+		@params  - The parameter strings, one for each parameter size the program was compiled with.
+
+		Returns the data of the reads selected by the program's function; see Compile.
+		Raises an exception on failure.
+		"""
+		if self._batch is not None:
+			raise Exception, "Execute is not supported while batching"
+
+		if not isinstance(program, Program):
+			program = self.programs[program]
+
+		buf = bytearray(program.rsize)
+		if _mpsse.Execute(self.context, program.Build(params), buf) == MPSSE_FAIL:
+			raise Exception, self.ErrorString()
+
+		return program.Results(str(buf))
+
+	def _record(self, func, params):
+		if self._batch is not None or _mpsse.BeginRecording(self.context) == MPSSE_FAIL:
+			raise Exception, "Failed to start recording"
+
+		self._batch = []
+		try:
+			result = func(self, *[str(param) for param in params])
+			reads = self._batch
+			rsize = _mpsse.BatchPending(self.context)
+		finally:
+			self._batch = None
+			commands = _mpsse.EndRecording(self.context)
+
+		# Note which of the reads func wants, by index, since each recording returns new BatchRead objects
+		if isinstance(result, BatchRead):
+			result = reads.index(result)
+		elif isinstance(result, (list, tuple)):
+			result = [reads.index(read) for read in result]
+		elif result is not None:
+			raise Exception, "Compiled functions must return a BatchRead, a list of BatchReads or None"
+
+		return (commands, rsize, reads, result)
+
+	def SetAck(self, ack):
+		"""
+		Sets the transmitted ACK bit.
+		For use only in I2C mode.
+
+		@ack - One of: ACK, NACK.
+
+		Returns None.
+		"""
+		_mpsse.SetAck(self.context, ack)
+
+	def SendAcks(self):
+		"""
+		Causes all subsequent I2C read operations to respond with an acknowledgement.
+
+		Returns None.
+		"""
+		_mpsse.SendAcks(self.context)
+
+	def SendNacks(self):
+		"""
+		Causes all subsequent I2C read operations to respond with a no-acknowledgement.
+
+		Returns None.
+		"""
+		return _mpsse.SendNacks(self.context)
+
+	def GetAck(self):
+		"""
+		Returns the last received ACK bit.
+
+		Returns one of: ACK, NACK.
+		"""
+		return _mpsse.GetAck(self.context)
+
+	def GetAcks(self):
+		"""
+		Returns the ACK bits received for each byte sent by the last I2C Write.
+
+		Returns a list of ACK / NACK values, one per byte written.
+		"""
+		acks = bytearray(_mpsse.GetAcks(self.context, bytearray()))
+		_mpsse.GetAcks(self.context, acks)
+		return list(acks)
+
+	def I2CReadReg(self, addr, reg, n):
+		"""
+		Reads from a register of an I2C slave device: start, address + register write, repeated start,
+		address read, n bytes read with the last byte NACKed, stop. The whole sequence is sent to the chip
+		as a single USB transaction.
+		For use only in I2C mode.
+
+		@addr - 7-bit slave address.
+		@reg  - Register address; either an integer (0 - 255) or a string of register address bytes.
+		@n    - Number of bytes to read.
+
+		Returns a tuple of (data, ack), where ack is ACK if the slave acknowledged every address and register byte, else NACK.
+		Raises an exception on failure.
+		"""
+		return self.I2CReadMany([(addr, reg, n)])[0]
+
+	def I2CWriteReg(self, addr, reg, data):
+		"""
+		Writes data to a register of an I2C slave device: start, address + register + data write, stop.
+		The whole sequence is sent to the chip as a single USB transaction.
+		For use only in I2C mode.
+
+		@addr - 7-bit slave address.
+		@reg  - Register address; either an integer (0 - 255) or a string of register address bytes.
+		@data - A string of bytes to write to the register.
+
+		Returns ACK if the slave acknowledged every byte, else NACK.
+		Raises an exception on failure.
+		"""
+		with self.Batch():
+			self.Start()
+			acks = self.Write(chr((addr << 1) & 0xFE) + self._i2c_reg(reg) + data)
+			self.Stop()
+
+		return self._i2c_ack_status([acks])
+
+	def I2CReadMany(self, reads):
+		"""
+		Performs multiple register reads, as per I2CReadReg, in a single USB transaction.
+		For use only in I2C mode.
+
+		@reads - A list of (addr, reg, n) tuples.
+
+		Returns a list of (data, ack) tuples, one per entry in reads.
+		Raises an exception on failure.
+		"""
+		queued = []
+
+		try:
+			with self.Batch():
+				for (addr, reg, n) in reads:
+					queued.append(self._i2c_queue_read(addr, reg, n))
+		finally:
+			self.SendAcks()
+
+		return [(''.join([r.data for r in data]), self._i2c_ack_status(acks)) for (data, acks) in queued]
+
+	def _i2c_reg(self, reg):
+		if isinstance(reg, (int, long)):
+			return chr(reg & 0xFF)
+		return reg
+
+	def _i2c_queue_read(self, addr, reg, n):
+		data = []
+
+		self.Start()
+		wack = self.Write(chr((addr << 1) & 0xFE) + self._i2c_reg(reg))
+		self.Start()
+		rack = self.Write(chr(((addr << 1) | 1) & 0xFF))
+		if n > 1:
+			self.SendAcks()
+			data.append(self.Read(n - 1))
+		if n > 0:
+			self.SendNacks()
+			data.append(self.Read(1))
+		self.Stop()
+
+		return (data, [wack, rack])
+
+	def _i2c_ack_status(self, acks):
+		for ack in acks:
+			for c in ack.data:
+				if ord(c) & 0x01:
+					return NACK
+		return ACK
+
+	def PinHigh(self, pin):
+		"""
+		Sets the specified GPIO pin high.
+		
+		@pin - Pin number 0 - 11 in GPIO mode.
+		       In all other modes, one of: GPIOL0, GPIOL1, GPIOL2, GPIOL3, GPIOH0, GPIOH1, GPIOH2, GPIOH3, GPIOH4, GPIOH5, GPIOH6, GPIOH7.
+
+		Returns MPSSE_OK on success.
+		Raises an exception on failure.
+		"""
+		if _mpsse.PinHigh(self.context, pin) == MPSSE_FAIL:
+			raise Exception, self.ErrorString()
+		return MPSSE_OK
+
+	def PinLow(self, pin):
+		"""
+		Sets the specified GPIO pin low.
+		
+		@pin - Pin number 0 - 11 in GPIO mode.
+		       In all other modes, one of: GPIOL0, GPIOL1, GPIOL2, GPIOL3, GPIOH0, GPIOH1, GPIOH2, GPIOH3, GPIOH4, GPIOH5, GPIOH6, GPIOH7.
+		
+		Returns MPSSE_OK on success.
+		Raises an exception on failure.
+		"""
+		if _mpsse.PinLow(self.context, pin) == MPSSE_FAIL:
+			raise Exception, self.ErrorString()
+		return MPSSE_OK
+
+	def SetPins(self, mask, values):
+		"""
+		Sets multiple GPIO pins high or low with a single command.
+
+		@mask   - An integer with a bit set for each pin to change; bit 0 is pin 0, etc.
+		          Pin numbers are the same as for PinHigh / PinLow.
+		@values - An integer with the bits set to the new pin states; bits not set in mask are ignored.
+
+		Returns MPSSE_OK on success.
+		Raises an exception on failure.
+		"""
+		if _mpsse.SetPins(self.context, mask, values) == MPSSE_FAIL:
+			raise Exception, self.ErrorString()
+		return MPSSE_OK
+
+	def UpdatePins(self, pins):
+		"""
+		Sets multiple GPIO pins high or low with a single command.
+
+		@pins - A dictionary of {pin : state}, where pin is a pin number as for PinHigh / PinLow and state is 1 (high) or 0 (low).
+
+		Returns MPSSE_OK on success.
+		Raises an exception on failure.
+		"""
+		mask = 0
+		values = 0
+
+		for (pin, state) in pins.items():
+			mask |= (1 << pin)
+			if state:
+				values |= (1 << pin)
+
+		return self.SetPins(mask, values)
+
+	def GetPins(self):
+		"""
+		Returns the last values written to the GPIO pins, without reading them from the chip.
+		Bit 0 is pin 0, etc.
+		"""
+		return _mpsse.GetPins(self.context)
+
+	def CoalescePinWrites(self, tf):
+		"""
+		Enables / disables the merging of consecutive GPIO writes while batching.
+		When enabled, only the final state of each run of consecutive pin changes in a batch is sent to the chip.
+
+		@tf - Set to 1 to enable, 0 to disable (default).
+
+		Returns None.
+		"""
+		_mpsse.CoalescePinWrites(self.context, tf)
+
+	def SetDirection(self, direction):
+		"""
+		Sets the input/output direction of pins as determined by direction (1 = Output, 0 = Input). 
+		For use in BITBANG mode only.
+
+		@direction -  Byte indicating input/output direction of each bit (1 is output, 0 is input). 
+
+		Returns MPSSE_OK on success.
+		Raises an exception on failure.
+		"""
+		if _mpsse.SetDirection(self.context, direction) == MPSSE_FAIL:
+			raise Exception, self.ErrorString()
+		return MPSSE_OK
+
+	def WriteBits(self, bits, n):
+		"""
+		Performs a bitwise write of up to 8 bits at a time.
+		
+		@bits - An integer of bits to be written.
+		@n    - Transmit n number of least-significant bits.
+
+		Returns MPSSE_OK on success.
+		Raises an exception on failure.
+		"""
+		if _mpsse.WriteBits(self.context, bits, n) == MPSSE_FAIL:
+			raise Exception, self.ErrorString()
+		return MPSSE_OK
+
+	def ReadBits(self, n):
+		"""
+		Performs a bitwise read of up to 8 bits at a time.
+
+		@n - Number of bits to read.
+
+		Returns an integer value with the read bits set.
+		"""
+		if self._batch is not None:
+			raise Exception, "ReadBits is not supported while batching"
+		return ord(_mpsse.ReadBits(self.context, n))
+
+	def WriteBitstream(self, data, nbits=None):
+		"""
+		Writes an arbitrary number of bits, in a single USB transaction for up to 63KB of data.
+		For use only in SPI0, SPI1, SPI2, SPI3 modes.
+
+		@data  - A string of bytes containing the bits to write. In MSB mode the first bit sent is the most significant
+			 bit of the first byte; in LSB mode it is the least significant bit.
+		@nbits - Number of bits from data to write (default: all of them).
+
+		Returns MPSSE_OK on success.
+		Raises an exception on failure.
+		"""
+		if nbits is None:
+			nbits = len(data) * 8
+
+		if _mpsse.WriteBitstream(self.context, data, nbits) == MPSSE_FAIL:
+			raise Exception, self.ErrorString()
+		return MPSSE_OK
+
+	def ReadBitstream(self, nbits):
+		"""
+		Reads an arbitrary number of bits, in a single USB transaction for up to 63KB of data.
+		For use only in SPI0, SPI1, SPI2, SPI3 modes.
+
+		@nbits - Number of bits to read.
+
+		Returns a string of (nbits + 7) / 8 bytes, with the bits packed as for WriteBitstream.
+		While batching, returns a BatchRead instead.
+		Raises an exception on failure.
+		"""
+		return self._bitstream(None, nbits)
+
+	def TransferBitstream(self, data, nbits=None):
+		"""
+		Writes and reads an arbitrary number of bits, in a single USB transaction for up to 63KB of data.
+		For use only in SPI0, SPI1, SPI2, SPI3 modes.
+
+		@data  - A string of bytes containing the bits to write, packed as for WriteBitstream.
+		@nbits - Number of bits from data to transfer (default: all of them).
+
+		Returns a string of (nbits + 7) / 8 bytes, with the bits packed as for WriteBitstream.
+		While batching, returns a BatchRead instead.
+		Raises an exception on failure.
+		"""
+		if nbits is None:
+			nbits = len(data) * 8
+
+		return self._bitstream(data, nbits)
+
+	def _bitstream(self, data, nbits):
+		buf = bytearray((nbits + 7) / 8)
+
+		if self._batch is not None:
+			before = _mpsse.BatchPending(self.context)
+
+		if data is None:
+			retval = _mpsse.ReadBitstream(self.context, buf, nbits)
+		else:
+			retval = _mpsse.TransferBitstream(self.context, data, buf, nbits)
+
+		if retval == MPSSE_FAIL:
+			raise Exception, self.ErrorString()
+
+		if self._batch is not None:
+			read = BitstreamRead(before, _mpsse.BatchPending(self.context) - before, nbits, self.context.endianess)
+			self._batch.append(read)
+			return read
+
+		return str(buf)
+
+	def JTAGReset(self):
+		"""
+		Resets the JTAG TAP, leaving it in the TAP_RESET state. For use only in JTAG mode.
+
+		Returns MPSSE_OK on success.
+		Raises an exception on failure.
+		"""
+		if _mpsse.JTAGReset(self.context) == MPSSE_FAIL:
+			raise Exception, self.ErrorString()
+		return MPSSE_OK
+
+	def JTAGSetState(self, state):
+		"""
+		Moves the JTAG TAP to the requested state, along the shortest path from its current state.
+		The TAP is reset first if its current state is not known. For use only in JTAG mode.
+
+		@state - One of the TAP_* states, except TAP_UNKNOWN.
+
+		Returns MPSSE_OK on success.
+		Raises an exception on failure.
+		"""
+		if _mpsse.JTAGSetState(self.context, state) == MPSSE_FAIL:
+			raise Exception, self.ErrorString()
+		return MPSSE_OK
+
+	def JTAGGetState(self):
+		"""
+		Returns the current TAP_* state of the JTAG TAP, or TAP_UNKNOWN if it has not been reset yet.
+		"""
+		return _mpsse.JTAGGetState(self.context)
+
+	def JTAGShiftIR(self, data, nbits=None, end=TAP_IDLE):
+		"""
+		Shifts bits through the instruction register, moving the TAP through TAP_IRSHIFT to the end state in a 
+		single USB write. For use only in JTAG mode.
+
+		@data  - A string of bytes containing the bits to shift in, LSB of the first byte first.
+		@nbits - Number of bits from data to shift (default: all of them).
+		@end   - The TAP_* state to leave the TAP in (default: TAP_IDLE).
+
+		Returns a string of (nbits + 7) / 8 bytes containing the bits shifted out, packed in the same way as data.
+		While batching, returns a BatchRead instead.
+		Raises an exception on failure.
+		"""
+		return self._jtag_shift(_mpsse.JTAGShiftIR, data, nbits, end)
+
+	def JTAGShiftDR(self, data, nbits=None, end=TAP_IDLE):
+		"""
+		Shifts bits through the data register selected by the current instruction, moving the TAP through 
+		TAP_DRSHIFT to the end state in a single USB write. For use only in JTAG mode.
+
+		@data  - A string of bytes containing the bits to shift in, LSB of the first byte first.
+		@nbits - Number of bits from data to shift (default: all of them).
+		@end   - The TAP_* state to leave the TAP in (default: TAP_IDLE).
+
+		Returns a string of (nbits + 7) / 8 bytes containing the bits shifted out, packed in the same way as data.
+		While batching, returns a BatchRead instead.
+		Raises an exception on failure.
+		"""
+		return self._jtag_shift(_mpsse.JTAGShiftDR, data, nbits, end)
+
+	def JTAGScanChain(self, max_devices=32):
+		"""
+		Finds the devices on the JTAG chain. The TAP is reset, which selects either the IDCODE or the BYPASS 
+		register in every device, and the data registers of the whole chain are read in a single USB transaction.
+		For use only in JTAG mode; not supported while batching.
+
+		@max_devices - Maximum number of devices on the chain (default: 32).
+
+		Returns a list with one entry per device, nearest to TDO first: the device's 32 bit IDCODE, or None
+		if the device only has a BYPASS register.
+		Raises an exception on failure.
+		"""
+		if self._batch is not None:
+			raise Exception, "JTAGScanChain is not supported while batching"
+
+		# Shift in ones; once they appear on TDO, every device's data register has been read
+		nbits = (max_devices + 1) * 32
+		data = "\xFF" * (nbits / 8)
+
+		with self.Batch():
+			self.JTAGReset()
+			read = self.JTAGShiftDR(data, nbits)
+
+		bits = reduce(lambda value, byte: (value << 8) | ord(byte), reversed(read.data), 0)
+		devices = []
+
+		while len(devices) < max_devices:
+			if bits & 1:
+				idcode = bits & 0xFFFFFFFF
+				if idcode == 0xFFFFFFFF:
+					break
+				devices.append(idcode)
+				bits >>= 32
+			else:
+				devices.append(None)
+				bits >>= 1
+
+		return devices
+
+	def _jtag_shift(self, func, data, nbits, end):
+		if nbits is None:
+			nbits = len(data) * 8
+
+		buf = bytearray((nbits + 7) / 8)
+
+		if self._batch is not None:
+			before = _mpsse.BatchPending(self.context)
+
+		if func(self.context, data, buf, nbits, end) == MPSSE_FAIL:
+			raise Exception, self.ErrorString()
+
+		if self._batch is not None:
+			read = JTAGRead(before, _mpsse.BatchPending(self.context) - before, nbits)
+			self._batch.append(read)
+			return read
+
+		return str(buf)
+
+	def WritePins(self, data):
+		"""
+		Writes a new state to the chip's pins.
+		For use in BITBANG mode only.
+
+		@data - An integer with the bits set to the desired pin states (1 = output, 0 = input).
+
+		Returns MPSSE_OK on success.
+		Raises an exception on failure.
+		"""
+		if _mpsse.WritePins(self.context, data) == MPSSE_FAIL:
+			raise Exception, self.ErrorString()
+		return MPSSE_OK
+
+	def Waveform(self, data, rate=0, capture=False):
+		"""
+		Clocks a waveform out on the pins in bulk.
+		For use only in BITBANG mode; not supported while batching.
+
+		@data    - Pin values for each sample, one byte per sample. May be a string or any object supporting the
+		           buffer interface, such as a bytearray, array('B') or a NumPy uint8 array.
+		@rate    - Sample rate, in samples per second (default: 0, keep the previously used rate).
+		@capture - If True, the state of the pins is captured for every sample (default: False).
+
+		Returns MPSSE_OK if capture is False.
+		Returns a bytearray of the pin states sampled just before each sample was clocked out if capture is True.
+		Raises an exception on failure.
+		"""
+		# The sample rate is set with a USB control transfer, which would overtake any queued commands
+		if self._batch is not None:
+			raise Exception, "Waveform is not supported while batching"
+
+		if capture:
+			rdata = bytearray(len(data))
+			if _mpsse.TransferWaveform(self.context, data, rdata, rate) == MPSSE_FAIL:
+				raise Exception, self.ErrorString()
+			return rdata
+
+		if _mpsse.WriteWaveform(self.context, data, rate) == MPSSE_FAIL:
+			raise Exception, self.ErrorString()
+		return MPSSE_OK
+
+	def ReadPins(self):
+		"""
+		Reads the current state of the chip's pins.
+		For use in BITBANG mode only.
+
+		Returns an integer with the corresponding pin's bits set.
+		Not supported while batching.
+		"""
+		if self._batch is not None:
+			raise Exception, "ReadPins is not supported while batching"
+		return _mpsse.ReadPins(self.context)
+
+	def PinState(self, pin, state=-1):
+		"""
+		Checks the current state of the pins.
+		For use in BITBANG mode only.
+
+		@pin   - The pin number whose state you want to check. 
+		@state - The value returned by ReadPins. If not specified, ReadPins will be called automatically.
+
+		Returns a 1 if the pin is high, 0 if the pin is low.
+		Not supported while batching, unless state is specified.
+		"""
+		if state == -1 and self._batch is not None:
+			raise Exception, "PinState is not supported while batching"
+		return _mpsse.PinState(self.context, pin, state)
+
+	def WaitForPin(self, level, timeout=1000):
+		"""
+		Makes the chip wait until GPIOL1 is at the given level before it executes any of the commands that follow,
+		so that the pin doesn't need to be polled with ReadPins. GPIOL1 is made an input, until the next SetMode.
+		Best used while batching, so that the wait and the read that follows it are sent to the chip together:
+
+			with spi.Batch():
+				spi.WaitForPin(LOW)
+				spi.Start()
+				spi.Write("\x03\x00")
+				sample = spi.Read(2)
+				spi.Stop()
+
+		If the next read doesn't complete within the timeout, the chip is reset to abandon the wait, the
+		commands queued behind it are discarded, and the read raises an exception.
+
+		@level   - The level to wait for, one of: HIGH, LOW.
+		@timeout - Maximum time to wait for the next read to complete, in milliseconds (default: 1000).
+
+		Returns MPSSE_OK on success.
+		Raises an exception on failure.
+		"""
+		if _mpsse.WaitForPin(self.context, level, timeout) == MPSSE_FAIL:
+			raise Exception, self.ErrorString()
+		return MPSSE_OK
+
+	def WaitRead(self, level, size, timeout=1000):
+		"""
+		Waits for GPIOL1 to reach the given level and then reads bytes over the selected serial protocol,
+		with a single USB write and read. See WaitForPin.
+
+		@level   - The level to wait for, one of: HIGH, LOW.
+		@size    - Number of bytes to read.
+		@timeout - Maximum time to wait, in milliseconds (default: 1000).
+
+		Returns a string of size bytes.
+		While batching, returns a BatchRead instead.
+		Raises an exception on failure, or if GPIOL1 didn't reach the level in time.
+		"""
+		buf = bytearray(size)
+
+		if self._batch is not None:
+			before = _mpsse.BatchPending(self.context)
+
+		if _mpsse.WaitRead(self.context, level, buf, timeout) == MPSSE_FAIL:
+			self._check_wait()
+			raise Exception, self.ErrorString()
+
+		if self._batch is not None:
+			return self._queue_read(before)
+
+		return str(buf)
+
+	def _check_wait(self):
+		if self.context.wait_expired:
+			raise Exception, "Timed out waiting for GPIOL1"
+
+	def SamplePins(self, count, interval=0, high=False):
+		"""
+		Captures the state of the pins at a known rate, for use as a simple logic analyzer.
+		The chip clocks interval clock cycles (at the frequency set by SetClock) between samples, which toggles SK.
+		The samples are returned as arrays, which can be wrapped without copying by numpy.frombuffer.
+		Not supported while batching.
+
+		@count    - Number of samples to take.
+		@interval - Number of clock cycles between samples (up to MAX_SAMPLE_INTERVAL). If 0, the samples
+			    are taken as fast as possible, at an unspecified rate.
+		@high     - If True, the high pins are sampled as well.
+
+		Returns a tuple of (samples, timestamps).
+		samples is an array of bytes with the state of the low pins (as returned by ReadPins), or if high is set,
+		an array of 16 bit integers with the low pins in the low byte and the high pins in the high byte.
+		timestamps is an array of the time of each sample in seconds, relative to the first, or None if interval is 0.
+		Raises an exception on failure.
+		"""
+		if self._batch is not None:
+			raise Exception, "SamplePins is not supported while batching"
+
+		width = 2 if high else 1
+		buf = bytearray(count * width)
+
+		if _mpsse.SamplePins(self.context, buf, count, interval, int(high)) == MPSSE_FAIL:
+			raise Exception, self.ErrorString()
+
+		if high:
+			samples = array('H', str(buf))
+			if sys.byteorder == 'big':
+				samples.byteswap()
+		else:
+			samples = array('B', buf)
+
+		timestamps = None
+		if interval:
+			period = float(interval) / self.GetClock()
+			timestamps = array('d', [i * period for i in xrange(count)])
+
+		return (samples, timestamps)
+
+	def Tristate(self):
+		"""
+		Puts all I/O pins into a tristate mode (FT232H only).
+		"""
+		return _mpsse.Tristate(self.context)
+
+	def Version(self):
 		"""
 		Returns the libmpsse version number.
 		High nibble is major, low nibble is minor.
 		"""
 		return _mpsse.Version()
+
+class MPSSEPool(object):
+	"""
+	Thread-safe pool of open MPSSE connections for long running programs, keyed by device serial number and interface.
+
+		pool = MPSSEPool()
+		with pool.Connection("FT123456", IFACE_A, SPI0, TEN_MHZ) as spi:
+			spi.Start()
+			...
+
+	Connections are kept open when they are returned to the pool. Each time a connection is checked out it is
+	switched in place to the requested mode, clock and byte order, which also resets any pin, chip select or ACK
+	state left behind by its previous user; only the chip settings that actually differ are sent to the device.
+	Connections are pinged before they are handed out and are transparently reopened if the device has stopped
+	responding. Each connection is only handed to one thread at a time; other threads asking for it wait until
+	it is returned.
+	"""
+
+	def __init__(self, simulate=False):
+		"""
+		Class constructor.
+
+		@simulate - If True, connect to simulated chips instead of real devices (default: False).
+
+		Returns None.
+		"""
+		self.simulate = simulate
+		self.cond = Condition()
+		self.idle = {}
+		self.busy = set()
+		self.devices = None
+		self.closed = False
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, t, v, traceback):
+		self.Close()
+
+	def _find(self, serial):
+		# Only rescan the bus if the device isn't in the cached device list (it may have just been plugged in)
+		for rescan in [self.devices is None, True]:
+			if rescan:
+				self.devices = ListDevices()
+
+			for device in self.devices:
+				if serial is None or device['serial'] == serial:
+					return device
+
+		raise Exception, "No FTDI device with serial number %s found" % serial
+
+	def _open(self, serial, interface, mode, frequency, endianess):
+		mpsse = MPSSE()
+
+		if self.simulate:
+			mpsse.Simulate(mode, frequency, endianess)
+		else:
+			try:
+				mpsse.OpenDevice(self._find(serial), mode, frequency, endianess, interface)
+			except Exception:
+				# The cached bus location is stale if the device has been unplugged and plugged back in
+				self.devices = None
+				mpsse = MPSSE()
+				mpsse.OpenDevice(self._find(serial), mode, frequency, endianess, interface)
+
+		return mpsse
+
+	def Get(self, serial=None, interface=IFACE_A, mode=SPI0, frequency=ONE_HUNDRED_KHZ, endianess=MSB):
+		"""
+		Checks a connection out of the pool, opening it if needed.
+		The connection must be returned with Put when it is no longer in use.
+
+		@serial    - Serial number of the FTDI device, or None for the first device found (default: None).
+		@interface - The interface to use on the FTDI chip, one of: IFACE_A, IFACE_B, IFACE_C, IFACE_D (default: IFACE_A).
+		@mode      - The MPSSE mode to use, one of: SPI0, SPI1, SPI2, SPI3, I2C, GPIO (default: SPI0).
+		@frequency - The frequency to use for the specified serial protocol, in hertz (default: 100KHz).
+		@endianess - The endianess of data transfers, one of: MSB, LSB (default: MSB).
+
+		Returns an MPSSE object.
+		Raises an exception on failure.
+		"""
+		key = (serial, interface)
+
+		with self.cond:
+			while key in self.busy:
+				self.cond.wait()
+			self.busy.add(key)
+			mpsse = self.idle.pop(key, None)
+
+		try:
+			if mpsse is not None and not mpsse.Ping():
+				mpsse.Close()
+				mpsse = None
+
+			if mpsse is None:
+				mpsse = self._open(serial, interface, mode, frequency, endianess)
+			else:
+				mpsse.SwitchMode(mode, frequency, endianess)
+		except:
+			with self.cond:
+				self.busy.discard(key)
+				self.cond.notify_all()
+			raise
+
+		mpsse._pool_key = key
+		return mpsse
+
+	def Put(self, mpsse):
+		"""
+		Returns a connection obtained from Get to the pool.
+
+		@mpsse - The MPSSE object to return.
+
+		Returns None.
+		"""
+		key = mpsse._pool_key
+
+		with self.cond:
+			if self.closed:
+				mpsse.Close()
+			elif mpsse.context is not None:
+				self.idle[key] = mpsse
+			self.busy.discard(key)
+			self.cond.notify_all()
+
+	def Connection(self, serial=None, interface=IFACE_A, mode=SPI0, frequency=ONE_HUNDRED_KHZ, endianess=MSB):
+		"""
+		Returns a context manager that checks a connection out of the pool with Get, and returns it with Put 
+		when the with block exits. Takes the same arguments as Get.
+		"""
+		return PoolConnection(self, serial, interface, mode, frequency, endianess)
+
+	def Close(self):
+		"""
+		Closes all idle connections in the pool. Connections that are checked out are closed when they are returned.
+
+		Returns None.
+		"""
+		with self.cond:
+			for mpsse in self.idle.values():
+				mpsse.Close()
+			self.idle = {}
+			self.closed = True
+
+class PoolConnection(object):
+	"""
+	Context manager returned by MPSSEPool.Connection.
+	"""
+
+	def __init__(self, pool, *args):
+		self.pool = pool
+		self.args = args
+		self.mpsse = None
+
+	def __enter__(self):
+		self.mpsse = self.pool.Get(*self.args)
+		return self.mpsse
+
+	def __exit__(self, t, v, traceback):
+		self.pool.Put(self.mpsse)
@@ -0,0 +1,448 @@
+from mpsse import MPSSE, SPI0, MSB, FIFTEEN_MHZ
+from time import time
+from mmap import mmap
+import hashlib
+from threading import Thread, Lock
+
+class SPIFlash(object):
+	"""
+	Driver for standard 25-series SPI flash chips.
+
+	Instead of sleeping for the worst case page program / erase time, the status register is read
+	continuously with CS held low (the chip keeps clocking out its status for as long as CS is asserted)
+	and the driver moves on as soon as the WIP bit clears. The first status read after a page program
+	is sent in the same USB transaction as the program command itself.
+	"""
+
+	READ = "\x03"		# Read data command
+	PP = "\x02"		# Page program command
+	WREN = "\x06"		# Write enable command
+	RDSR = "\x05"		# Read status register command
+	SE = "\x20"		# Sector (4KB) erase command
+	BE = "\xD8"		# Block (64KB) erase command
+	CE = "\xC7"		# Chip erase command
+	RDID = "\x9F"		# JEDEC ID command
+
+	WIP = 0x01		# Status register write in progress bit
+
+	ID_LENGTH = 3		# JEDEC ID length, in bytes
+	ADDRESS_LENGTH = 3	# Address length, in bytes
+	PAGE_SIZE = 256		# Page size; page program commands must not cross a page boundary
+	SECTOR_SIZE = 4096	# Size of the area erased by EraseSector
+	BLOCK_SIZE = 65536	# Size of the area erased by EraseBlock
+
+	POLL_PERIOD = .0001	# Time that each USB read of the status register should cover, in seconds
+	POLL_MAX = 512		# Maximum number of status bytes to read per USB read
+	PROGRAM_TIMEOUT = 1	# Page program timeout, in seconds
+	ERASE_TIMEOUT = 400	# Erase timeout, in seconds (large chip erases can take minutes)
+	WINDOW = 256 * 1024	# Default number of bytes read between progress callbacks by ReadInto / Dump
+	HASH = "sha1"		# Hash algorithm used for sector digests
+
+	def __init__(self, mpsse=None, frequency=FIFTEEN_MHZ):
+		"""
+		Class constructor.
+
+		@mpsse     - An open MPSSE object in SPI0 or SPI3 mode. If None, the first FTDI chip found is opened in SPI0 mode.
+		@frequency - The SPI clock frequency to use if mpsse is None (default: 15MHz).
+
+		Returns None.
+		"""
+		if mpsse is None:
+			mpsse = MPSSE(SPI0, frequency, MSB)
+
+		self.flash = mpsse
+		self.chip = self.flash.GetDescription()
+		self.speed = self.flash.GetClock()
+		self.poll_size = max(1, min(self.POLL_MAX, int((self.speed * self.POLL_PERIOD) / 8)))
+		self.programmed = 0
+		self.program_time = 0.0
+
+	def _addr2str(self, address):
+		addr_str = ""
+
+		for i in range(0, self.ADDRESS_LENGTH):
+			addr_str += chr((address >> (i*8)) & 0xFF)
+
+		return addr_str[::-1]
+
+	def _command(self, cmd):
+		self.flash.Start()
+		self.flash.Write(cmd)
+		self.flash.Stop()
+
+	def _busy(self, status):
+		# The chip is ready as soon as any one of the status bytes read shows WIP cleared
+		for byte in status:
+			if not (ord(byte) & self.WIP):
+				return False
+		return True
+
+	def _wait(self, status, timeout):
+		"""
+		Waits for the WIP bit to clear. Must be called with CS asserted and the RDSR command already sent.
+
+		@status  - Status bytes that have already been read.
+		@timeout - Maximum time to wait, in seconds.
+
+		Returns None.
+		Raises an exception on timeout.
+		"""
+		start = time()
+
+		try:
+			while self._busy(status):
+				if (time() - start) > timeout:
+					raise Exception, "Timed out waiting for the flash chip to become ready"
+				status = self.flash.Read(self.poll_size)
+		finally:
+			self.flash.Stop()
+
+	def ChipID(self):
+		"""
+		Returns the chip's JEDEC ID string.
+		"""
+		self.flash.Start()
+		self.flash.Write(self.RDID)
+		chipid = self.flash.Read(self.ID_LENGTH)
+		self.flash.Stop()
+		return chipid
+
+	def Status(self):
+		"""
+		Returns the value of the status register.
+		"""
+		self.flash.Start()
+		self.flash.Write(self.RDSR)
+		status = self.flash.Read(1)
+		self.flash.Stop()
+		return ord(status)
+
+	def WaitReady(self, timeout=ERASE_TIMEOUT):
+		"""
+		Waits until the chip has finished any program or erase operation in progress.
+
+		@timeout - Maximum time to wait, in seconds (default: ERASE_TIMEOUT).
+
+		Returns None.
+		Raises an exception on timeout.
+		"""
+		self.flash.Start()
+		self.flash.Write(self.RDSR)
+		self._wait(self.flash.Read(self.poll_size), timeout)
+
+	def Read(self, count, address=0):
+		"""
+		Reads data from the chip.
+
+		@count   - Number of bytes to read.
+		@address - Address to start reading from (default: 0).
+
+		Returns a string of count bytes.
+		"""
+		self.flash.Start()
+		self.flash.Write(self.READ + self._addr2str(address))
+		data = self.flash.Read(count)
+		self.flash.Stop()
+
+		return data
+
+	def ReadInto(self, buf, offset, address, count, window=WINDOW, progress=None):
+		"""
+		Reads data from the chip directly into a caller supplied buffer, window bytes at a time.
+		CS is held low for the whole read, so the chip streams out consecutive addresses without
+		a new read command being sent for each window.
+
+		@buf      - Any writable object supporting the buffer protocol (bytearray, mmap, array).
+		@offset   - Offset into buf at which to store the data.
+		@address  - Address to start reading from.
+		@count    - Number of bytes to read.
+		@window   - Number of bytes to read per FastReadInto call (default: WINDOW).
+		@progress - If not None, called as progress(n) after each window of n bytes has been read.
+
+		Returns None.
+		Raises an exception on failure.
+		"""
+		done = 0
+
+		self.flash.Start()
+		try:
+			self.flash.Write(self.READ + self._addr2str(address))
+
+			while done < count:
+				n = min(window, count - done)
+				self.flash.FastReadInto(buf, offset + done, n)
+				done += n
+
+				if progress is not None:
+					progress(n)
+		finally:
+			self.flash.Stop()
+
+	def Dump(self, fname, count, address=0, window=WINDOW, progress=None):
+		"""
+		Reads data from the chip into a file, which is memory mapped so that no intermediate copy of the data is made.
+
+		@fname    - Output file name.
+		@count    - Number of bytes to read.
+		@address  - Address to start reading from (default: 0).
+		@window   - Number of bytes to read between progress callbacks (default: WINDOW).
+		@progress - If not None, called as progress(done, total) after each window.
+
+		Returns None.
+		Raises an exception on failure.
+		"""
+		Dump([self], fname, count, address, window, progress)
+
+	def Program(self, data, address):
+		"""
+		Programs up to one page of data and waits for the chip to finish.
+		The write enable, page program and first status read are sent in a single USB transaction.
+
+		@data    - Data to program. Must not cross a page boundary.
+		@address - Address to program the data at.
+
+		Returns None.
+		Raises an exception on failure.
+		"""
+		if (address % self.PAGE_SIZE) + len(data) > self.PAGE_SIZE:
+			raise Exception, "Page program data crosses a page boundary"
+
+		with self.flash.Batch():
+			self._command(self.WREN)
+
+			self.flash.Start()
+			self.flash.Write(self.PP + self._addr2str(address) + data)
+			self.flash.Stop()
+
+			self.flash.Start()
+			self.flash.Write(self.RDSR)
+			status = self.flash.Read(self.poll_size)
+
+		self._wait(status.data, self.PROGRAM_TIMEOUT)
+
+	def Write(self, data, address=0):
+		"""
+		Programs data into the chip, one page at a time. The area being written must have been erased.
+		Pages that are entirely 0xFF are skipped, since they are already in the erased state.
+		Updates the statistics returned by Throughput.
+
+		@data    - Data to program.
+		@address - Address to start programming at (default: 0).
+
+		Returns None.
+		Raises an exception on failure.
+		"""
+		count = 0
+		start = time()
+
+		while count < len(data):
+			# The first and last pages may be partial if address is not page aligned
+			size = min(self.PAGE_SIZE - ((address + count) % self.PAGE_SIZE), len(data) - count)
+			page = data[count:count+size]
+			if page != ("\xFF" * size):
+				self.Program(page, address + count)
+			count += size
+
+		self.programmed += count
+		self.program_time += time() - start
+
+	def _digest(self, buf, address, size):
+		digest = hashlib.new(self.HASH)
+		self.ReadInto(buf, 0, address, size)
+		digest.update(buffer(buf, 0, size))
+		return digest.hexdigest()
+
+	def Update(self, image, address=0, index=None, verify=True, progress=None):
+		"""
+		Programs an image into the chip, only erasing and programming the sectors whose contents differ.
+		Each sector is read back and hashed first, and compared against the image's digest index.
+
+		@image    - Image data (a string or mmap). Any part of the last sector not covered by the image is erased if that sector is rewritten.
+		@address  - Address to program the image at; must be sector aligned (default: 0).
+		@index    - The image's digest index, as returned by DigestIndex. If None, it is computed from image (default: None).
+		@verify   - If True, Verify the image once programming is complete (default: True).
+		@progress - If not None, called as progress(done, total) after each sector is checked.
+
+		Returns a list of the addresses of the sectors that were rewritten.
+		Raises an exception on failure, or if verification fails.
+		"""
+		changed = []
+		offset = 0
+
+		if address % self.SECTOR_SIZE:
+			raise Exception, "Update address is not sector aligned"
+
+		if index is None:
+			index = DigestIndex(image, self.SECTOR_SIZE, self.HASH)
+
+		buf = bytearray(max([size for (size, digest) in index] + [0]))
+
+		for (size, digest) in index:
+			if self._digest(buf, address + offset, size) != digest:
+				for sector in range(address + offset, address + offset + size, self.SECTOR_SIZE):
+					self.EraseSector(sector)
+				self.Write(image[offset:offset+size], address + offset)
+				changed.append(address + offset)
+
+			offset += size
+
+			if progress is not None:
+				progress(offset, len(image))
+
+		if verify and self.Verify(index, address):
+			raise Exception, "Verification failed"
+
+		return changed
+
+	def Verify(self, index, address=0):
+		"""
+		Reads back and hashes the chip's contents one sector at a time, comparing them against a digest index.
+		No copy of the whole image is needed.
+
+		@index   - Digest index, as returned by DigestIndex.
+		@address - Address of the image in the chip (default: 0).
+
+		Returns a list of the addresses of the sectors that do not match.
+		"""
+		bad = []
+		offset = 0
+		buf = bytearray(max([size for (size, digest) in index] + [0]))
+
+		for (size, digest) in index:
+			if self._digest(buf, address + offset, size) != digest:
+				bad.append(address + offset)
+			offset += size
+
+		return bad
+
+	def _erase(self, cmd):
+		with self.flash.Batch():
+			self._command(self.WREN)
+			self._command(cmd)
+
+		self.WaitReady(self.ERASE_TIMEOUT)
+
+	def EraseSector(self, address):
+		"""
+		Erases the SECTOR_SIZE sector that contains address.
+
+		Returns None.
+		"""
+		self._erase(self.SE + self._addr2str(address))
+
+	def EraseBlock(self, address):
+		"""
+		Erases the BLOCK_SIZE block that contains address.
+
+		Returns None.
+		"""
+		self._erase(self.BE + self._addr2str(address))
+
+	def Erase(self):
+		"""
+		Erases the entire chip.
+
+		Returns None.
+		"""
+		self._erase(self.CE)
+
+	def Throughput(self):
+		"""
+		Returns the average programming throughput achieved by Write so far, in bytes per second.
+		"""
+		if self.program_time > 0:
+			return self.programmed / self.program_time
+		return 0
+
+	def Close(self):
+		"""
+		Closes the connection to the FTDI chip.
+
+		Returns None.
+		"""
+		self.flash.Close()
+
+def DigestIndex(image, sector_size=SPIFlash.SECTOR_SIZE, algorithm=SPIFlash.HASH):
+	"""
+	Builds a digest index of an image for SPIFlash.Update and SPIFlash.Verify.
+	The index can be computed once and stored alongside the image.
+
+	@image       - Image data (a string or mmap).
+	@sector_size - Size of each indexed sector, in bytes (default: SPIFlash.SECTOR_SIZE).
+	@algorithm   - Name of the hashlib algorithm to use (default: SPIFlash.HASH).
+
+	Returns a list of (size, hexdigest) tuples, one for each sector.
+	"""
+	index = []
+
+	for offset in range(0, len(image), sector_size):
+		data = image[offset:offset+sector_size]
+		index.append((len(data), hashlib.new(algorithm, data).hexdigest()))
+
+	return index
+
+def Dump(flashes, fname, count, address=0, window=SPIFlash.WINDOW, progress=None):
+	"""
+	Reads data from one or more identical flash chips into a memory mapped file. The address range is split into
+	contiguous slices, one per chip, and each slice is read in its own thread. Libmpsse releases the Python
+	interpreter lock while waiting on USB I/O, so chips on different FTDI interfaces or devices are read in parallel.
+
+	@flashes  - List of SPIFlash objects, each connected to a chip with the same contents.
+	@fname    - Output file name.
+	@count    - Number of bytes to read.
+	@address  - Address to start reading from (default: 0).
+	@window   - Number of bytes to read between progress callbacks (default: SPIFlash.WINDOW).
+	@progress - If not None, called as progress(done, total) after each window from any chip.
+
+	Returns None.
+	Raises an exception if reading from any of the chips fails.
+	"""
+	lock = Lock()
+	done = [0]
+	errors = []
+	threads = []
+
+	# Slices are a multiple of the window size, except for the last one
+	slice_size = ((count / len(flashes)) + window - 1) / window * window
+
+	def update(n):
+		with lock:
+			done[0] += n
+			if progress is not None:
+				progress(done[0], count)
+
+	def worker(flash, buf, offset, size):
+		try:
+			flash.ReadInto(buf, offset, address + offset, size, window, update)
+		except Exception, e:
+			errors.append(e)
+
+	fp = open(fname, 'w+b')
+	try:
+		if count > 0:
+			fp.truncate(count)
+			buf = mmap(fp.fileno(), count)
+
+			try:
+				for i in range(0, len(flashes)):
+					offset = i * slice_size
+					size = min(slice_size, count - offset)
+					if size > 0:
+						threads.append(Thread(target=worker, args=(flashes[i], buf, offset, size)))
+
+				if len(threads) == 1:
+					threads[0].run()
+				else:
+					for thread in threads:
+						thread.start()
+					for thread in threads:
+						thread.join()
+
+				buf.flush()
+			finally:
+				buf.close()
+	finally:
+		fp.close()
+
+	if errors:
+		raise errors[0]
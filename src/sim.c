@@ -0,0 +1,1135 @@
+/*
+ * Simulated FTDI chip, for testing and benchmarking libmpsse without any hardware.
+ *
+ * The simulator implements the transport functions used by support.c. Data written to the chip is
+ * decoded as MPSSE commands (or as bitbang samples), and every pin change and clock edge is played
+ * out on a simulated bus with the following devices attached:
+ *
+ *	o A 1MB SPI flash chip (25 series command set), on SK/DO/DI/CS, in all modes except I2C and JTAG.
+ *	o A 32KB I2C EEPROM (24 series, 16 bit addressing) at slave address 0x50, in I2C mode.
+ *	  DO and DI are tied together to form SDA, and SK is SCL.
+ *	o A JTAG chain of two TAPs, on TCK (SK), TDI (DO), TDO (DI) and TMS (CS), in JTAG mode. TDI feeds the
+ *	  first TAP (4 bit IR), whose TDO feeds the second (5 bit IR). Both support the BYPASS, IDCODE and a 
+ *	  32 bit read / write USER data register instruction, and select IDCODE on reset.
+ *	o Loopback connections between pairs of GPIO pins: GPIOL0 <-> GPIOL1, GPIOL2 <-> GPIOL3,
+ *	  GPIOH0 <-> GPIOH1, etc. A pin configured as an input reads the level of the other pin in its pair.
+ *	  Since nothing else drives the pins, a wait on GPIOL1 that isn't already satisfied never ends.
+ */
+
+#include <stdlib.h>
+#include <string.h>
+#include <unistd.h>
+
+#if LIBFTDI1 == 1
+#include <libftdi1/ftdi.h>
+#else
+#include <ftdi.h>
+#endif
+
+#include "mpsse.h"
+#include "support.h"
+
+#define SIM_VID			0x0403
+#define SIM_PID			0x6010
+#define SIM_DESCRIPTION		"Simulated FT2232H"
+
+#define SIM_FLASH_SIZE		(1024 * 1024)
+#define SIM_FLASH_PAGE		256
+#define SIM_FLASH_SECTOR	(4 * 1024)
+#define SIM_FLASH_BLOCK		(64 * 1024)
+#define SIM_PROGRAM_POLLS	2		/* Number of status reads for which WIP stays set after a page program */
+#define SIM_ERASE_POLLS		16		/* Number of status reads for which WIP stays set after an erase */
+
+#define SIM_EEPROM_SIZE		(32 * 1024)
+#define SIM_EEPROM_PAGE		64
+#define SIM_EEPROM_ADDRESS	0x50
+
+#define SIM_BAD_COMMAND		0xFA
+
+#define SIM_TAPS		2
+#define SIM_TAP_IDCODE		0x0E		/* IDCODE instruction, the low bits of which are used for IRs shorter than 4 bits */
+#define SIM_TAP_USER		0x02		/* USER instruction, selects a 32 bit read / write data register */
+
+enum sim_eeprom_states
+{
+	EEPROM_IDLE,
+	EEPROM_RECEIVE,
+	EEPROM_ACK,
+	EEPROM_SEND,
+	EEPROM_MASTER_ACK
+};
+
+struct sim_flash
+{
+	unsigned char mem[SIM_FLASH_SIZE];
+	int selected;
+	int count;
+	int bits;
+	uint8_t shift;
+	uint8_t out;
+	uint8_t cmd;
+	uint32_t addr;
+	int wel;
+	int busy;
+};
+
+struct sim_eeprom
+{
+	unsigned char mem[SIM_EEPROM_SIZE];
+	enum sim_eeprom_states state;
+	int count;
+	int bits;
+	int read;
+	int sda;
+	int master_ack;
+	uint8_t shift;
+	uint8_t out;
+	uint16_t addr;
+};
+
+struct sim_tap
+{
+	int ir_len;
+	uint32_t idcode;
+	uint32_t ir;
+	uint64_t shift;
+	int shift_len;
+	uint32_t user;
+};
+
+struct sim_jtag
+{
+	int state;
+	int tdo;
+	struct sim_tap taps[SIM_TAPS];
+};
+
+struct sim_chip
+{
+	enum modes mode;
+	int latency;
+	int bitmode;
+	int loopback;
+	uint8_t low;
+	uint8_t low_dir;
+	uint8_t high;
+	uint8_t high_dir;
+	/* Bus levels as of the last update, for edge detection */
+	int sk;
+	int cs;
+	int sda;
+	int waiting;
+	unsigned char *cmd;
+	int cmd_size;
+	int cmd_alloc;
+	unsigned char *out;
+	int out_size;
+	int out_pos;
+	int out_alloc;
+	const char *error;
+	int write_errors;
+	struct sim_flash flash;
+	struct sim_eeprom eeprom;
+	struct sim_jtag jtag;
+};
+
+/* Queues a byte of data to be read by the host */
+static void sim_output(struct sim_chip *sim, uint8_t data)
+{
+	if(grow_buffer(&sim->out, &sim->out_alloc, sim->out_size + 1) == MPSSE_OK)
+	{
+		sim->out[sim->out_size++] = data;
+	}
+}
+
+/* Level of one of the low pins as driven by the chip, or 1 (pulled up) if the pin is an input */
+static int sim_driven(struct sim_chip *sim, uint8_t pin)
+{
+	if(sim->low_dir & pin)
+	{
+		return ((sim->low & pin) != 0);
+	}
+
+	return 1;
+}
+
+/* Level of the I2C SDA line (DO and DI tied together), pulled up and driven low by the master or the EEPROM */
+static int sim_sda(struct sim_chip *sim)
+{
+	return sim_driven(sim, DO) & sim_driven(sim, DI) & sim->eeprom.sda;
+}
+
+/* Level of the DI pin */
+static int sim_di(struct sim_chip *sim)
+{
+	int di = 1;
+
+	if(sim->loopback)
+	{
+		di = sim_driven(sim, DO);
+	}
+	else if(sim->mode == I2C)
+	{
+		di = sim_sda(sim);
+	}
+	else if(sim->mode == JTAG)
+	{
+		di = sim->jtag.tdo;
+	}
+	else if(sim->flash.selected)
+	{
+		di = (sim->flash.out >> (7 - sim->flash.bits)) & 1;
+	}
+
+	return di;
+}
+
+/* Reads the level of all eight pins in one byte of the port, including the GPIO loopback connections */
+static uint8_t sim_port(struct sim_chip *sim, uint8_t value, uint8_t dir, int first_gpio)
+{
+	uint8_t pins = 0;
+	int i = 0, pair = 0;
+
+	for(i=0; i<8; i++)
+	{
+		pair = i ^ 1;
+
+		if(dir & (1 << i))
+		{
+			pins |= (value & (1 << i));
+		}
+		else if(i >= first_gpio && (dir & (1 << pair)))
+		{
+			pins |= ((value >> pair) & 1) << i;
+		}
+		else
+		{
+			pins |= (1 << i);
+		}
+	}
+
+	return pins;
+}
+
+static uint8_t sim_low_pins(struct sim_chip *sim)
+{
+	uint8_t pins = sim_port(sim, sim->low, sim->low_dir, NUM_GPIOL_PINS);
+
+	if(sim_di(sim))
+	{
+		pins |= DI;
+	}
+	else
+	{
+		pins &= ~DI;
+	}
+
+	return pins;
+}
+
+static uint8_t sim_high_pins(struct sim_chip *sim)
+{
+	return sim_port(sim, sim->high, sim->high_dir, 0);
+}
+
+/* Called at the end of each SPI flash command */
+static void flash_deselect(struct sim_flash *flash)
+{
+	uint32_t size = 0;
+
+	flash->selected = 0;
+
+	if(flash->busy || flash->count == 0)
+	{
+		return;
+	}
+
+	switch(flash->cmd)
+	{
+		case 0x06:
+			flash->wel = 1;
+			break;
+		case 0x04:
+			flash->wel = 0;
+			break;
+		case 0x02:
+			if(flash->wel && flash->count > 4)
+			{
+				flash->busy = SIM_PROGRAM_POLLS;
+			}
+			flash->wel = 0;
+			break;
+		case 0x20:
+		case 0x52:
+		case 0xD8:
+			if(flash->wel && flash->count >= 4)
+			{
+				size = (flash->cmd == 0x20) ? SIM_FLASH_SECTOR : SIM_FLASH_BLOCK;
+				memset(flash->mem + ((flash->addr % SIM_FLASH_SIZE) & ~(size - 1)), 0xFF, size);
+				flash->busy = SIM_ERASE_POLLS;
+			}
+			flash->wel = 0;
+			break;
+		case 0x60:
+		case 0xC7:
+			if(flash->wel)
+			{
+				memset(flash->mem, 0xFF, SIM_FLASH_SIZE);
+				flash->busy = SIM_ERASE_POLLS;
+			}
+			flash->wel = 0;
+			break;
+	}
+}
+
+/* Called for every byte clocked into the SPI flash; sets up the next byte to be clocked out */
+static void flash_byte(struct sim_flash *flash, uint8_t data)
+{
+	static const uint8_t jedec_id[] = { 0xEF, 0x40, 0x14 };
+	int i = flash->count++;
+	uint32_t addr = 0;
+
+	flash->out = 0xFF;
+
+	if(i == 0)
+	{
+		flash->cmd = data;
+		flash->addr = 0;
+	}
+	else if(i <= 3)
+	{
+		flash->addr = (flash->addr << 8) | data;
+	}
+
+	/* While a program or erase is in progress, only the status register can be read */
+	if(flash->busy && flash->cmd != 0x05)
+	{
+		return;
+	}
+
+	switch(flash->cmd)
+	{
+		case 0x05:
+			/* Count down the busy period once for each status byte clocked out */
+			if(i > 0 && flash->busy)
+			{
+				flash->busy--;
+			}
+			flash->out = (flash->busy ? 0x01 : 0x00) | (flash->wel ? 0x02 : 0x00);
+			break;
+		case 0x9F:
+			if(i < (int) sizeof(jedec_id))
+			{
+				flash->out = jedec_id[i];
+			}
+			break;
+		case 0x03:
+			if(i >= 3)
+			{
+				flash->out = flash->mem[(flash->addr + i - 3) % SIM_FLASH_SIZE];
+			}
+			break;
+		case 0x0B:
+			if(i >= 4)
+			{
+				flash->out = flash->mem[(flash->addr + i - 4) % SIM_FLASH_SIZE];
+			}
+			break;
+		case 0x02:
+			/* Page programming wraps around within the page, and can only clear bits */
+			if(i >= 4 && flash->wel)
+			{
+				addr = (flash->addr % SIM_FLASH_SIZE) & ~(SIM_FLASH_PAGE - 1);
+				addr |= (flash->addr + i - 4) & (SIM_FLASH_PAGE - 1);
+				flash->mem[addr] &= data;
+			}
+			break;
+	}
+}
+
+/* Feeds the current SPI bus state to the flash chip */
+static void flash_update(struct sim_chip *sim, int cs, int sk)
+{
+	struct sim_flash *flash = &sim->flash;
+
+	if(sim->cs && !cs)
+	{
+		flash->selected = 1;
+		flash->count = 0;
+		flash->bits = 0;
+		flash->out = 0xFF;
+	}
+	else if(!sim->cs && cs)
+	{
+		flash_deselect(flash);
+	}
+
+	/* Data is clocked in on the rising edge of the clock */
+	if(flash->selected && !sim->sk && sk)
+	{
+		flash->shift = (flash->shift << 1) | sim_driven(sim, DO);
+		if(++flash->bits == 8)
+		{
+			flash->bits = 0;
+			flash_byte(flash, flash->shift);
+		}
+	}
+}
+
+/* Called for every byte clocked into the EEPROM. Returns 1 if the byte is acknowledged. */
+static int eeprom_byte(struct sim_eeprom *eeprom, uint8_t data)
+{
+	int i = eeprom->count++;
+
+	if(i == 0)
+	{
+		if((data >> 1) != SIM_EEPROM_ADDRESS)
+		{
+			return 0;
+		}
+
+		eeprom->read = data & 1;
+	}
+	else if(!eeprom->read)
+	{
+		if(i == 1)
+		{
+			eeprom->addr = (data << 8) & (SIM_EEPROM_SIZE - 1);
+		}
+		else if(i == 2)
+		{
+			eeprom->addr |= data;
+		}
+		else
+		{
+			/* Writes wrap around within the page */
+			eeprom->mem[eeprom->addr] = data;
+			eeprom->addr = (eeprom->addr & ~(SIM_EEPROM_PAGE - 1)) | ((eeprom->addr + 1) & (SIM_EEPROM_PAGE - 1));
+		}
+	}
+
+	return 1;
+}
+
+/* Starts sending the next byte of EEPROM data to the master */
+static void eeprom_send(struct sim_eeprom *eeprom)
+{
+	eeprom->out = eeprom->mem[eeprom->addr];
+	eeprom->addr = (eeprom->addr + 1) & (SIM_EEPROM_SIZE - 1);
+	eeprom->bits = 0;
+	eeprom->sda = (eeprom->out >> 7) & 1;
+	eeprom->state = EEPROM_SEND;
+}
+
+/* Feeds the current I2C bus state to the EEPROM */
+static void eeprom_update(struct sim_chip *sim, int scl, int sda)
+{
+	struct sim_eeprom *eeprom = &sim->eeprom;
+
+	/* SDA changing while SCL is high is either a start or a stop condition */
+	if(sim->sk && scl && sim->sda != sda)
+	{
+		eeprom->sda = 1;
+		eeprom->bits = 0;
+		eeprom->count = 0;
+
+		if(!sda)
+		{
+			eeprom->state = EEPROM_RECEIVE;
+		}
+		else
+		{
+			eeprom->state = EEPROM_IDLE;
+		}
+	}
+	/* Data is sampled on the rising edge of the clock */
+	else if(!sim->sk && scl)
+	{
+		if(eeprom->state == EEPROM_RECEIVE)
+		{
+			eeprom->shift = (eeprom->shift << 1) | sda;
+			eeprom->bits++;
+		}
+		else if(eeprom->state == EEPROM_MASTER_ACK)
+		{
+			eeprom->master_ack = sda;
+		}
+	}
+	/* And changed on the falling edge */
+	else if(sim->sk && !scl)
+	{
+		switch(eeprom->state)
+		{
+			case EEPROM_RECEIVE:
+				if(eeprom->bits == 8)
+				{
+					if(eeprom_byte(eeprom, eeprom->shift))
+					{
+						eeprom->sda = 0;
+						eeprom->state = EEPROM_ACK;
+					}
+					else
+					{
+						eeprom->state = EEPROM_IDLE;
+					}
+				}
+				break;
+			case EEPROM_ACK:
+				eeprom->sda = 1;
+				if(eeprom->read)
+				{
+					eeprom_send(eeprom);
+				}
+				else
+				{
+					eeprom->bits = 0;
+					eeprom->state = EEPROM_RECEIVE;
+				}
+				break;
+			case EEPROM_SEND:
+				if(++eeprom->bits == 8)
+				{
+					eeprom->sda = 1;
+					eeprom->state = EEPROM_MASTER_ACK;
+				}
+				else
+				{
+					eeprom->sda = (eeprom->out >> (7 - eeprom->bits)) & 1;
+				}
+				break;
+			case EEPROM_MASTER_ACK:
+				if(eeprom->master_ack == ACK)
+				{
+					eeprom_send(eeprom);
+				}
+				else
+				{
+					eeprom->state = EEPROM_IDLE;
+				}
+				break;
+			case EEPROM_IDLE:
+				break;
+		}
+	}
+}
+
+/* Puts the JTAG TAPs in the reset state, selecting the IDCODE instruction */
+static void jtag_reset(struct sim_jtag *jtag)
+{
+	int i = 0;
+
+	jtag->state = TAP_RESET;
+
+	for(i=0; i<SIM_TAPS; i++)
+	{
+		jtag->taps[i].ir = SIM_TAP_IDCODE & ((1 << jtag->taps[i].ir_len) - 1);
+	}
+}
+
+/* Feeds the current JTAG bus state to the TAPs */
+static void jtag_update(struct sim_chip *sim, int tck, int tms)
+{
+	struct sim_jtag *jtag = &sim->jtag;
+	struct sim_tap *tap = NULL;
+	int i = 0, tdi = 0, out = 0, shifting = 0;
+
+	/* The TAPs act on, and change state on, the rising edge of TCK */
+	if(!sim->sk && tck)
+	{
+		tdi = sim_driven(sim, DO);
+
+		for(i=0; i<SIM_TAPS; i++)
+		{
+			tap = &jtag->taps[i];
+
+			switch(jtag->state)
+			{
+				case TAP_DRCAPTURE:
+					if(tap->ir == (SIM_TAP_IDCODE & ((1 << tap->ir_len) - 1)))
+					{
+						tap->shift = tap->idcode;
+						tap->shift_len = 32;
+					}
+					else if(tap->ir == SIM_TAP_USER)
+					{
+						tap->shift = tap->user;
+						tap->shift_len = 32;
+					}
+					else
+					{
+						/* BYPASS, and any unknown instruction */
+						tap->shift = 0;
+						tap->shift_len = 1;
+					}
+					break;
+				case TAP_IRCAPTURE:
+					tap->shift = 0x01;
+					tap->shift_len = tap->ir_len;
+					break;
+				case TAP_DRSHIFT:
+				case TAP_IRSHIFT:
+					/* Each TAP's TDO feeds the next one's TDI */
+					out = tap->shift & 1;
+					tap->shift = (tap->shift >> 1) | ((uint64_t) tdi << (tap->shift_len - 1));
+					tdi = out;
+					break;
+			}
+		}
+
+		jtag->state = tap_transitions[jtag->state][tms];
+
+		for(i=0; i<SIM_TAPS; i++)
+		{
+			tap = &jtag->taps[i];
+
+			if(jtag->state == TAP_IRUPDATE)
+			{
+				tap->ir = (uint32_t) tap->shift;
+			}
+			else if(jtag->state == TAP_DRUPDATE && tap->ir == SIM_TAP_USER)
+			{
+				tap->user = (uint32_t) tap->shift;
+			}
+		}
+
+		if(jtag->state == TAP_RESET)
+		{
+			jtag_reset(jtag);
+		}
+	}
+	/* TDO changes on the falling edge of TCK, and is only driven in the shift states */
+	else if(sim->sk && !tck)
+	{
+		shifting = (jtag->state == TAP_DRSHIFT || jtag->state == TAP_IRSHIFT);
+		jtag->tdo = shifting ? (jtag->taps[SIM_TAPS-1].shift & 1) : 1;
+	}
+}
+
+/* Propagates a change in the pin states to the attached devices */
+static void sim_bus(struct sim_chip *sim)
+{
+	int sk = sim_driven(sim, SK);
+	int cs = sim_driven(sim, CS);
+
+	if(sim->mode == I2C)
+	{
+		eeprom_update(sim, sk, sim_sda(sim));
+	}
+	else if(sim->mode == JTAG)
+	{
+		jtag_update(sim, sk, cs);
+	}
+	else
+	{
+		flash_update(sim, cs, sk);
+	}
+
+	sim->sk = sk;
+	sim->cs = cs;
+	sim->sda = sim_sda(sim);
+}
+
+/*
+ * Clocks one bit of data. Returns the level of DI on the edge specified by the read_neg flag.
+ * If tms is not -1, it is clocked out on the TMS (CS) pin.
+ */
+static int sim_clock(struct sim_chip *sim, int bit, int write, int tms, int read_neg)
+{
+	int edge = 0, sample = 1, level = 0;
+
+	if(write)
+	{
+		sim->low = bit ? (sim->low | DO) : (sim->low & ~DO);
+	}
+
+	if(tms != -1)
+	{
+		sim->low = tms ? (sim->low | CS) : (sim->low & ~CS);
+	}
+
+	if(write || tms != -1)
+	{
+		sim_bus(sim);
+	}
+
+	for(edge=0; edge<2; edge++)
+	{
+		level = !(sim->low & SK);
+
+		if(level != read_neg)
+		{
+			sample = sim_di(sim);
+		}
+
+		sim->low = level ? (sim->low | SK) : (sim->low & ~SK);
+		sim_bus(sim);
+	}
+
+	return sample;
+}
+
+/* Clocks size bits of data, returning the bits read */
+static uint8_t sim_clock_bits(struct sim_chip *sim, uint8_t cmd, uint8_t data, int size)
+{
+	int i = 0, bit = 0, tms = -1, sample = 0;
+	uint8_t rdata = 0;
+
+	for(i=0; i<size; i++)
+	{
+		if(cmd & MPSSE_WRITE_TMS)
+		{
+			/* TMS data is always sent LSB first, and bit 7 is held on DO */
+			tms = (data >> i) & 1;
+			bit = (data >> 7) & 1;
+		}
+		else if(cmd & MPSSE_LSB)
+		{
+			bit = (data >> i) & 1;
+		}
+		else
+		{
+			bit = (data >> (7 - i)) & 1;
+		}
+
+		sample = sim_clock(sim, bit, (cmd & (MPSSE_DO_WRITE | MPSSE_WRITE_TMS)) != 0, tms, (cmd & MPSSE_READ_NEG) != 0);
+
+		if((cmd & MPSSE_LSB) || (cmd & MPSSE_WRITE_TMS))
+		{
+			rdata = (rdata >> 1) | (sample << 7);
+		}
+		else
+		{
+			rdata = (rdata << 1) | sample;
+		}
+	}
+
+	return rdata;
+}
+
+/* Clocks count cycles without transferring any data */
+static void sim_clock_cycles(struct sim_chip *sim, int count)
+{
+	while(count-- > 0)
+	{
+		sim_clock(sim, 0, 0, -1, 0);
+	}
+}
+
+/* Executes one MPSSE command. Returns the size of the command, or 0 if all of the command has not been received yet. */
+static int sim_command(struct sim_chip *sim, unsigned char *buf, int size)
+{
+	uint8_t cmd = buf[0], rdata = 0;
+	int n = 1, i = 0, len = 0, write = 0;
+
+	/* Data transfer commands */
+	if(!(cmd & 0x80) && (cmd & (MPSSE_DO_WRITE | MPSSE_DO_READ | MPSSE_WRITE_TMS)))
+	{
+		write = (cmd & (MPSSE_DO_WRITE | MPSSE_WRITE_TMS)) != 0;
+
+		if(cmd & MPSSE_BITMODE)
+		{
+			n = write ? 3 : 2;
+			if(size < n)
+			{
+				return 0;
+			}
+
+			len = (buf[1] & 0x07) + 1;
+			rdata = sim_clock_bits(sim, cmd, write ? buf[2] : 0, len);
+			if(cmd & MPSSE_DO_READ)
+			{
+				sim_output(sim, rdata);
+			}
+		}
+		else if(!(cmd & MPSSE_WRITE_TMS))
+		{
+			if(size < 3)
+			{
+				return 0;
+			}
+
+			len = (buf[1] | (buf[2] << 8)) + 1;
+			n = write ? (3 + len) : 3;
+			if(size < n)
+			{
+				return 0;
+			}
+
+			for(i=0; i<len; i++)
+			{
+				rdata = sim_clock_bits(sim, cmd, write ? buf[3+i] : 0, 8);
+				if(cmd & MPSSE_DO_READ)
+				{
+					sim_output(sim, rdata);
+				}
+			}
+		}
+		else
+		{
+			/* TMS commands must be bit mode commands */
+			sim_output(sim, SIM_BAD_COMMAND);
+			sim_output(sim, cmd);
+		}
+
+		return n;
+	}
+
+	switch(cmd)
+	{
+		case SET_BITS_LOW:
+		case SET_BITS_HIGH:
+			n = 3;
+			if(size < n)
+			{
+				return 0;
+			}
+
+			if(cmd == SET_BITS_LOW)
+			{
+				sim->low = buf[1];
+				sim->low_dir = buf[2];
+				sim_bus(sim);
+			}
+			else
+			{
+				sim->high = buf[1];
+				sim->high_dir = buf[2];
+			}
+			break;
+		case GET_BITS_LOW:
+			sim_output(sim, sim_low_pins(sim));
+			break;
+		case GET_BITS_HIGH:
+			sim_output(sim, sim_high_pins(sim));
+			break;
+		case LOOPBACK_START:
+			sim->loopback = 1;
+			break;
+		case LOOPBACK_END:
+			sim->loopback = 0;
+			break;
+		case TCK_DIVISOR:
+		case 0x9C:
+		case 0x9D:
+		case 0x9E:
+			n = 3;
+			break;
+		case CLOCK_N_CYCLES:
+			n = 2;
+			if(size >= n)
+			{
+				sim_clock_cycles(sim, (buf[1] & 0x07) + 1);
+			}
+			break;
+		case CLOCK_N8_CYCLES:
+			n = 3;
+			if(size >= n)
+			{
+				sim_clock_cycles(sim, ((buf[1] | (buf[2] << 8)) + 1) * 8);
+			}
+			break;
+		case WAIT_ON_HIGH:
+		case WAIT_ON_LOW:
+			/* Hold up this and all following commands until GPIOL1 reaches the level being waited for */
+			sim->waiting = (((sim_low_pins(sim) & GPIO1) != 0) != (cmd == WAIT_ON_HIGH));
+			if(sim->waiting)
+			{
+				return 0;
+			}
+			break;
+		case SEND_IMMEDIATE:
+		case TCK_X5:
+		case TCK_D5:
+		case ENABLE_3_PHASE_CLOCK:
+		case DISABLE_3_PHASE_CLOCK:
+		case PULSE_CLOCK_IO_HIGH:
+		case PULSE_CLOCK_IO_LOW:
+		case ENABLE_ADAPTIVE_CLOCK:
+		case DISABLE_ADAPTIVE_CLOCK:
+			break;
+		default:
+			/* The chip responds to unknown commands with the bad command byte followed by the command */
+			sim_output(sim, SIM_BAD_COMMAND);
+			sim_output(sim, cmd);
+			break;
+	}
+
+	if(size < n)
+	{
+		return 0;
+	}
+
+	return n;
+}
+
+static int sim_write(struct mpsse_context *mpsse, unsigned char *buf, int size)
+{
+	struct sim_chip *sim = mpsse->transport_data;
+	int i = 0, n = 0;
+
+	if(sim->latency > 0)
+	{
+		usleep(sim->latency);
+	}
+
+	if(sim->write_errors > 0)
+	{
+		sim->write_errors--;
+		sim->error = "Simulated USB write error";
+		return -1;
+	}
+
+	/* The device attached to the bus follows the context's mode, so that SwitchMode can move between the flash and the EEPROM */
+	sim->mode = mpsse->mode;
+
+	if(sim->bitmode == BITMODE_MPSSE)
+	{
+		/* Commands may be split across writes, so keep any partial command around until the rest of it arrives */
+		if(grow_buffer(&sim->cmd, &sim->cmd_alloc, sim->cmd_size + size) != MPSSE_OK)
+		{
+			sim->error = "Simulator out of memory";
+			return -1;
+		}
+
+		memcpy(sim->cmd + sim->cmd_size, buf, size);
+		sim->cmd_size += size;
+
+		while(i < sim->cmd_size && (n = sim_command(sim, sim->cmd + i, sim->cmd_size - i)) > 0)
+		{
+			i += n;
+		}
+
+		memmove(sim->cmd, sim->cmd + i, sim->cmd_size - i);
+		sim->cmd_size -= i;
+	}
+	else if(sim->bitmode == BITMODE_BITBANG || sim->bitmode == BITMODE_SYNCBB)
+	{
+		for(i=0; i<size; i++)
+		{
+			/* In synchronous bitbang mode the pins are read before each new value is set */
+			if(sim->bitmode == BITMODE_SYNCBB)
+			{
+				sim_output(sim, sim_low_pins(sim));
+			}
+
+			sim->low = buf[i];
+			sim_bus(sim);
+		}
+	}
+
+	return size;
+}
+
+static int sim_read(struct mpsse_context *mpsse, unsigned char *buf, int size)
+{
+	struct sim_chip *sim = mpsse->transport_data;
+	int n = sim->out_size - sim->out_pos;
+
+	if(sim->latency > 0)
+	{
+		usleep(sim->latency);
+	}
+
+	/* While waiting on GPIOL1, a real chip returns no data each time its latency timer expires */
+	if(n <= 0 && sim->waiting)
+	{
+		usleep(LATENCY_MS * 1000);
+		return 0;
+	}
+
+	/* A real chip would just time out here; fail instead, since there is no data on the way */
+	if(n <= 0)
+	{
+		sim->error = "No data available to read from the simulator";
+		return -1;
+	}
+
+	if(n > size)
+	{
+		n = size;
+	}
+
+	memcpy(buf, sim->out + sim->out_pos, n);
+	sim->out_pos += n;
+
+	if(sim->out_pos == sim->out_size)
+	{
+		sim->out_pos = sim->out_size = 0;
+	}
+
+	return n;
+}
+
+static int sim_purge(struct mpsse_context *mpsse)
+{
+	struct sim_chip *sim = mpsse->transport_data;
+
+	sim->cmd_size = 0;
+	sim->waiting = 0;
+	sim->out_pos = sim->out_size = 0;
+
+	return 0;
+}
+
+static int sim_purge_rx(struct mpsse_context *mpsse)
+{
+	struct sim_chip *sim = mpsse->transport_data;
+
+	sim->out_pos = sim->out_size = 0;
+
+	return 0;
+}
+
+static int sim_read_pins(struct mpsse_context *mpsse, unsigned char *pins)
+{
+	*pins = sim_low_pins(mpsse->transport_data);
+	return 0;
+}
+
+static int sim_set_bitmode(struct mpsse_context *mpsse, unsigned char mask, unsigned char mode)
+{
+	struct sim_chip *sim = mpsse->transport_data;
+
+	sim->bitmode = mode;
+	sim->cmd_size = 0;
+	sim->waiting = 0;
+
+	if(mode == BITMODE_BITBANG || mode == BITMODE_SYNCBB)
+	{
+		sim->low_dir = mask;
+	}
+	else if(mode == BITMODE_RESET)
+	{
+		sim->low_dir = 0;
+		sim->high_dir = 0;
+	}
+
+	sim_bus(sim);
+
+	return 0;
+}
+
+static int sim_set_baudrate(struct mpsse_context *mpsse, int rate)
+{
+	return 0;
+}
+
+static const char *sim_error_string(struct mpsse_context *mpsse)
+{
+	struct sim_chip *sim = mpsse->transport_data;
+
+	if(sim && sim->error)
+	{
+		return sim->error;
+	}
+
+	return "";
+}
+
+static void sim_close(struct mpsse_context *mpsse)
+{
+	struct sim_chip *sim = mpsse->transport_data;
+
+	if(sim)
+	{
+		free(sim->cmd);
+		free(sim->out);
+		free(sim);
+		mpsse->transport_data = NULL;
+	}
+}
+
+const struct mpsse_transport sim_transport = {
+	sim_write,
+	sim_read,
+	sim_purge,
+	sim_purge_rx,
+	sim_read_pins,
+	sim_set_bitmode,
+	sim_set_baudrate,
+	sim_error_string,
+	sim_close
+};
+
+/*
+ * Opens a simulated FT2232H chip instead of a real FTDI device.
+ * The simulated chip executes MPSSE commands in-process and emulates an SPI flash chip, an I2C EEPROM
+ * and GPIO loopback connections; see sim.c for details.
+ *
+ * @mode      - Mode to open the device in. One of enum modes.
+ * @freq      - Clock frequency to use for the specified mode.
+ * @endianess - Specifies how data is clocked in/out (MSB, LSB).
+ * @latency   - Simulated USB latency of each read and write, in microseconds.
+ *
+ * Returns a pointer to an MPSSE context structure.
+ * On success, mpsse->open will be set to 1.
+ * On failure, mpsse->open will be set to 0.
+ */
+struct mpsse_context *OpenSimulator(enum modes mode, int freq, int endianess, int latency)
+{
+	struct mpsse_context *mpsse = NULL;
+	struct sim_chip *sim = NULL;
+
+	mpsse = malloc(sizeof(struct mpsse_context));
+	if(mpsse)
+	{
+		memset(mpsse, 0, sizeof(struct mpsse_context));
+		FlushAfterRead(mpsse, 0);
+
+		sim = calloc(1, sizeof(struct sim_chip));
+		if(sim)
+		{
+			sim->mode = mode;
+			sim->latency = latency;
+			sim->sk = sim->cs = sim->sda = 1;
+			sim->eeprom.sda = 1;
+			memset(sim->flash.mem, 0xFF, sizeof(sim->flash.mem));
+			memset(sim->eeprom.mem, 0xFF, sizeof(sim->eeprom.mem));
+
+			sim->jtag.taps[0].ir_len = 4;
+			sim->jtag.taps[0].idcode = 0x4BA00477;
+			sim->jtag.taps[1].ir_len = 5;
+			sim->jtag.taps[1].idcode = 0x06413041;
+			sim->jtag.tdo = 1;
+			jtag_reset(&sim->jtag);
+
+			mpsse->transport = &sim_transport;
+			mpsse->transport_data = sim;
+			mpsse->description = SIM_DESCRIPTION;
+			mpsse->ftdi.type = TYPE_2232H;
+
+			setup_mode(mpsse, SIM_VID, SIM_PID, mode, freq, endianess);
+
+			if(!mpsse->open)
+			{
+				sim_close(mpsse);
+			}
+		}
+	}
+
+	return mpsse;
+}
+
+/*
+ * Makes the next USB writes to a simulated chip fail, for testing error handling.
+ *
+ * @mpsse - MPSSE context pointer, as returned by OpenSimulator().
+ * @count - Number of writes that should fail.
+ *
+ * Returns MPSSE_OK on success.
+ * Returns MPSSE_FAIL if mpsse is not a simulated chip.
+ */
+int SimulateWriteErrors(struct mpsse_context *mpsse, int count)
+{
+	int retval = MPSSE_FAIL;
+	struct sim_chip *sim = NULL;
+
+	if(is_valid_context(mpsse) && mpsse->transport == &sim_transport)
+	{
+		sim = mpsse->transport_data;
+		sim->write_errors = count;
+		retval = MPSSE_OK;
+	}
+
+	return retval;
+}
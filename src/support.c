@@ -5,7 +5,10 @@
  * 27 December 2011
  */
 
+#include <stdlib.h>
 #include <string.h>
+#include <unistd.h>
+#include <sys/time.h>
 
 #if LIBFTDI1 == 1
 #include <libftdi1/ftdi.h>
@@ -16,16 +19,90 @@
 #include "mpsse.h"
 #include "support.h"
 
-/* Write data to the FTDI chip */
+/* libftdi implementation of the transport functions, used for real FTDI chips */
+static int libftdi_write(struct mpsse_context *mpsse, unsigned char *buf, int size)
+{
+	return ftdi_write_data(&mpsse->ftdi, buf, size);
+}
+
+static int libftdi_read(struct mpsse_context *mpsse, unsigned char *buf, int size)
+{
+	return ftdi_read_data(&mpsse->ftdi, buf, size);
+}
+
+static int libftdi_purge(struct mpsse_context *mpsse)
+{
+	return ftdi_usb_purge_buffers(&mpsse->ftdi);
+}
+
+static int libftdi_purge_rx(struct mpsse_context *mpsse)
+{
+	return ftdi_usb_purge_rx_buffer(&mpsse->ftdi);
+}
+
+static int libftdi_read_pins(struct mpsse_context *mpsse, unsigned char *pins)
+{
+	return ftdi_read_pins(&mpsse->ftdi, pins);
+}
+
+static int libftdi_set_bitmode(struct mpsse_context *mpsse, unsigned char mask, unsigned char mode)
+{
+	return ftdi_set_bitmode(&mpsse->ftdi, mask, mode);
+}
+
+static int libftdi_set_baudrate(struct mpsse_context *mpsse, int rate)
+{
+	return ftdi_set_baudrate(&mpsse->ftdi, rate);
+}
+
+static const char *libftdi_error_string(struct mpsse_context *mpsse)
+{
+	return ftdi_get_error_string(&mpsse->ftdi);
+}
+
+static void libftdi_close(struct mpsse_context *mpsse)
+{
+	ftdi_set_bitmode(&mpsse->ftdi, 0, BITMODE_RESET);
+	ftdi_usb_close(&mpsse->ftdi);
+	ftdi_deinit(&mpsse->ftdi);
+}
+
+const struct mpsse_transport libftdi_transport = {
+	libftdi_write,
+	libftdi_read,
+	libftdi_purge,
+	libftdi_purge_rx,
+	libftdi_read_pins,
+	libftdi_set_bitmode,
+	libftdi_set_baudrate,
+	libftdi_error_string,
+	libftdi_close
+};
+
+/* Write data to the FTDI chip, or queue it if a batch is in progress */
 int raw_write(struct mpsse_context *mpsse, unsigned char *buf, int size)
 {
         int retval = MPSSE_FAIL;
 
         if(mpsse->mode)
 	{
-		if(ftdi_write_data(&mpsse->ftdi, buf, size) == size)
-        	{
-                	retval = MPSSE_OK;
+		if(mpsse->batch)
+		{
+			retval = batch_append(mpsse, buf, size);
+		}
+		else
+		{
+			if(mpsse->trace)
+			{
+				mpsse->trace(mpsse, TRACE_WRITE, buf, size, usecs_now() / 1000000.0, mpsse->trace_data);
+			}
+
+			mpsse->stats.writes++;
+			if(mpsse->transport->write(mpsse, buf, size) == size)
+			{
+				mpsse->stats.bytes_out += size;
+				retval = MPSSE_OK;
+			}
 		}
         }
 
@@ -36,14 +113,50 @@ int raw_write(struct mpsse_context *mpsse, unsigned char *buf, int size)
 int raw_read(struct mpsse_context *mpsse, unsigned char *buf, int size)
 {
 	int n = 0, r = 0;
+	uint64_t start = 0, deadline = 0;
 
-	if(mpsse->mode)
+	if(mpsse->mode && mpsse->batch)
+	{
+		/* 
+		 * The commands that generate this data are still sitting in the batch queue; 
+		 * note how much data they will return and collect it when the batch is sent.
+		 */
+		mpsse->batch_pending += size;
+		n = size;
+
+		/* Don't let the chip's TX FIFO fill up while the rest of the batch is still queued; recorded commands are never sent */
+		if(mpsse->batch_pending >= fifo_size(mpsse) && !mpsse->batch_recording)
+		{
+			batch_sync(mpsse);
+		}
+	}
+	else if(mpsse->mode)
 	{
+		/* If the chip has been told to wait on GPIOL1, the data may never come; give up once the wait times out */
+		if(mpsse->wait_timeout > 0)
+		{
+			deadline = usecs_now() + ((uint64_t) mpsse->wait_timeout * 1000);
+		}
+
 		while(n < size)
 		{
-			r = ftdi_read_data(&mpsse->ftdi, buf, size);
+			start = usecs_now();
+			r = mpsse->transport->read(mpsse, buf + n, size - n);
+			record_read(mpsse, buf + n, size - n, r, start);
 			if(r < 0) break;
 			n += r;
+
+			if(deadline && n < size && usecs_now() >= deadline) break;
+		}
+
+		if(deadline)
+		{
+			mpsse->wait_timeout = 0;
+			if(n < size)
+			{
+				mpsse->wait_expired = 1;
+				cancel_wait(mpsse);
+			}
 		}
 
 		if(mpsse->flush_after_read)
@@ -51,15 +164,253 @@ int raw_read(struct mpsse_context *mpsse, unsigned char *buf, int size)
 			/* 
 			 * Make sure the buffers are cleared after a read or subsequent reads may fail.
 			 * 
-			 * Is this needed anymore? It slows down repetitive read operations by ~8%.
+			 * Is this needed anymore? It slows down repetitive read operations; run
+			 * examples/benchmark.py with and without --flush to measure by how much.
 			 */
-			ftdi_usb_purge_rx_buffer(&mpsse->ftdi);
+			mpsse->stats.purges++;
+			mpsse->transport->purge_rx(mpsse);
 		}
 	}
 
 	return n;
 }
 
+/* Purges the chip's RX and TX buffers */
+int raw_purge(struct mpsse_context *mpsse)
+{
+	mpsse->stats.purges++;
+	return mpsse->transport->purge(mpsse);
+}
+
+/* Returns the current time, in microseconds */
+uint64_t usecs_now(void)
+{
+	struct timeval tv = { 0 };
+
+	gettimeofday(&tv, NULL);
+
+	return ((uint64_t) tv.tv_sec * 1000000) + tv.tv_usec;
+}
+
+/* 
+ * Updates the read counters and calls the trace callback after a USB read of size bytes that returned n, 
+ * which was started at start microseconds.
+ */
+void record_read(struct mpsse_context *mpsse, unsigned char *buf, int size, int n, uint64_t start)
+{
+	uint64_t end = usecs_now();
+
+	mpsse->stats.reads++;
+	mpsse->stats.read_usecs += (unsigned long) (end - start);
+
+	if(n < size)
+	{
+		mpsse->stats.short_reads++;
+	}
+
+	if(n > 0)
+	{
+		mpsse->stats.bytes_in += n;
+
+		if(mpsse->trace)
+		{
+			mpsse->trace(mpsse, TRACE_READ, buf, n, end / 1000000.0, mpsse->trace_data);
+		}
+	}
+}
+
+/* Grows a heap buffer so that it can hold at least size bytes */
+int grow_buffer(unsigned char **buf, int *alloc, int size)
+{
+	int retval = MPSSE_OK, new_alloc = 0;
+	unsigned char *new_buf = NULL;
+
+	if(size > *alloc)
+	{
+		new_alloc = *alloc ? *alloc : CMD_SIZE;
+		while(new_alloc < size)
+		{
+			new_alloc *= 2;
+		}
+
+		new_buf = realloc(*buf, new_alloc);
+		if(new_buf)
+		{
+			*buf = new_buf;
+			*alloc = new_alloc;
+		}
+		else
+		{
+			retval = MPSSE_FAIL;
+		}
+	}
+
+	return retval;
+}
+
+/* 
+ * Ensures that one of the context's reusable buffers can hold at least size bytes.
+ * Buffers only ever grow, so once they reach their high water mark no further allocations are made.
+ */
+int pool_buffer(struct mpsse_context *mpsse, unsigned char **buf, int *alloc, int size)
+{
+	int retval = MPSSE_OK;
+
+	if(size > *alloc)
+	{
+		retval = grow_buffer(buf, alloc, size);
+		mpsse->allocations++;
+	}
+	else
+	{
+		mpsse->allocations_avoided++;
+	}
+
+	return retval;
+}
+
+/* Appends data to the batch command queue */
+int batch_append(struct mpsse_context *mpsse, unsigned char *buf, int size)
+{
+	int retval = MPSSE_FAIL;
+
+	if(pool_buffer(mpsse, &mpsse->batch_buf, &mpsse->batch_alloc, mpsse->batch_size + size) == MPSSE_OK)
+	{
+		memcpy(mpsse->batch_buf + mpsse->batch_size, buf, size);
+		mpsse->batch_size += size;
+		retval = MPSSE_OK;
+	}
+	else
+	{
+		mpsse->batch_status = MPSSE_FAIL;
+	}
+
+	return retval;
+}
+
+/* Sends the queued batch commands to the chip and reads back any data they produce */
+int batch_sync(struct mpsse_context *mpsse)
+{
+	int retval = MPSSE_OK, pending = 0;
+	unsigned char cmd = SEND_IMMEDIATE;
+
+	pending = mpsse->batch_pending;
+
+	if(mpsse->batch_size > 0)
+	{
+		/* Make sure the chip doesn't sit on the read data until the latency timer expires */
+		if(pending > 0)
+		{
+			retval = batch_append(mpsse, &cmd, sizeof(cmd));
+		}
+
+		if(retval == MPSSE_OK)
+		{
+			retval = pool_buffer(mpsse, &mpsse->batch_rbuf, &mpsse->batch_ralloc, mpsse->batch_rsize + pending);
+		}
+
+		if(retval == MPSSE_OK)
+		{
+			/* Temporarily leave batch mode so that raw_write/raw_read talk to the chip */
+			mpsse->batch = 0;
+
+			retval = raw_write(mpsse, mpsse->batch_buf, mpsse->batch_size);
+			if(retval == MPSSE_OK && pending > 0)
+			{
+				if(raw_read(mpsse, mpsse->batch_rbuf + mpsse->batch_rsize, pending) != pending)
+				{
+					retval = MPSSE_FAIL;
+				}
+			}
+
+			mpsse->batch = 1;
+		}
+	}
+
+	if(retval == MPSSE_OK)
+	{
+		mpsse->batch_rsize += pending;
+	}
+	else
+	{
+		mpsse->batch_status = MPSSE_FAIL;
+	}
+
+	mpsse->batch_size = 0;
+	mpsse->coalesce_end = -1;
+	mpsse->batch_pending = 0;
+
+	return retval;
+}
+
+/* Returns 1 if the chip can run from the undivided 60MHz clock (TCK_X5), 0 if it only has the 12MHz clock */
+int has_clock_x5(struct mpsse_context *mpsse)
+{
+	int retval = 0;
+
+	switch(mpsse->ftdi.type)
+	{
+		case TYPE_2232H:
+		case TYPE_4232H:
+		case TYPE_232H:
+			retval = 1;
+			break;
+		default:
+			break;
+	}
+
+	return retval;
+}
+
+/* Returns the size of the FIFO that the chip uses to buffer data being sent back to the host */
+int fifo_size(struct mpsse_context *mpsse)
+{
+	int size = 0;
+
+	switch(mpsse->ftdi.type)
+	{
+		case TYPE_2232H:
+		case TYPE_4232H:
+			size = 4096;
+			break;
+		case TYPE_232H:
+			size = 1024;
+			break;
+		default:
+			/* FT2232C/D */
+			size = 384;
+			break;
+	}
+
+	return size;
+}
+
+/* 
+ * Returns the size of each txrx block used by Transfer / FastTransfer.
+ * Blocks are never larger than the chip's FIFO, so at least one block can always be in flight.
+ */
+int transfer_block_size(struct mpsse_context *mpsse)
+{
+	int size = SPI_TRANSFER_SIZE;
+
+	if(mpsse->transfer_size > 0)
+	{
+		size = mpsse->transfer_size;
+	}
+
+	if(size > fifo_size(mpsse))
+	{
+		size = fifo_size(mpsse);
+	}
+
+	if(size > mpsse->xsize)
+	{
+		size = mpsse->xsize;
+	}
+
+	return size;
+}
+
 /* Sets the read and write timeout periods for bulk usb data transfers. */
 void set_timeouts(struct mpsse_context *mpsse, int timeout)
 {
@@ -72,19 +423,39 @@ void set_timeouts(struct mpsse_context *mpsse, int timeout)
 	return;
 }
 
-/* Convert a frequency to a clock divisor */
-uint16_t freq2div(uint32_t system_clock, uint32_t freq)
+/* Convert a frequency to the smallest clock divisor that doesn't clock faster than it, given the number of clock phases per bit */
+uint16_t freq2div(uint32_t system_clock, double freq, int phases)
 {
-	return (((system_clock / freq) / 2) - 1);
+	double cycles = 0;
+	uint32_t n = MAX_CLOCK_DIVISOR + 1;
+
+	/* Find the smallest number of system clock cycles per phase that doesn't clock faster than freq */
+	if(freq > 0)
+	{
+		cycles = system_clock / (freq * phases);
+
+		if(cycles < (MAX_CLOCK_DIVISOR + 1))
+		{
+			n = (uint32_t) cycles;
+
+			/* Allow for rounding errors when freq is exactly achievable */
+			if((n * (1 + 1e-9)) < cycles || n == 0)
+			{
+				n++;
+			}
+		}
+	}
+
+	return (uint16_t) (n - 1);
 }
 
-/* Convert a clock divisor to a frequency */
-uint32_t div2freq(uint32_t system_clock, uint16_t div)
+/* Convert a clock divisor back to a frequency, given the number of clock phases per bit */
+uint32_t div2freq(uint32_t system_clock, uint16_t div, int phases)
 {
-	return (system_clock / ((1 + div) * 2));
+	return (system_clock / ((1 + div) * phases));
 }
 
-/* Builds a buffer of commands + data blocks */
+/* Builds a buffer of commands + data blocks in the context's reusable command buffer */
 unsigned char *build_block_buffer(struct mpsse_context *mpsse, uint8_t cmd, unsigned char *data, int size, int *buf_size)
 {
 	unsigned char *buf = NULL;
@@ -112,16 +483,15 @@ unsigned char *build_block_buffer(struct mpsse_context *mpsse, uint8_t cmd, unsi
 	/* The total size of the data will be the data size + the write command */
         total_size = size + (CMD_SIZE * num_blocks);
 
-	/* In I2C we have to add 3 additional commands per data block */
+	/* In I2C we have to add 3 additional commands per data block, plus a SEND_IMMEDIATE at the end */
 	if(mpsse->mode == I2C)
 	{
-		total_size += (CMD_SIZE * 3 * num_blocks);
+		total_size += (CMD_SIZE * 3 * num_blocks) + 1;
 	}
 
-        buf = malloc(total_size);
-        if(buf)
+        if(pool_buffer(mpsse, &mpsse->cmd_buf, &mpsse->cmd_alloc, total_size) == MPSSE_OK)
         {
-                memset(buf, 0, total_size);
+		buf = mpsse->cmd_buf;
 
 		for(j=0; j<num_blocks; j++)
 		{
@@ -194,17 +564,408 @@ unsigned char *build_block_buffer(struct mpsse_context *mpsse, uint8_t cmd, unsi
 
 					buf[i++] = mpsse->rx | MPSSE_BITMODE;
 					buf[i++] = 0;
-					buf[i++] = SEND_IMMEDIATE;
 				}
 			}
 		}
 
+		/* 
+		 * In I2C mode, all of the ACK bits (or read bytes) for this buffer are read back in one go,
+		 * so only one SEND_IMMEDIATE is needed rather than one per byte.
+		 */
+		if(mpsse->mode == I2C)
+		{
+			buf[i++] = SEND_IMMEDIATE;
+		}
+
 		*buf_size = i;
 	}
 
 	return buf;
 }
 
+/* 
+ * Writes the commands to clock nbits bits to buf: one byte-clock command for the whole bytes, followed by one 
+ * bit-clock command for any remaining bits. The remaining bits are taken from the next byte of data, MSB first 
+ * (from the top of the byte) or LSB first (from the bottom of the byte), as set by cmd. 
+ * buf must have room for (CMD_SIZE * 2) bytes, plus nbits / 8 + 1 bytes of data if cmd writes data.
+ * Returns the number of bytes written to buf.
+ */
+int bitstream_commands(unsigned char *buf, uint8_t cmd, unsigned char *data, int nbits)
+{
+	int i = 0, bytes = 0, bits = 0, write = 0;
+
+	bytes = nbits / 8;
+	bits = nbits % 8;
+	write = (cmd & MPSSE_DO_WRITE) != 0;
+
+	if(bytes > 0)
+	{
+		buf[i++] = cmd;
+		buf[i++] = ((bytes - 1) & 0xFF);
+		buf[i++] = (((bytes - 1) >> 8) & 0xFF);
+
+		if(write)
+		{
+			memcpy(buf+i, data, bytes);
+			i += bytes;
+		}
+	}
+
+	if(bits > 0)
+	{
+		buf[i++] = cmd | MPSSE_BITMODE;
+		buf[i++] = bits - 1;
+
+		if(write)
+		{
+			buf[i++] = data[bytes];
+		}
+	}
+
+	return i;
+}
+
+/* Builds the commands to clock nbits bits in the context's reusable command buffer, see bitstream_commands() */
+unsigned char *build_bitstream_buffer(struct mpsse_context *mpsse, uint8_t cmd, unsigned char *data, int nbits, int *buf_size)
+{
+	unsigned char *buf = NULL;
+
+	*buf_size = 0;
+
+	if(pool_buffer(mpsse, &mpsse->cmd_buf, &mpsse->cmd_alloc, (CMD_SIZE * 2) + (nbits / 8) + 1) == MPSSE_OK)
+	{
+		buf = mpsse->cmd_buf;
+		*buf_size = bitstream_commands(buf, cmd, data, nbits);
+	}
+
+	return buf;
+}
+
+/* JTAG TAP controller state transitions, indexed by current state and TMS */
+const int tap_transitions[NUM_TAP_STATES][2] = {
+	{ TAP_IDLE,      TAP_RESET    },	/* TAP_RESET */
+	{ TAP_IDLE,      TAP_DRSELECT },	/* TAP_IDLE */
+	{ TAP_DRCAPTURE, TAP_IRSELECT },	/* TAP_DRSELECT */
+	{ TAP_DRSHIFT,   TAP_DREXIT1  },	/* TAP_DRCAPTURE */
+	{ TAP_DRSHIFT,   TAP_DREXIT1  },	/* TAP_DRSHIFT */
+	{ TAP_DRPAUSE,   TAP_DRUPDATE },	/* TAP_DREXIT1 */
+	{ TAP_DRPAUSE,   TAP_DREXIT2  },	/* TAP_DRPAUSE */
+	{ TAP_DRSHIFT,   TAP_DRUPDATE },	/* TAP_DREXIT2 */
+	{ TAP_IDLE,      TAP_DRSELECT },	/* TAP_DRUPDATE */
+	{ TAP_IRCAPTURE, TAP_RESET    },	/* TAP_IRSELECT */
+	{ TAP_IRSHIFT,   TAP_IREXIT1  },	/* TAP_IRCAPTURE */
+	{ TAP_IRSHIFT,   TAP_IREXIT1  },	/* TAP_IRSHIFT */
+	{ TAP_IRPAUSE,   TAP_IRUPDATE },	/* TAP_IREXIT1 */
+	{ TAP_IRPAUSE,   TAP_IREXIT2  },	/* TAP_IRPAUSE */
+	{ TAP_IRSHIFT,   TAP_IRUPDATE },	/* TAP_IREXIT2 */
+	{ TAP_IDLE,      TAP_DRSELECT },	/* TAP_IRUPDATE */
+};
+
+/* 
+ * Writes the commands to clock cycles clock cycles without transferring any data to buf: one CLOCK_N8_CYCLES 
+ * command for each whole group of 8 clocks, followed by one CLOCK_N_CYCLES command for any remaining clocks.
+ * cycles must not exceed MAX_SAMPLE_INTERVAL, for which buf must have room for CLOCK_CYCLES_SIZE bytes.
+ * Returns the number of bytes written to buf.
+ */
+int clock_commands(unsigned char *buf, int cycles)
+{
+	int i = 0, groups = 0;
+
+	groups = cycles / 8;
+	cycles = cycles % 8;
+
+	if(groups > 0)
+	{
+		buf[i++] = CLOCK_N8_CYCLES;
+		buf[i++] = ((groups - 1) & 0xFF);
+		buf[i++] = (((groups - 1) >> 8) & 0xFF);
+	}
+
+	if(cycles > 0)
+	{
+		buf[i++] = CLOCK_N_CYCLES;
+		buf[i++] = (cycles - 1);
+	}
+
+	return i;
+}
+
+/* 
+ * Finds the shortest sequence of TMS values that moves the TAP from state from to state to, with a breadth first 
+ * search of the state machine. The TMS values are stored in tms, which must have room for NUM_TAP_STATES values.
+ * Returns the number of TMS values.
+ */
+int tap_path(int from, int to, uint8_t *tms)
+{
+	int queue[NUM_TAP_STATES] = { 0 }, prev[NUM_TAP_STATES] = { 0 }, head = 0, tail = 0, state = 0, next = 0, bit = 0, n = 0;
+	uint8_t prev_tms[NUM_TAP_STATES] = { 0 };
+
+	for(state=0; state<NUM_TAP_STATES; state++)
+	{
+		prev[state] = -1;
+	}
+
+	prev[from] = from;
+	queue[tail++] = from;
+
+	while(head < tail && prev[to] == -1)
+	{
+		state = queue[head++];
+
+		for(bit=0; bit<2; bit++)
+		{
+			next = tap_transitions[state][bit];
+			if(prev[next] == -1)
+			{
+				prev[next] = state;
+				prev_tms[next] = bit;
+				queue[tail++] = next;
+			}
+		}
+	}
+
+	/* Count the steps back from the destination, then fill in the TMS values from the end */
+	for(state=to; state != from; state=prev[state])
+	{
+		n++;
+	}
+
+	next = n;
+	for(state=to; state != from; state=prev[state])
+	{
+		tms[--next] = prev_tms[state];
+	}
+
+	return n;
+}
+
+/*
+ * Writes the TMS commands that move the TAP from its current state to state to into buf, which must have room for 
+ * TMS_MOVE_SIZE bytes, and records the new state. If the current state is not known, the TAP is reset first.
+ * Returns the number of bytes written to buf.
+ */
+int tap_move(struct mpsse_context *mpsse, unsigned char *buf, int to)
+{
+	uint8_t tms[TAP_RESET_CLOCKS + NUM_TAP_STATES] = { 0 };
+	int i = 0, j = 0, k = 0, n = 0, bits = 0;
+
+	if(mpsse->tap_state == TAP_UNKNOWN)
+	{
+		for(n=0; n<TAP_RESET_CLOCKS; n++)
+		{
+			tms[n] = 1;
+		}
+
+		mpsse->tap_state = TAP_RESET;
+	}
+
+	n += tap_path(mpsse->tap_state, to, tms + n);
+
+	/* Each TMS command clocks up to TMS_MAX_BITS bits, LSB first; TDI is held low */
+	for(j=0; j<n; j+=bits)
+	{
+		bits = n - j;
+		if(bits > TMS_MAX_BITS)
+		{
+			bits = TMS_MAX_BITS;
+		}
+
+		buf[i++] = TMS_WRITE;
+		buf[i++] = bits - 1;
+		buf[i] = 0;
+		for(k=0; k<bits; k++)
+		{
+			buf[i] |= (tms[j+k] << k);
+		}
+		i++;
+	}
+
+	mpsse->tap_state = to;
+
+	return i;
+}
+
+/* Set the rate at which bitbang samples are clocked out; a rate of 0 leaves the current rate unchanged */
+int set_bitbang_rate(struct mpsse_context *mpsse, int rate)
+{
+	int retval = MPSSE_OK;
+
+	/* Changing the baud rate is a USB control transfer, so only do it if the rate has actually changed */
+	if(rate > 0 && rate != mpsse->bitbang_rate)
+	{
+		if(mpsse->transport->set_baudrate(mpsse, rate) == 0)
+		{
+			mpsse->bitbang_rate = rate;
+		}
+		else
+		{
+			retval = MPSSE_FAIL;
+		}
+	}
+
+	return retval;
+}
+
+/* Forgets the cached chip settings, so that SetMode() and SetClock() send all of them again the next time they are called */
+void forget_settings(struct mpsse_context *mpsse)
+{
+	mpsse->settings.loopback = -1;
+	mpsse->settings.adaptive = -1;
+	mpsse->settings.three_phase = -1;
+	mpsse->settings.clock_base = -1;
+	mpsse->settings.divisor = -1;
+}
+
+/* 
+ * Abandons a wait on GPIOL1 that the chip is stuck in. The wait can't be interrupted by another command, so the
+ * MPSSE engine is reset and the context's clock, mode and GPIO pin states are sent to the chip again.
+ */
+void cancel_wait(struct mpsse_context *mpsse)
+{
+	int gpio = 0;
+
+	/* SetMode() resets the GPIO pins, so note their current states to restore afterwards */
+	gpio = ((mpsse->pidle & (GPIO0 | GPIO1 | GPIO2 | GPIO3)) / GPIO0) | (mpsse->gpioh << NUM_GPIOL_PINS);
+
+	mpsse->transport->set_bitmode(mpsse, 0, BITMODE_RESET);
+	mpsse->transport->set_bitmode(mpsse, 0, BITMODE_MPSSE);
+	raw_purge(mpsse);
+
+	/* Nothing is known about the state of the chip after a reset */
+	forget_settings(mpsse);
+	mpsse->status = STOPPED;
+
+	if(SetClock(mpsse, mpsse->clock) == MPSSE_OK && SetMode(mpsse, mpsse->endianess) == MPSSE_OK)
+	{
+		gpio_set(mpsse, (1 << NUM_GPIO_PINS) - 1, gpio);
+	}
+}
+
+/* 
+ * Configures a newly opened chip for the requested mode. Shared by OpenIndex() and OpenSimulator().
+ * On success, mpsse->open will be set to 1.
+ */
+void setup_mode(struct mpsse_context *mpsse, int vid, int pid, enum modes mode, int freq, int endianess)
+{
+	mpsse->mode = mode;
+	mpsse->vid = vid;
+	mpsse->pid = pid;
+	mpsse->status = STOPPED;
+	mpsse->endianess = endianess;
+
+	/* Set the appropriate transfer size for the requested protocol */
+	if(mpsse->mode == I2C)
+	{
+		mpsse->xsize = I2C_TRANSFER_SIZE;
+	}
+	else
+	{
+		mpsse->xsize = SPI_RW_SIZE;
+	}
+
+	/* Nothing is known about the state of a newly opened chip */
+	forget_settings(mpsse);
+
+	if(mpsse->mode != BITBANG)
+	{
+		mpsse->transport->set_bitmode(mpsse, 0, BITMODE_MPSSE);
+
+		if(SetClock(mpsse, freq) == MPSSE_OK)
+		{
+			if(SetMode(mpsse, endianess) == MPSSE_OK)
+			{
+				mpsse->open = 1;
+			}
+		}
+	}
+	else
+	{
+		/* Skip the setup functions if we're just operating in BITBANG mode */
+		if(mpsse->transport->set_bitmode(mpsse, 0xFF, BITMODE_BITBANG) == 0)
+		{
+			mpsse->bitbang_dir = 0xFF;
+			mpsse->open = 1;
+		}
+	}
+}
+
+/* 
+ * Checks whether the chip is already in MPSSE mode, in which case it answers an invalid command 
+ * with a bad command response. Used to avoid resetting a chip that is already set up.
+ */
+int mpsse_active(struct mpsse_context *mpsse)
+{
+	unsigned char cmd = INVALID_COMMAND, rbuf[2] = { 0 };
+	int n = 0, r = 0, i = 0;
+
+	mpsse->transport->purge(mpsse);
+
+	if(mpsse->transport->write(mpsse, &cmd, sizeof(cmd)) == sizeof(cmd))
+	{
+		for(i=0; i<PROBE_TRIES && n<(int) sizeof(rbuf); i++)
+		{
+			r = mpsse->transport->read(mpsse, rbuf + n, sizeof(rbuf) - n);
+			if(r < 0) break;
+			n += r;
+		}
+	}
+
+	return (n == sizeof(rbuf) && rbuf[0] == BAD_COMMAND_RESPONSE && rbuf[1] == INVALID_COMMAND);
+}
+
+/* 
+ * Initializes a newly opened chip and puts it into the requested mode. 
+ * If reuse is set and the chip is already in MPSSE mode, the USB reset and the setup delay are skipped.
+ */
+void init_device(struct mpsse_context *mpsse, int vid, int pid, enum modes mode, int freq, int endianess, int reuse)
+{
+	int status = 0, active = 0;
+
+	if(reuse && mode != BITBANG)
+	{
+		/* Keep the latency low so that the probe doesn't wait long for a chip that isn't going to answer */
+		status |= ftdi_set_latency_timer(&mpsse->ftdi, LATENCY_MS);
+		active = mpsse_active(mpsse);
+	}
+
+	if(!active)
+	{
+		status |= ftdi_usb_reset(&mpsse->ftdi);
+	}
+
+	status |= ftdi_set_latency_timer(&mpsse->ftdi, LATENCY_MS);
+	status |= ftdi_write_data_set_chunksize(&mpsse->ftdi, CHUNK_SIZE);
+	status |= ftdi_read_data_set_chunksize(&mpsse->ftdi, CHUNK_SIZE);
+
+	if(!active)
+	{
+		status |= ftdi_set_bitmode(&mpsse->ftdi, 0, BITMODE_RESET);
+	}
+
+	if(status == 0)
+	{
+		/* Set the read and write timeout periods */
+		set_timeouts(mpsse, USB_TIMEOUT);
+
+		setup_mode(mpsse, vid, pid, mode, freq, endianess);
+
+		if(mpsse->open && mpsse->mode != BITBANG)
+		{
+			/* Give the chip a few mS to initialize */
+			if(!active)
+			{
+				usleep(SETUP_DELAY);
+			}
+
+			/* 
+			 * Not all FTDI chips support all the commands that SetMode may have sent.
+			 * This clears out any errors from unsupported commands that might have been sent during set up. 
+			 */
+			raw_purge(mpsse);
+		}
+	}
+}
+
 /* Set the low bit pins high/low */
 int set_bits_low(struct mpsse_context *mpsse, int port)
 {
@@ -229,65 +990,130 @@ int set_bits_high(struct mpsse_context *mpsse, int port)
 	return raw_write(mpsse, (unsigned char *) &buf, sizeof(buf));
 }
 
-/* Set the GPIO pins high/low */
-int gpio_write(struct mpsse_context *mpsse, int pin, int direction)
+/* Queue a SET_BITS_LOW / SET_BITS_HIGH command in a batch, merging it with the same command earlier in a run of consecutive GPIO writes */
+static int coalesce_bits(struct mpsse_context *mpsse, unsigned char *cmd)
 {
-	int retval = MPSSE_FAIL;
+	int retval = MPSSE_OK;
+	int *offset = NULL;
+
+	/* Anything queued since the last GPIO write ends the run */
+	if(mpsse->batch_size != mpsse->coalesce_end)
+	{
+		mpsse->coalesce_low = -1;
+		mpsse->coalesce_high = -1;
+	}
+
+	if(cmd[0] == SET_BITS_LOW)
+	{
+		offset = &mpsse->coalesce_low;
+	}
+	else
+	{
+		offset = &mpsse->coalesce_high;
+	}
+
+	if(*offset >= 0)
+	{
+		memcpy(mpsse->batch_buf + *offset, cmd, CMD_SIZE);
+	}
+	else
+	{
+		*offset = mpsse->batch_size;
+		retval = raw_write(mpsse, cmd, CMD_SIZE);
+	}
+
+	mpsse->coalesce_end = mpsse->batch_size;
+
+	return retval;
+}
+
+/* Set the GPIO pins in mask to the corresponding bits in values, using at most one SET_BITS_LOW and one SET_BITS_HIGH command */
+int gpio_set(struct mpsse_context *mpsse, int mask, int values)
+{
+	unsigned char buf[CMD_SIZE * 2] = { 0 };
+	int retval = MPSSE_FAIL, i = 0;
+	uint8_t lmask = 0, hmask = 0, low = 0;
 
 	if(mpsse->mode == BITBANG)
 	{
-		if(direction == HIGH)
-		{
-			mpsse->bitbang |= (1 << pin);
-		}
-		else 
+		if((mask & ~0xFF) == 0)
 		{
-			mpsse->bitbang &= ~(1 << pin);
-		}
-		
-		if(set_bits_high(mpsse, mpsse->bitbang) == MPSSE_OK)
-		{
-                	retval = raw_write(mpsse, (unsigned char *) &mpsse->bitbang, 1);
+			mpsse->bitbang = (mpsse->bitbang & ~mask) | (values & mask);
+			retval = raw_write(mpsse, &mpsse->bitbang, 1);
 		}
 	}
-	else
+	else if((mask & ~((1 << NUM_GPIO_PINS) - 1)) == 0)
 	{
+		/* Convert pin numbers 0 - 3 to the corresponding GPIOL bits, and pin numbers 4 - 11 to GPIOH bits */
+		lmask = (uint8_t) ((mask & 0x0F) * GPIO0);
+		low = (uint8_t) ((values & 0x0F) * GPIO0);
+		hmask = (uint8_t) (mask >> NUM_GPIOL_PINS);
+
 		/* The first four pins can't be changed unless we are in a stopped status */
-		if(pin < NUM_GPIOL_PINS && mpsse->status == STOPPED)
+		if(lmask && mpsse->status != STOPPED)
 		{
-			/* Convert pin number (0-3) to the corresponding pin bit */
-			pin = (GPIO0 << pin);
+			return MPSSE_FAIL;
+		}
 
-	        	if(direction == HIGH)
-	        	{
-	        	        mpsse->pstart |= pin;
-	        	        mpsse->pidle |= pin;
-	        	        mpsse->pstop |= pin;
-	        	}
-	        	else
-	        	{
-	        	        mpsse->pstart &= ~pin;
-	        	        mpsse->pidle &= ~pin;
-	        	        mpsse->pstop &= ~pin;
-	        	}
+		if(lmask)
+		{
+			mpsse->pstart = (mpsse->pstart & ~lmask) | (low & lmask);
+			mpsse->pidle = (mpsse->pidle & ~lmask) | (low & lmask);
+			mpsse->pstop = (mpsse->pstop & ~lmask) | (low & lmask);
 
-			retval = set_bits_low(mpsse, mpsse->pstart);
+			buf[i++] = SET_BITS_LOW;
+			buf[i++] = mpsse->pstart;
+			buf[i++] = mpsse->tris;
 		}
-		else if(pin >= NUM_GPIOL_PINS && pin < NUM_GPIO_PINS)
+
+		if(hmask)
 		{
-			/* Convert pin number (4 - 11) to the corresponding pin bit */
-			pin -= NUM_GPIOL_PINS;
+			mpsse->gpioh = (mpsse->gpioh & ~hmask) | ((values >> NUM_GPIOL_PINS) & hmask);
 
-			if(direction == HIGH)
+			buf[i++] = SET_BITS_HIGH;
+			buf[i++] = mpsse->gpioh;
+			buf[i++] = mpsse->trish;
+		}
+
+		if(mpsse->batch && mpsse->coalesce)
+		{
+			retval = MPSSE_OK;
+			if(lmask)
 			{
-				mpsse->gpioh |= (1 << pin);
+				retval |= coalesce_bits(mpsse, buf);
 			}
-			else
+			if(hmask)
 			{
-				mpsse->gpioh &= ~(1 << pin);
+				retval |= coalesce_bits(mpsse, buf + i - CMD_SIZE);
 			}
-	
-			retval = set_bits_high(mpsse, mpsse->gpioh);	
+		}
+		else if(i > 0)
+		{
+			retval = raw_write(mpsse, buf, i);
+		}
+		else
+		{
+			retval = MPSSE_OK;
+		}
+	}
+
+	return retval;
+}
+
+/* Set a GPIO pin high/low */
+int gpio_write(struct mpsse_context *mpsse, int pin, int direction)
+{
+	int retval = MPSSE_FAIL;
+
+	if(pin >= 0 && pin < NUM_GPIO_PINS)
+	{
+		if(direction == HIGH)
+		{
+			retval = gpio_set(mpsse, (1 << pin), (1 << pin));
+		}
+		else
+		{
+			retval = gpio_set(mpsse, (1 << pin), 0);
 		}
 	}
 
@@ -3,14 +3,39 @@
 
 #include "mpsse.h"
 
+extern const struct mpsse_transport libftdi_transport;
+extern const int tap_transitions[NUM_TAP_STATES][2];
+
 int raw_write(struct mpsse_context *mpsse, unsigned char *buf, int size);
 int raw_read(struct mpsse_context *mpsse, unsigned char *buf, int size);
+int raw_purge(struct mpsse_context *mpsse);
+uint64_t usecs_now(void);
+void record_read(struct mpsse_context *mpsse, unsigned char *buf, int size, int n, uint64_t start);
+int grow_buffer(unsigned char **buf, int *alloc, int size);
+int pool_buffer(struct mpsse_context *mpsse, unsigned char **buf, int *alloc, int size);
+int batch_append(struct mpsse_context *mpsse, unsigned char *buf, int size);
+int batch_sync(struct mpsse_context *mpsse);
+int fifo_size(struct mpsse_context *mpsse);
+int transfer_block_size(struct mpsse_context *mpsse);
 void set_timeouts(struct mpsse_context *mpsse, int timeout);
-uint16_t freq2div(uint32_t system_clock, uint32_t freq);
-uint32_t div2freq(uint32_t system_clock, uint16_t div);
+uint16_t freq2div(uint32_t system_clock, double freq, int phases);
+uint32_t div2freq(uint32_t system_clock, uint16_t div, int phases);
+int has_clock_x5(struct mpsse_context *mpsse);
 unsigned char *build_block_buffer(struct mpsse_context *mpsse, uint8_t cmd, unsigned char *data, int size, int *buf_size);
+int bitstream_commands(unsigned char *buf, uint8_t cmd, unsigned char *data, int nbits);
+unsigned char *build_bitstream_buffer(struct mpsse_context *mpsse, uint8_t cmd, unsigned char *data, int nbits, int *buf_size);
+int clock_commands(unsigned char *buf, int cycles);
+int tap_path(int from, int to, uint8_t *tms);
+int tap_move(struct mpsse_context *mpsse, unsigned char *buf, int to);
+int mpsse_active(struct mpsse_context *mpsse);
+void init_device(struct mpsse_context *mpsse, int vid, int pid, enum modes mode, int freq, int endianess, int reuse);
+void forget_settings(struct mpsse_context *mpsse);
+void cancel_wait(struct mpsse_context *mpsse);
+void setup_mode(struct mpsse_context *mpsse, int vid, int pid, enum modes mode, int freq, int endianess);
 int set_bits_high(struct mpsse_context *mpsse, int port);
 int set_bits_low(struct mpsse_context *mpsse, int port);
+int set_bitbang_rate(struct mpsse_context *mpsse, int rate);
+int gpio_set(struct mpsse_context *mpsse, int mask, int values);
 int gpio_write(struct mpsse_context *mpsse, int pin, int direction);
 int is_valid_context(struct mpsse_context *mpsse);
 